@@ -1,8 +1,9 @@
-import json
-
 from dsl_grade_db import MongoDBStudentGrade
+from dsl_grade_db.session_exporter import export_students_project_session
 
-STUDENTS_ID_CORRECT_SAVE_FILE = "students_id_to_correct.json"
+STUDENTS_FINAL_GRADE_SAVE_FILE = "students_final_grade.ndjson"
+# "ndjson" (one student per line) or "csv"
+FILE_FORMAT = "ndjson"
 
 
 def main():
@@ -10,10 +11,9 @@ def main():
     # all the students tha satisfy the following conditions:
     # 1. have participated in the last project (the project is associated with the last leaderboard ingested)
     # 2. The project contains both leaderboard and report grades
-    data = student_db.get_students_project_session()
-
-    with open(STUDENTS_ID_CORRECT_SAVE_FILE, 'w') as json_file:
-        json.dump(data, json_file, indent=2)
+    # the students are written one by one while they are read from the database
+    export_students_project_session(student_db, STUDENTS_FINAL_GRADE_SAVE_FILE,
+                                    file_format=FILE_FORMAT)
 
 
 if __name__ == "__main__":
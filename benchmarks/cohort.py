@@ -0,0 +1,153 @@
+"""
+Seeded generator of the csv files of synthetic grading sessions, in the formats read by
+the ingestors: enrolled students, written exams (Moodle export), teams, leaderboard and
+report grades. The same seed, size and number of sessions give the same files.
+"""
+from __future__ import annotations
+
+import os
+import random
+
+import pandas as pd
+
+from dsl_grade_db.data_ingestor.mongo_db_written_grade import ITALIAN_MONTHS
+
+# the question columns of the Moodle export, with their maximum points
+QUESTIONS = ['D. 1 /0,00', 'D. 2 /1,50', 'D. 3 /1,50', 'D. 4 /1,50', 'D. 5 /1,50',
+             'D. 6 /2,50', 'D. 7 /1,50', 'D. 8 /1,50', 'D. 9 /1,50', 'D. 10 /1,50',
+             'D. 11 /1,50', 'D. 12 /2,00', 'D. 13 /2,00']
+MONTH_NAMES = {number: name for name, number in ITALIAN_MONTHS.items()}
+# the first student ID of the cohort
+FIRST_STUDENT_ID = 300000
+# the written exams of a year are in these months, the projects are due in the next one
+SESSION_MONTHS = [1, 6, 9]
+
+
+def _comma(value: float) -> str:
+    """From 12.88 to "12,88", as in the Moodle export"""
+    return f"{value:.2f}".replace(".", ",")
+
+
+def session_dates(session: int) -> tuple[tuple[int, int, int], tuple[int, int, int]]:
+    """The (day, month, year) of the written exam and of the project of the session"""
+    year = 2023 + session // len(SESSION_MONTHS)
+    month = SESSION_MONTHS[session % len(SESSION_MONTHS)]
+    return (8, month, year), (1, month + 1, year)
+
+
+class CohortGenerator:
+    """
+    Generate the files of `sessions` grading sessions of a cohort of `students`.
+    In each session a part of the students takes the written exam, a part works on the
+    project in teams of two (or alone), submits to the leaderboard and gets a report grade.
+    """
+
+    def __init__(self, students: int, sessions: int = 1, seed: int = 42,
+                 written_rate: float = 0.7, project_rate: float = 0.6):
+        self.students = students
+        self.sessions = sessions
+        self.written_rate = written_rate
+        self.project_rate = project_rate
+        self.random = random.Random(seed)
+        self.student_ids = list(range(FIRST_STUDENT_ID, FIRST_STUDENT_ID + students))
+
+    def write(self, directory: str) -> list[dict]:
+        """
+        Write the files of all the sessions in the directory.
+
+        Returns:
+            list[dict]: for each session the paths of its files (enrolled, written, teams,
+            leaderboard, report) and the number of rows of each file
+        """
+        os.makedirs(directory, exist_ok=True)
+        enrolled_path = os.path.join(directory, "enrolled.csv")
+        self.enrolled().to_csv(enrolled_path, index=False)
+        sessions = []
+        for session in range(self.sessions):
+            files = {"enrolled": enrolled_path}
+            rows = {"enrolled": self.students}
+            for name, df in self.session(session).items():
+                files[name] = os.path.join(directory, f"{name}_{session:02d}.csv")
+                df.to_csv(files[name], index=False)
+                rows[name] = len(df)
+            sessions.append({"files": files, "rows": rows})
+        return sessions
+
+    def enrolled(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            "MATRICOLA": self.student_ids,
+            "NOME": [f"Name{student_id}" for student_id in self.student_ids],
+            "COGNOME - (*) Inserito dal docente": [f"Surname{student_id}"
+                                                   for student_id in self.student_ids],
+        })
+
+    def session(self, session: int) -> dict[str, pd.DataFrame]:
+        """The written, teams, leaderboard and report files of the session"""
+        written_date, project_date = session_dates(session)
+        written = self.written(written_date)
+        participants = self.random.sample(self.student_ids,
+                                          int(self.students * self.project_rate))
+        teams = self.teams(participants, project_date)
+        return {"written": written,
+                "teams": teams,
+                "leaderboard": self.leaderboard(participants),
+                "report": self.report(participants)}
+
+    def written(self, date: tuple[int, int, int]) -> pd.DataFrame:
+        day, month, year = date
+        started = f"{day} {MONTH_NAMES[month]} {year}  09:40"
+        rows = []
+        for student_id in self.student_ids:
+            if self.random.random() > self.written_rate:
+                continue
+            answers = {question: "-" if self.random.random() < 0.05 else
+                       _comma(self.random.uniform(-0.25, float(question.split("/")[1]
+                                                               .replace(",", "."))))
+                       for question in QUESTIONS}
+            rows.append({
+                "Corso": "corso00 - 01TWZSM",
+                "Username": f"01twzsm0_it_23_p1070_s{student_id}",
+                "Nome": f"Name{student_id}",
+                "Cognome": f"Surname{student_id}",
+                "Stato": "Completato",
+                "Iniziato": started,
+                "Completato": started,
+                "Tempo impiegato": "1 ora 30 min.",
+                "Email PDF": started,
+                "Valutazione/20,00": _comma(self.random.uniform(5, 20)),
+                **answers,
+            })
+        return pd.DataFrame(rows, columns=["Corso", "Username", "Nome", "Cognome", "Stato",
+                                           "Iniziato", "Completato", "Tempo impiegato",
+                                           "Email PDF", "Valutazione/20,00", *QUESTIONS])
+
+    def teams(self, participants: list[int], date: tuple[int, int, int]) -> pd.DataFrame:
+        """Teams of two, 10% of the participants work alone and are not in the file"""
+        day, month, year = date
+        in_teams = participants[:int(len(participants) * 0.9)]
+        rows = []
+        for index in range(0, len(in_teams), 2):
+            rows.append({"Timestamp": f"{day}/{month}/{year} 22:17:06",
+                         "Student ID # 1": in_teams[index],
+                         "Student ID # 2": in_teams[index + 1]
+                         if index + 1 < len(in_teams) else ""})
+        return pd.DataFrame(rows, columns=["Timestamp", "Student ID # 1", "Student ID # 2"])
+
+    def leaderboard(self, participants: list[int]) -> pd.DataFrame:
+        """From zero to three submissions for each participant"""
+        rows = []
+        for student_id in participants:
+            for _ in range(self.random.choice([0, 1, 1, 2, 3])):
+                score = self.random.random()
+                rows.append({"matricola": student_id, "score": round(score, 3),
+                             "points": round(score * 10, 2),
+                             "rounded_points": round(score * 10)})
+        return pd.DataFrame(rows, columns=["matricola", "score", "points", "rounded_points"])
+
+    def report(self, participants: list[int]) -> pd.DataFrame:
+        """The report grade of 80% of the participants"""
+        rows = [{"Matricola": student_id,
+                 "Final score": self.random.randint(0, 12),
+                 "Note": "MFCC/ZCR/RMS + PCA + SVM/RF/KNN"}
+                for student_id in participants if self.random.random() < 0.8]
+        return pd.DataFrame(rows, columns=["Matricola", "Final score", "Note"])
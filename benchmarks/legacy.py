@@ -0,0 +1,76 @@
+"""
+The per-document ingestion of the baseline, before the bulk and parallel methods, as
+the reference of the "legacy" mode of the benchmarks: the rows go through the staging
+collections, and each row reads its student and writes back the whole array of grades.
+The grades are built with the helpers of the ingestors, hence the documents are the
+same as the ones written by the other modes.
+"""
+from __future__ import annotations
+
+import pandas as pd
+
+from dsl_grade_db.data_ingestor import MongoDBReportGrade, MongoDBTeamsGrade, \
+    MongoDBWrittenGrade
+
+
+def consume_written(ingestor: MongoDBWrittenGrade):
+    ingestor._insert_in_collections(ingestor.written_coll, ingestor.written_df)
+    for written_doc in ingestor.written_coll.find():
+        student_id = written_doc['student_id']
+        written_grades = ingestor.student_coll.get_student(student_id)['written_grades']
+        # the written grades are recognized by the date (only one written grade per date)
+        if written_doc['date'] not in [written['date'] for written in written_grades]:
+            written_grades.append(ingestor._new_written_grade(written_doc))
+        ingestor.student_coll.update_student_written_grade(student_id, written_grades)
+    ingestor.written_coll.drop()
+
+
+def consume_teams(ingestor: MongoDBTeamsGrade):
+    ingestor._parse_df_and_insert(pd.read_csv(ingestor.leaderboard_csv_file_path),
+                                  ingestor.leaderboard_coll)
+    ingestor._parse_df_and_insert(pd.read_csv(ingestor.teams_csv_file_path),
+                                  ingestor.teams_coll)
+    # one search of the team for each leaderboard submission, without index
+    for lead_doc in ingestor.leaderboard_coll.find():
+        team = ingestor.teams_coll.find_one({"$or": [
+            {"Student ID # 1": lead_doc["matricola"]},
+            {"Student ID # 2": lead_doc["matricola"]}]})
+        if not team:
+            ingestor.insert_in_teams(lead_doc)
+        else:
+            ingestor.update_team_max_lead_grade(team["_id"], lead_doc)
+    ingestor.leaderboard_coll.drop()
+    for team in ingestor.teams_coll.find():
+        for member in ['Student ID # 1', 'Student ID # 2']:
+            student_id = ingestor._to_student_id(team[member])
+            if student_id is not None:
+                _update_project_grade(ingestor, student_id, ingestor._new_project_grade(team),
+                                      'leaderboard_grade', team['max_lead_grade'] >= 0)
+    ingestor.teams_coll.drop()
+
+
+def consume_report(ingestor: MongoDBReportGrade):
+    ingestor._read_and_insert(pd.read_csv(ingestor.report_csv_file_path),
+                              ingestor.report_coll)
+    for report in ingestor.report_coll.find():
+        _update_project_grade(ingestor, str(report['Matricola']),
+                              ingestor._new_project_grade(report), 'report_grade')
+    ingestor.report_coll.drop()
+
+
+def _update_project_grade(ingestor, student_id: str, project_grade: dict, grade_field: str,
+                          patch: bool = True):
+    """Read the project grades of the student, add the grade to the element of the
+    project (only if it has no such grade) or append the element, and write them back"""
+    project_grades = ingestor.student_coll.get_student(student_id)['project_grades']
+    for project in project_grades:
+        if project['project_id'] == project_grade['project_id']:
+            if patch and grade_field not in project:
+                # the grade and its csv row
+                project.update({field: value for field, value in project_grade.items()
+                                if field not in ('project_id', 'date_key', 'final_grade')})
+                project['final_grade'] += project_grade[grade_field]
+            break
+    else:
+        project_grades.append(project_grade)
+    ingestor.student_coll.update_student_project_grade(student_id, project_grades)
@@ -0,0 +1,242 @@
+"""
+Time the ingestors and the queries of MongoDBStudentGrade on synthetic cohorts
+(see cohort.py) and save the results as JSON, to compare them between commits:
+
+    python -m benchmarks.run_benchmarks --sizes 100 1000 10000 --sessions 3
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+
+from dsl_grade_db import MongoDBConnection, MongoDBStudentGrade
+from dsl_grade_db.data_ingestor import MongoDBEnrolledStudent, MongoDBReportGrade, \
+    MongoDBTeamsGrade, MongoDBWrittenGrade, ParallelIngestion
+from dsl_grade_db.instrumentation import CommandInstrumentation
+from dsl_grade_db.mongo_db_connection import BACKENDS, default_backend
+
+from . import legacy
+from .cohort import CohortGenerator
+
+SIZES = [100, 1000, 10_000, 100_000]
+# the ingestion methods of each mode, or the functions of the ingestor for the
+# per-document path of the baseline (see legacy.py)
+MODES = {
+    "legacy": {"enrolled": "consume_file", "written": legacy.consume_written,
+               "teams": legacy.consume_teams, "report": legacy.consume_report},
+    "bulk": {"enrolled": "consume_file_bulk", "written": "consume_documents_bulk",
+             "teams": "consume_documents_in_teams_bulk", "report": "consume_documents_bulk"},
+    "parallel": {"enrolled": "consume_file_parallel", "written": "consume_documents_parallel",
+                 "teams": "consume_documents_in_teams_parallel",
+                 "report": "consume_documents_parallel"},
+}
+THRESHOLD = 15
+# the students of the per-student queries
+SAMPLE_SIZE = 100
+
+
+class Timer:
+    """Accumulate the seconds and the round trips of each operation"""
+
+    def __init__(self, instrumentation: CommandInstrumentation):
+        self.instrumentation = instrumentation
+        self.timings: dict[str, dict] = {}
+
+    def measure(self, operation: str, function, *args, **kwargs):
+        start = time.perf_counter()
+        with self.instrumentation.measure() as measurement:
+            result = function(*args, **kwargs)
+        timing = self.timings.setdefault(operation, {"seconds": 0.0, "round_trips": 0,
+                                                     "calls": 0})
+        timing["seconds"] += time.perf_counter() - start
+        timing["round_trips"] += measurement.round_trips()
+        timing["calls"] += 1
+        return result
+
+
+def benchmark_cohort(students: int, sessions: int = 1, mode: str = "bulk", seed: int = 42,
+                     host: str | None = None, workers: int = 4, chunk_size: int = 1000,
+                     directory: str | None = None, backend: str | None = None) -> dict:
+    """
+    Ingest the sessions of a synthetic cohort in a new database, then run the queries.
+    The database is dropped at the end.
+
+    Returns:
+        dict: the size of the cohort, the rows of the files and, for each operation,
+        the total seconds, round trips and calls
+    """
+    instrumentation = CommandInstrumentation()
+    connection = MongoDBConnection(host, backend, event_listeners=[instrumentation])
+    database_name = f"DSL_grade_bench_{students}"
+    connection.client.drop_database(database_name)
+    timer = Timer(instrumentation)
+    methods = MODES[mode]
+    ingestion = ParallelIngestion(workers, chunk_size) if mode == "parallel" else None
+    student_db = MongoDBStudentGrade(database_name=database_name, connection=connection)
+    with tempfile.TemporaryDirectory() as temporary_directory:
+        generated = CohortGenerator(students, sessions, seed).write(
+            directory or temporary_directory)
+        rows = {}
+        for index, session in enumerate(generated):
+            files = session["files"]
+            for name, count in session["rows"].items():
+                # the students are enrolled once, with the first session
+                if name != "enrolled" or index == 0:
+                    rows[name] = rows.get(name, 0) + count
+            ingestors = {
+                "enrolled": lambda: MongoDBEnrolledStudent(files["enrolled"], database_name,
+                                                           connection),
+                "written": lambda: MongoDBWrittenGrade(database_name, files["written"],
+                                                       connection),
+                "teams": lambda: MongoDBTeamsGrade(database_name, files["leaderboard"],
+                                                   files["teams"], connection),
+                "report": lambda: MongoDBReportGrade(database_name, files["report"],
+                                                     connection),
+            }
+            for name in ["enrolled", "written", "teams"] if index == 0 \
+                    else ["written", "teams"]:
+                _ingest(timer, name, ingestors[name], methods[name], student_db, ingestion)
+            timer.measure("get_student_id_to_correct", student_db.get_student_id_to_correct,
+                          THRESHOLD)
+            _ingest(timer, "report", ingestors["report"], methods["report"], student_db,
+                    ingestion)
+            timer.measure("get_students_project_session",
+                          student_db.get_students_project_session)
+    sample = random.Random(seed).sample([str(student_id) for student_id
+                                         in CohortGenerator(students).student_ids],
+                                        min(students, SAMPLE_SIZE))
+    for student_id in sample:
+        timer.measure("get_final_grade_given", student_db.get_final_grade_given, student_id)
+    timer.measure("update_students_have_rejected",
+                  student_db.update_students_have_rejected, sample)
+    connection.client.drop_database(database_name)
+    connection.close()
+    return {"students": students, "sessions": sessions, "mode": mode, "rows": rows,
+            "timings": timer.timings}
+
+
+def _ingest(timer: Timer, name: str, create_ingestor, method: str | Callable,
+            student_db: MongoDBStudentGrade, ingestion: ParallelIngestion | None):
+    """Time the creation of the ingestor (which may read the csv file) and the ingestion.
+    The ingestors use the student database of the benchmark, as the session pipeline"""
+
+    def ingest():
+        ingestor = create_ingestor()
+        if isinstance(ingestor, MongoDBEnrolledStudent):
+            ingestor.mongo_db_student_id = student_db.db_id
+            ingestor.mongo_db_student_grade = student_db
+        else:
+            ingestor.student_coll = student_db
+        if callable(method):
+            return method(ingestor)
+        if ingestion is not None:
+            return getattr(ingestor, method)(ingestion)
+        return getattr(ingestor, method)()
+
+    return timer.measure(name, ingest)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list[int], sessions: int = 1, mode: str = "bulk", seed: int = 42,
+        host: str | None = None, workers: int = 4, chunk_size: int = 1000,
+        backend: str | None = None) -> dict:
+    return {
+        "commit": _git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "seed": seed,
+        "backend": backend or default_backend(),
+        "results": [benchmark_cohort(students, sessions, mode, seed, host, workers,
+                                     chunk_size, backend=backend)
+                    for students in sizes],
+    }
+
+
+def compare(old: dict, new: dict) -> list[dict]:
+    """The ratio new / old of the seconds and of the round trips of each operation,
+    for the cohorts of the same size, sessions and mode"""
+    old_results = {(result["students"], result["sessions"], result["mode"]): result
+                   for result in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        old_result = old_results.get((result["students"], result["sessions"],
+                                      result["mode"]))
+        if old_result is None:
+            continue
+        for operation, timing in result["timings"].items():
+            old_timing = old_result["timings"].get(operation)
+            if old_timing is None:
+                continue
+            comparison.append({
+                "students": result["students"], "operation": operation,
+                "seconds": timing["seconds"] / old_timing["seconds"]
+                if old_timing["seconds"] else None,
+                "round_trips": timing["round_trips"] / old_timing["round_trips"]
+                if old_timing["round_trips"] else None,
+            })
+    return comparison
+
+
+def _format_ratio(ratio: float | None) -> str:
+    return "-" if ratio is None else f"{ratio:.2f}x"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ingestors and the queries")
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--sessions", type=int, default=1)
+    parser.add_argument("--mode", choices=list(MODES), default="bulk")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="the storage backend (default: DSL_GRADE_DB_BACKEND or mongodb)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--output", default=None,
+                        help="the JSON file of the results (benchmarks/results/<date>.json)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"),
+                        help="compare two result files instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as old_file, open(args.compare[1]) as new_file:
+            comparison = compare(json.load(old_file), json.load(new_file))
+        print(f"{'students':>9}  {'operation':<32}{'seconds':>9}{'round trips':>13}")
+        for row in comparison:
+            print(f"{row['students']:>9}  {row['operation']:<32}"
+                  f"{_format_ratio(row['seconds']):>9}{_format_ratio(row['round_trips']):>13}")
+        return
+
+    results = run(args.sizes, args.sessions, args.mode, args.seed, args.host, args.workers,
+                  args.chunk_size, args.backend)
+    output = args.output or os.path.join(
+        os.path.dirname(__file__), "results",
+        f"{datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')}_{args.mode}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    for result in results["results"]:
+        for operation, timing in result["timings"].items():
+            print(f"{result['students']:>9}  {operation:<32}{timing['seconds']:>9.3f}s"
+                  f"{timing['round_trips']:>9} round trips")
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,10 @@
+from .async_dsl_student_id_database import AsyncMongoDBStudentId
+from .async_mongo_db_student_grade import AsyncMongoDBStudentGrade
 from .dsl_student_id_database import MongoDBStudentId
+from .mongo_db_connection import MongoDBConnection, get_connection
+from .mongo_db_indexes import ensure_indexes
 from .mongo_db_student_grade import MongoDBStudentGrade
 
-__all__ = ['MongoDBStudentId', 'MongoDBStudentGrade']
\ No newline at end of file
+__all__ = ['MongoDBStudentId', 'MongoDBStudentGrade', 'MongoDBConnection',
+           'get_connection', 'ensure_indexes', 'AsyncMongoDBStudentId',
+           'AsyncMongoDBStudentGrade']
\ No newline at end of file
@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+from typing import Iterable
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .dsl_student_id_database import _chunks, get_student_id_cache
+from .mongo_db_connection import MongoDBConnection, get_connection
+
+
+class AsyncMongoDBStudentId:
+    """
+    asyncio version of MongoDBStudentId, on the AsyncIOMotorClient of the connection:
+    the same methods, as coroutines, with the same cache (shared with the
+    MongoDBStudentId of the same connection and database).
+    """
+
+    def __init__(self, database_name="DSL_grade_dbs",
+                 connection: MongoDBConnection | None = None,
+                 cache_size: int = 100_000):
+        self.connection = connection or get_connection()
+        self.client = self.connection.async_client
+        self.db = self.client[database_name]
+        self.collection = self.db["enrolled_students"]
+        self.cache = get_student_id_cache(self.connection, database_name, cache_size)
+
+    @property
+    def cache_size(self) -> int:
+        return self.cache.cache_size
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    async def warm_cache(self) -> int:
+        """See MongoDBStudentId.warm_cache"""
+        documents = self.collection.find({"MATRICOLA": {"$exists": True}},
+                                         {"MATRICOLA": 1}).limit(self.cache_size)
+        async for document in documents:
+            self.cache.put(document["MATRICOLA"], document["_id"])
+        return len(self.cache)
+
+    async def add_student_id(self, document: dict):
+        """See MongoDBStudentId.add_student_id"""
+        document["MATRICOLA"] = str(document["MATRICOLA"])
+        student_id = document['MATRICOLA']
+        if not await self.collection.find_one({"MATRICOLA": student_id}):
+            result = await self.collection.insert_one(document)
+            self.cache.put(student_id, result.inserted_id)
+
+    async def add_student_ids(self, documents: list[dict]) -> int:
+        """See MongoDBStudentId.add_student_ids"""
+        requests = []
+        for document in documents:
+            document = {**document, "MATRICOLA": str(document["MATRICOLA"])}
+            requests.append(UpdateOne({"MATRICOLA": document["MATRICOLA"]},
+                                      {"$setOnInsert": document},
+                                      upsert=True))
+        if not requests:
+            return 0
+        result = await self.collection.bulk_write(requests, ordered=False)
+        return result.upserted_count
+
+    async def remove_student_id(self, student_id: str):
+        """See MongoDBStudentId.remove_student_id"""
+        await self.collection.delete_one({"MATRICOLA": student_id})
+        self.cache.invalidate(student_id)
+
+    async def update_student_id(self, student_id: str, new_student_id: str):
+        """See MongoDBStudentId.update_student_id"""
+        student_id, new_student_id = str(student_id), str(new_student_id)
+        await self.collection.update_one({"MATRICOLA": student_id},
+                                         {"$set": {"MATRICOLA": new_student_id}})
+        self.cache.invalidate(student_id)
+        self.cache.invalidate(new_student_id)
+
+    async def get_db_id_from(self, student_id: str) -> ObjectId:
+        """See MongoDBStudentId.get_db_id_from"""
+        student_id = str(student_id)
+        db_id = self.cache.db_id(student_id)
+        if db_id is not None:
+            return db_id
+        document = await self.collection.find_one({"MATRICOLA": student_id}, {"_id": 1})
+        if not document:
+            raise KeyError(f"Student ID '{student_id}' not found in the database.")
+        self.cache.put(student_id, document["_id"])
+        return document["_id"]
+
+    async def get_student_id_from(self, db_id: ObjectId) -> str:
+        """See MongoDBStudentId.get_student_id_from"""
+        student_id = self.cache.student_id(db_id)
+        if student_id is not None:
+            return student_id
+        document = await self.collection.find_one({"_id": db_id}, {"MATRICOLA": 1})
+        if not document:
+            raise KeyError(f"Database ID '{db_id}' not found in the database.")
+        self.cache.put(document["MATRICOLA"], db_id)
+        return document["MATRICOLA"]
+
+    async def get_db_ids_from(self, student_ids: Iterable[str]) -> tuple[
+        dict[str, ObjectId], list[str]]:
+        """See MongoDBStudentId.get_db_ids_from"""
+        student_ids = list(dict.fromkeys(str(student_id) for student_id in student_ids))
+        db_ids = self.cache.db_ids(student_ids)
+        not_cached = [student_id for student_id in student_ids
+                      if student_id not in db_ids]
+        for chunk in _chunks(not_cached):
+            async for document in self.collection.find({"MATRICOLA": {"$in": chunk}},
+                                                       {"MATRICOLA": 1}):
+                db_ids[document["MATRICOLA"]] = document["_id"]
+                self.cache.put(document["MATRICOLA"], document["_id"])
+        missing = [student_id for student_id in student_ids if student_id not in db_ids]
+        return db_ids, missing
+
+    async def get_student_ids_from(self, db_ids: Iterable[ObjectId]) -> tuple[
+        dict[ObjectId, str], list[ObjectId]]:
+        """See MongoDBStudentId.get_student_ids_from"""
+        db_ids = list(dict.fromkeys(db_ids))
+        student_ids = self.cache.student_ids(db_ids)
+        not_cached = [db_id for db_id in db_ids if db_id not in student_ids]
+        for chunk in _chunks(not_cached):
+            async for document in self.collection.find({"_id": {"$in": chunk}},
+                                                       {"MATRICOLA": 1}):
+                student_ids[document["_id"]] = document["MATRICOLA"]
+                self.cache.put(document["MATRICOLA"], document["_id"])
+        missing = [db_id for db_id in db_ids if db_id not in student_ids]
+        return student_ids, missing
+
+    async def set_project_id(self, project_id: str):
+        await self.collection.update_one({"project_id": "project_id"},
+                                         {'$set': {'id': str(project_id)}},
+                                         upsert=True)
+
+    async def get_project_id(self):
+        return (await self.collection.find_one({"project_id": "project_id"}))['id']
+
+    def close(self):
+        """Kept for compatibility: the connection is shared with the other objects
+        using it, hence only its owner closes it (MongoDBConnection.close)"""
@@ -0,0 +1,251 @@
+from __future__ import annotations
+
+import asyncio
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .async_dsl_student_id_database import AsyncMongoDBStudentId
+from .date_keys import entry_sort_key
+from .mongo_db_connection import MongoDBConnection, get_connection
+from .student_grade_queries import DATE_KEYS_PROJECTION, FINAL_GRADE_PROJECTION, \
+    GRADE_FIELDS, LEGACY_PROJECTION, check_grades_found, checked_db_id, \
+    date_key_requests, final_grade_rows, grade_counts_pipeline, legacy_query, \
+    max_project_grade, max_written_grade, missing_date_keys_query, new_student_document, \
+    project_session_query, push_written_grade_request, read_projection, \
+    rows_of_student_ids, summary_stages, to_correct_pipeline, \
+    upsert_project_grade_requests, with_summary, without_last_request
+
+
+class AsyncMongoDBStudentGrade:
+    """
+    asyncio version of MongoDBStudentGrade, on the AsyncIOMotorClient of the
+    connection: the same methods, as coroutines, and the iter_* methods as async
+    generators. The queries and the update pipelines are the ones of
+    MongoDBStudentGrade, from student_grade_queries, hence the documents written by the
+    two classes are the same.
+    """
+
+    def __init__(self, database_name="DSL_grade_dbs",
+                 connection: MongoDBConnection | None = None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.async_client
+        self.db = self.client[database_name]
+        self.collection = self.db["student_grade"]
+        self.db_id = AsyncMongoDBStudentId(database_name=database_name,
+                                           connection=self.connection)
+
+    async def _get_db_id_from(self, student_id: str) -> ObjectId:
+        """get the db_id from the student_id.
+        Raise an error if the student_id is not in the database"""
+        return checked_db_id(await self.db_id.get_db_id_from(student_id))
+
+    async def _get_db_ids_from(self, student_ids: list[str]) -> dict[str, ObjectId]:
+        db_ids, missing = await self.db_id.get_db_ids_from(student_ids)
+        if missing:
+            raise KeyError(f"Student IDs {missing} not found in the database.")
+        return db_ids
+
+    async def insert_student(self, document: dict):
+        """See MongoDBStudentGrade.insert_student"""
+        document = new_student_document(
+            document, await self._get_db_id_from(str(document['MATRICOLA'])))
+        if not await self.collection.find_one({"db_id": document["db_id"]}, {"_id": 1}):
+            await self.collection.insert_one(document)
+
+    async def insert_students(self, documents: list[dict]) -> int:
+        """See MongoDBStudentGrade.insert_students"""
+        db_ids = await self._get_db_ids_from([document['MATRICOLA']
+                                              for document in documents])
+        requests = []
+        for document in documents:
+            document = new_student_document(
+                document, db_ids[str(document['MATRICOLA'])])
+            requests.append(UpdateOne({"db_id": document["db_id"]},
+                                      {"$setOnInsert": document},
+                                      upsert=True))
+        if not requests:
+            return 0
+        result = await self.collection.bulk_write(requests, ordered=False)
+        return result.upserted_count
+
+    async def remove_student(self, student_id: str):
+        """See MongoDBStudentGrade.remove_student"""
+        db_id = await self._get_db_id_from(student_id)
+        await self.collection.delete_one({"db_id": db_id})
+        await self.db_id.remove_student_id(student_id)
+
+    async def update_student_id(self, student_id: str, new_student_id: str):
+        """See MongoDBStudentGrade.update_student_id"""
+        await self.db_id.update_student_id(student_id, new_student_id)
+        db_id = await self._get_db_id_from(new_student_id)
+        await self.collection.update_one({"db_id": db_id},
+                                         {"$set": {"student_id": new_student_id}})
+
+    async def update_students_have_rejected(self, student_ids: list[str]):
+        """See MongoDBStudentGrade.update_students_have_rejected.
+        The students are updated concurrently"""
+        db_ids = await self._get_db_ids_from(student_ids)
+
+        async def reject(db_id):
+            student = await self.collection.find_one(
+                {"db_id": db_id}, {"written_grades": 1, "project_grades": 1})
+            project_grades = sorted(student['project_grades'],
+                                    key=lambda x: entry_sort_key(x, 'project_id'))
+            written_grades = sorted(student['written_grades'],
+                                    key=lambda x: entry_sort_key(x, 'date'))
+            await self.collection.update_one({"db_id": db_id}, with_summary(
+                [{"$set": {"written_grades": {"$literal": written_grades[:-1]},
+                           "project_grades": {"$literal": project_grades[:-1]}}}]))
+
+        await asyncio.gather(*(reject(db_ids[str(student_id)])
+                               for student_id in student_ids))
+
+    async def update_students_have_rejected_bulk(self, student_ids: list[str]) -> dict:
+        """See MongoDBStudentGrade.update_students_have_rejected_bulk"""
+        db_ids = await self._get_db_ids_from(student_ids)
+        student_ids_by_db_id = {db_id: student_id for student_id, db_id in db_ids.items()}
+        sizes = await self.collection.aggregate(
+            grade_counts_pipeline(list(db_ids.values()))).to_list(None)
+        check_grades_found(student_ids_by_db_id, sizes)
+        requests, nothing_to_drop = [], []
+        for student in sizes:
+            if student["grades"] == 0:
+                nothing_to_drop.append(student_ids_by_db_id[student["db_id"]])
+                continue
+            requests.append(without_last_request(student["db_id"]))
+        return {"updated": await self.bulk_write(requests), "nothing_to_drop": nothing_to_drop}
+
+    async def get_student(self, student_id: str, projection: dict | None = None,
+                          lean: bool = False) -> dict:
+        """See MongoDBStudentGrade.get_student"""
+        db_id = await self._get_db_id_from(str(student_id))
+        return await self.collection.find_one(
+            {"db_id": db_id}, read_projection(projection, lean))
+
+    async def get_final_grade_given(self, student_id):
+        """See MongoDBStudentGrade.get_final_grade_given"""
+        db_id = await self._get_db_id_from(student_id)
+        student = await self.collection.find_one({"db_id": db_id}, {"final_grade": 1})
+        if "final_grade" in student:
+            return student["final_grade"]
+        student = await self.collection.find_one({"db_id": db_id},
+                                                 {field: 1 for field in GRADE_FIELDS})
+        written = max_written_grade(student['written_grades'])
+        project = max_project_grade(student['project_grades'])
+        return written + project if written and project else None
+
+    async def get_final_grades(self, student_ids: list[str] | None = None,
+                               batch_size: int = 1000):
+        """See MongoDBStudentGrade.get_final_grades"""
+        if student_ids is None:
+            cursor = self.collection.find({}, FINAL_GRADE_PROJECTION).sort("_id", 1)
+            cursor = cursor.batch_size(batch_size)
+            while students := await cursor.to_list(batch_size):
+                for _, row in await self._final_grade_rows(students):
+                    yield row
+            return
+        db_ids = await self._get_db_ids_from(student_ids)
+        students = await self.collection.find({"db_id": {"$in": list(db_ids.values())}},
+                                              FINAL_GRADE_PROJECTION).to_list(None)
+        for row in rows_of_student_ids(await self._final_grade_rows(students), student_ids,
+                                       db_ids):
+            yield row
+
+    async def _final_grade_rows(self, students: list[dict]) -> list[tuple]:
+        query = legacy_query(students)
+        legacy_students = await self.collection.find(query, LEGACY_PROJECTION).to_list(None) \
+            if query else []
+        return final_grade_rows(students, legacy_students)
+
+    async def iter_student_id_with_final_grade(self, min_grade: float,
+                                               batch_size: int = 1000):
+        """See MongoDBStudentGrade.iter_student_id_with_final_grade"""
+        cursor = self.collection.find({"final_grade": {"$gte": min_grade}},
+                                      {"_id": 0, "student_id": 1}).batch_size(batch_size)
+        async for student in cursor:
+            yield student["student_id"]
+
+    async def get_student_id_to_correct(self, threshold: float) -> list[str]:
+        """See MongoDBStudentGrade.get_student_id_to_correct"""
+        return [student_id async for student_id in self.iter_student_id_to_correct(threshold)]
+
+    async def iter_student_id_to_correct(self, threshold: float, batch_size: int = 1000):
+        """See MongoDBStudentGrade.iter_student_id_to_correct"""
+        project_id = await self.db_id.get_project_id()
+        pipeline = to_correct_pipeline(project_id, threshold)
+        async for student in self.collection.aggregate(pipeline, batchSize=batch_size):
+            yield student["student_id"]
+
+    async def get_students_project_session(self, projection: dict | None = None,
+                                           lean: bool = False) -> list[dict]:
+        """See MongoDBStudentGrade.get_students_project_session"""
+        return [student async for student in
+                self.iter_students_project_session(projection, lean)]
+
+    async def iter_students_project_session(self, projection: dict | None = None,
+                                            lean: bool = False, batch_size: int = 1000):
+        """See MongoDBStudentGrade.iter_students_project_session"""
+        project_id = await self.db_id.get_project_id()
+        students = self.collection.find(project_session_query(project_id),
+                                        read_projection(projection, lean))
+        async for student in students.batch_size(batch_size):
+            yield student
+
+    async def update_student_project_grade(self, student_id: str, project_grades: list):
+        """See MongoDBStudentGrade.update_student_project_grade"""
+        db_id = await self._get_db_id_from(student_id)
+        await self.collection.update_one({"db_id": db_id}, with_summary(
+            [{"$set": {"project_grades": {"$literal": project_grades}}}]))
+
+    async def update_student_written_grade(self, student_id: str, written_grades: list):
+        """See MongoDBStudentGrade.update_student_written_grade"""
+        db_id = await self._get_db_id_from(student_id)
+        await self.collection.update_one({"db_id": db_id}, with_summary(
+            [{"$set": {"written_grades": {"$literal": written_grades}}}]))
+
+    async def push_written_grade(self, student_id: str, written_grade: dict) -> bool:
+        """See MongoDBStudentGrade.push_written_grade"""
+        db_id = await self._get_db_id_from(str(student_id))
+        result = await self.collection.bulk_write(
+            [push_written_grade_request(db_id, written_grade)])
+        return result.modified_count > 0
+
+    async def upsert_project_grade(self, student_id: str, project_grade: dict,
+                                   grade_field: str, patch: bool = True) -> bool:
+        """See MongoDBStudentGrade.upsert_project_grade"""
+        db_id = await self._get_db_id_from(str(student_id))
+        requests = upsert_project_grade_requests(db_id, project_grade, grade_field, patch)
+        return await self.bulk_write(requests) > 0
+
+    async def bulk_write(self, requests: list[UpdateOne]) -> int:
+        """See MongoDBStudentGrade.bulk_write"""
+        if not requests:
+            return 0
+        result = await self.collection.bulk_write(requests, ordered=False)
+        return result.modified_count
+
+    async def rebuild_summaries(self) -> int:
+        """See MongoDBStudentGrade.rebuild_summaries"""
+        result = await self.collection.update_many({}, summary_stages())
+        return result.modified_count
+
+    async def migrate_date_keys(self, batch_size: int = 1000) -> dict:
+        """See MongoDBStudentGrade.migrate_date_keys"""
+        counts = {"students": 0, "batches": 0}
+        last_id = None
+        while True:
+            students = await self.collection.find(missing_date_keys_query(last_id),
+                                                  DATE_KEYS_PROJECTION) \
+                .sort("_id", 1).limit(batch_size).to_list(batch_size)
+            if not students:
+                return counts
+            requests = date_key_requests(students)
+            await self.bulk_write(requests)
+            counts["students"] += len(requests)
+            counts["batches"] += 1
+            last_id = students[-1]["_id"]
+
+    def close(self):
+        """Kept for compatibility: the connection is shared with the other objects
+        using it, hence only its owner closes it (MongoDBConnection.close)"""
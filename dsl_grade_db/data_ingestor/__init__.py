@@ -1,7 +1,10 @@
+from .ingestion_journal import IngestionJournal, IngestionRun
 from .mongo_db_enrolled_student import MongoDBEnrolledStudent
 from .mongo_db_report_grade import MongoDBReportGrade
 from .mongo_db_teams_grade import MongoDBTeamsGrade
 from .mongo_db_written_grade import MongoDBWrittenGrade
+from .parallel_ingestion import ParallelIngestion
 
 __all__ = ['MongoDBEnrolledStudent', 'MongoDBReportGrade',
-           'MongoDBWrittenGrade', 'MongoDBTeamsGrade']
+           'MongoDBWrittenGrade', 'MongoDBTeamsGrade', 'ParallelIngestion',
+           'IngestionJournal', 'IngestionRun']
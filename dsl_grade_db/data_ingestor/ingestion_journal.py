@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+from datetime import datetime, timezone
+
+from pymongo import ReturnDocument
+
+from ..mongo_db_connection import MongoDBConnection, get_connection
+
+
+class IngestionRun:
+    """
+    The journal of one ingestion, a document of the ingestion_runs collection with
+    the counts of the batches written, and one document of the ingestion_checkpoints
+    collection for each batch, with the student IDs it applied. The writes of the
+    ingestors are conditional (a grade is pushed or patched only if it is not there
+    yet), hence a batch interrupted before being recorded can be written again when
+    resuming.
+    """
+
+    def __init__(self, collection, checkpoints, document: dict):
+        self.collection = collection
+        self.checkpoints = checkpoints
+        self.run_id = document["_id"]
+        self.status = document["status"]
+        self.applied = set()
+        for checkpoint in checkpoints.find({"run_id": self.run_id},
+                                           {"_id": 0, "students": 1}):
+            self.applied.update(checkpoint["students"])
+
+    @property
+    def completed(self) -> bool:
+        return self.status == "completed"
+
+    def record_batch(self, student_ids: list[str], counts: dict):
+        """Checkpoint: the students of the batch are applied and skipped when resuming.
+        Only the students whose writes were sent must be given: the others (e.g. not
+        enrolled yet) are written by the next execution."""
+        now = datetime.now(timezone.utc)
+        self.checkpoints.insert_one({"run_id": self.run_id, "students": student_ids,
+                                     "rows": counts.get("rows", 0), "at": now})
+        self.collection.update_one({"_id": self.run_id}, {
+            "$inc": {"batches": 1, **{f"counts.{name}": value
+                                      for name, value in counts.items()
+                                      if isinstance(value, (int, float))}},
+            "$set": {"updated_at": now},
+        })
+        self.applied.update(student_ids)
+
+    def finish(self, counts: dict, resumed: int) -> dict:
+        """The counts of the ingestion with the run ID and the rows resumed (applied by
+        a previous execution). The run is completed only if no batch failed, otherwise
+        the students of the failed batches are written by the next execution."""
+        counts = {**counts, "run_id": self.run_id, "resumed": resumed}
+        if not counts.get("errors"):
+            self.complete(counts)
+        return counts
+
+    def complete(self, result: dict):
+        """Mark the run as completed with the result of the last execution"""
+        now = datetime.now(timezone.utc)
+        self.collection.update_one({"_id": self.run_id}, {"$set": {
+            "status": "completed", "result": result, "updated_at": now,
+            "completed_at": now}})
+        self.status = "completed"
+
+
+class IngestionJournal:
+    """
+    The ingestion_runs collection and the ingestion_checkpoints of the runs. A run is
+    identified by the kind of ingestion (the collection of the ingestor, e.g.
+    "written_grade") and the sha256 of its files, so that the same files are resumed
+    and different files start a new run.
+    """
+
+    def __init__(self, database_name="DSL_grade_dbs",
+                 connection: MongoDBConnection | None = None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
+        self.db = self.client[database_name]
+        self.collection = self.db["ingestion_runs"]
+        self.checkpoints = self.db["ingestion_checkpoints"]
+
+    @staticmethod
+    def files_sha256(*paths: str) -> str:
+        sha256 = hashlib.sha256()
+        for path in paths:
+            with open(path, "rb") as file:
+                for block in iter(lambda: file.read(1 << 20), b""):
+                    sha256.update(block)
+        return sha256.hexdigest()
+
+    def start(self, kind: str, *paths: str) -> IngestionRun:
+        """Start the run of the files, or resume it if it exists and it is not
+        completed (a completed run is returned as it is)"""
+        sha256 = self.files_sha256(*paths)
+        now = datetime.now(timezone.utc)
+        document = self.collection.find_one_and_update(
+            {"_id": f"{kind}:{sha256}"},
+            {"$setOnInsert": {"kind": kind, "files": list(paths), "sha256": sha256,
+                              "status": "running", "started_at": now, "batches": 0,
+                              "counts": {}},
+             "$set": {"updated_at": now}},
+            upsert=True, return_document=ReturnDocument.AFTER)
+        return IngestionRun(self.collection, self.checkpoints, document)
+
+    def get_run(self, kind: str, *paths: str) -> dict | None:
+        return self.collection.find_one({"_id": f"{kind}:{self.files_sha256(*paths)}"})
+
+    def drop(self):
+        self.collection.drop()
+        self.checkpoints.drop()
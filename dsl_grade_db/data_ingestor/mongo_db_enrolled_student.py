@@ -1,16 +1,23 @@
+from __future__ import annotations
+
 import pandas as pd
-from pymongo import MongoClient
 
 from ..dsl_student_id_database import MongoDBStudentId
+from ..mongo_db_connection import get_connection
 from ..mongo_db_student_grade import MongoDBStudentGrade
+from .ingestion_journal import IngestionJournal
+from .parallel_ingestion import ParallelIngestion
 
 
 class MongoDBEnrolledStudent:
-    def __init__(self, enrolled_students_csv_file_path, database_name):
-        self.client = MongoClient()
+    def __init__(self, enrolled_students_csv_file_path, database_name, connection=None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
-        self.mongo_db_student_id = MongoDBStudentId(database_name=database_name)
-        self.mongo_db_student_grade = MongoDBStudentGrade(database_name=database_name)
+        self.mongo_db_student_id = MongoDBStudentId(database_name=database_name,
+                                                    connection=self.connection)
+        self.mongo_db_student_grade = MongoDBStudentGrade(database_name=database_name,
+                                                          connection=self.connection)
         self.file_path = enrolled_students_csv_file_path
 
     def consume_file(self):
@@ -19,3 +26,48 @@ class MongoDBEnrolledStudent:
         for _, row in df.iterrows():
             self.mongo_db_student_id.add_student_id(row.to_dict())
             self.mongo_db_student_grade.insert_student(row.to_dict())
+
+    def consume_file_bulk(self) -> dict:
+        """Bulk version of consume_file: the new students are inserted with one bulk
+        upsert keyed on MATRICOLA in enrolled_students and one keyed on db_id in
+        student_grade, instead of several round trips for each student.
+
+        Returns:
+            dict: the number of students inserted and the number of rows skipped
+            because the student was already in the database.
+        """
+        df = pd.read_csv(self.file_path)
+        df['MATRICOLA'] = df['MATRICOLA'].astype(str)
+        inserted = self._insert_chunk(df)["inserted"]
+        return {"inserted": inserted, "skipped": len(df) - inserted}
+
+    def consume_file_parallel(self, ingestion: ParallelIngestion | None = None,
+                              journal: IngestionJournal | None = None) -> dict:
+        """Parallel version of consume_file_bulk: the two bulk upserts are sent for
+        each chunk of students, on the thread pool of the ingestion.
+        With the journal, each chunk is recorded in the run of the file, and the
+        students applied by an interrupted run of the same file are skipped.
+
+        Returns:
+            dict: as consume_file_bulk, with the number of chunks and their errors
+            (and the run ID and the rows resumed with the journal)
+        """
+        ingestion = ingestion or ParallelIngestion()
+        journal_run = journal.start(self.mongo_db_student_id.collection.name, self.file_path) \
+            if journal else None
+        df = pd.read_csv(self.file_path)
+        df['MATRICOLA'] = df['MATRICOLA'].astype(str)
+        result = ingestion.run(df, 'MATRICOLA', self._insert_chunk, journal_run)
+        inserted = result.get("inserted", 0)
+        counts = {"inserted": inserted,
+                  "skipped": len(df) - inserted - result.get("resumed", 0),
+                  "chunks": result["chunks"], "errors": result["errors"]}
+        if journal_run is not None:
+            counts = journal_run.finish(counts, result["resumed"])
+        return counts
+
+    def _insert_chunk(self, df) -> dict:
+        documents = df.to_dict('records')
+        inserted = self.mongo_db_student_id.add_student_ids(documents)
+        self.mongo_db_student_grade.insert_students(documents)
+        return {"inserted": inserted}
@@ -1,15 +1,22 @@
+from __future__ import annotations
+
 import pandas as pd
-from pymongo import MongoClient
 
+from dsl_grade_db.date_keys import to_date_key
+from dsl_grade_db.mongo_db_connection import get_connection
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
+from .ingestion_journal import IngestionJournal
+from .parallel_ingestion import ParallelIngestion
 
 
 class MongoDBReportGrade:
-    def __init__(self, database_name, report_csv_file_path):
-        self.client = MongoClient()
+    def __init__(self, database_name, report_csv_file_path, connection=None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
         self.report_coll = self.db["report_grade"]
-        self.student_coll = MongoDBStudentGrade(database_name=database_name)
+        self.student_coll = MongoDBStudentGrade(database_name=database_name,
+                                                connection=self.connection)
         self.report_csv_file_path = report_csv_file_path
 
     def _read_and_insert(self, df, collection):
@@ -18,34 +25,83 @@ class MongoDBReportGrade:
         df['project_id'] = project_id
         collection.insert_many(df.to_dict('records'))
 
-    def consume_documents(self):
-        self._read_and_insert(pd.read_csv(self.report_csv_file_path), self.report_coll)
+    def consume_documents(self) -> list[str]:
+        """Assign the report grades to the students.
+        Return the student IDs not found in the database, whose reports are skipped"""
+        df = pd.read_csv(self.report_csv_file_path)
+        # resolve all the students with one query, the following lookups hit the cache
+        _, missing = self.student_coll.db_id.get_db_ids_from(df['Matricola'])
+        skipped = set(missing)
+        self._read_and_insert(df, self.report_coll)
         for report in self.report_coll.find():
             student_id = report['Matricola']
-            student = self.student_coll.get_student(student_id)
-            project_grades = self._update_project_grade(report=report,
-                                                        project_grades=student[
-                                                            'project_grades'])
-            self.student_coll.update_student_project_grade(student_id, project_grades)
+            if str(student_id) in skipped:
+                continue
+            # an existing report grade is never overwritten
+            self.student_coll.upsert_project_grade(
+                student_id, self._new_project_grade(report), 'report_grade')
         self.report_coll.drop()
+        return missing
+
+    def consume_documents_bulk(self) -> dict:
+        """Bulk version of consume_documents: the reports go straight from the csv file
+        to the students with one bulk write, without the staging collection and without
+        reading the students. As in consume_documents, an existing report grade is never
+        overwritten.
+
+        Returns:
+            dict: the number of students updated and the student IDs not found
+        """
+        df = pd.read_csv(self.report_csv_file_path)
+        df['project_id'] = self.student_coll.db_id.get_project_id()
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(df['Matricola'])
+        updated = self.student_coll.bulk_write(self._report_grade_requests(df, db_ids))
+        return {"updated": updated, "missing": missing}
+
+    def consume_documents_parallel(self, ingestion: ParallelIngestion | None = None,
+                                   journal: IngestionJournal | None = None) -> dict:
+        """Parallel version of consume_documents_bulk: the students are resolved with
+        one query and the reports are sent with one bulk write for each chunk of
+        students, on the thread pool of the ingestion.
+        With the journal, each chunk is recorded in the run of the file, and the
+        students applied by an interrupted run of the same file are skipped.
+
+        Returns:
+            dict: as consume_documents_bulk, with the number of chunks and their errors
+            (and the run ID and the rows resumed with the journal)
+        """
+        ingestion = ingestion or ParallelIngestion()
+        journal_run = journal.start(self.report_coll.name, self.report_csv_file_path) \
+            if journal else None
+        df = pd.read_csv(self.report_csv_file_path)
+        df['project_id'] = self.student_coll.db_id.get_project_id()
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(df['Matricola'])
+        result = ingestion.run(df, 'Matricola', lambda chunk: {
+            "updated": self.student_coll.bulk_write(self._report_grade_requests(chunk, db_ids))
+        }, journal_run, missing)
+        counts = {"updated": result.get("updated", 0), "missing": missing,
+                  "chunks": result["chunks"], "errors": result["errors"]}
+        if journal_run is not None:
+            counts = journal_run.finish(counts, result["resumed"])
+        return counts
+
+    def _report_grade_requests(self, df, db_ids) -> list:
+        """The requests assigning the reports of the rows"""
+        requests = []
+        # only one report for each student, the first one in the file
+        for report in df.drop_duplicates('Matricola').to_dict('records'):
+            if str(report['Matricola']) in db_ids:
+                requests += self.student_coll.upsert_project_grade_requests(
+                    db_ids[str(report['Matricola'])], self._new_project_grade(report),
+                    'report_grade')
+        return requests
 
-    def _update_project_grade(self, report, project_grades: list[dict]):
-        project_ids = [project['project_id'] for project in project_grades]
-        if report['project_id'] in project_ids:
-            # update the project grade
-            for project in project_grades:
-                if project['project_id'] == report['project_id']:
-                    if 'report_grade' not in project:
-                        project['report_grade'] = float(report['Final score'])
-                        project['final_grade'] += float(report['Final score'])
-                        project['report_info'] = report
-                        break
-        else:
-            # initialize the project document
-            project_grades.append({
-                'project_id': str(report['project_id']),
-                'report_grade': float(report['Final score']),
-                'final_grade': float(report['Final score']),
-                'report_info': report
-            })
-        return project_grades
+    @staticmethod
+    def _new_project_grade(report) -> dict:
+        return {
+            'project_id': str(report['project_id']),
+            'date_key': to_date_key(str(report['project_id'])),
+            'report_grade': float(report['Final score']),
+            'final_grade': float(report['Final score']),
+            'report_info': report
+        }
@@ -1,7 +1,11 @@
 import pandas as pd
-from pymongo import MongoClient
 
+from dsl_grade_db.date_keys import to_date_key
+from dsl_grade_db.mongo_db_connection import get_connection
+from dsl_grade_db.mongo_db_indexes import ensure_indexes
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
+from .ingestion_journal import IngestionJournal
+from .parallel_ingestion import ParallelIngestion
 
 
 class MongoDBTeamsGrade:
@@ -12,13 +16,16 @@ class MongoDBTeamsGrade:
     a submission to the leaderboard in order to update the project grades.
     """
 
-    def __init__(self, database_name, leaderboard_csv_file_path, teams_csv_file_path):
+    def __init__(self, database_name, leaderboard_csv_file_path, teams_csv_file_path,
+                 connection=None):
 
-        self.client = MongoClient()
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
         self.leaderboard_coll = self.db["leaderboard_grade"]
         self.teams_coll = self.db["teams_grade"]
-        self.student_coll = MongoDBStudentGrade(database_name=database_name)
+        self.student_coll = MongoDBStudentGrade(database_name=database_name,
+                                                connection=self.connection)
         # read leaderboard and add to collection
         self.leaderboard_csv_file_path = leaderboard_csv_file_path
         self.teams_csv_file_path = teams_csv_file_path
@@ -42,6 +49,8 @@ class MongoDBTeamsGrade:
                                   self.leaderboard_coll)
         # read teams and add to collection
         self._parse_df_and_insert(pd.read_csv(self.teams_csv_file_path), self.teams_coll)
+        # the teams are searched by student ID for each leaderboard submission
+        ensure_indexes(self.db, collections=[self.teams_coll.name])
         # iterate over the leaderboard
         for lead_doc in self.leaderboard_coll.find():
             team = self.teams_coll.find_one({
@@ -59,6 +68,66 @@ class MongoDBTeamsGrade:
                 self.update_team_max_lead_grade(team["_id"], lead_doc)
         self.leaderboard_coll.drop()
 
+    def consume_documents_in_leaderboard_bulk(self) -> list[dict]:
+        """Bulk version of consume_documents_in_leaderboard: the max leaderboard grade
+        of each team is computed in memory (see _join_leaderboard_and_teams), without
+        the leaderboard and the teams staging collections.
+
+        Returns:
+            list[dict]: the teams of teams.csv followed by the new teams with one student
+        """
+        return self._join_leaderboard_and_teams(pd.read_csv(self.leaderboard_csv_file_path),
+                                                pd.read_csv(self.teams_csv_file_path))
+
+    def _join_leaderboard_and_teams(self, leaderboard_df, teams_df) -> list[dict]:
+        """Hash join of the leaderboard with the teams, with the same rules of
+        consume_documents_in_leaderboard:
+        - each student is mapped to their team with a student ID -> team dictionary
+        - the team gets the first submission with the max rounded_points of its members
+        - the students without a team get a new team with only one student
+        """
+        teams_df = teams_df.copy()
+        # from "1/3/2023 22:17:06" to "1/3/2023"
+        teams_df['project_id'] = teams_df['Timestamp'].str.split(' ').str[0]
+        self.set_project_date(teams_df['project_id'][0])
+        teams_df['max_lead_grade'] = -1  # set it to -1 in case of no update
+        teams = teams_df.to_dict('records')
+        member_to_team = {}
+        for team_index, team in enumerate(teams):
+            for member in ['Student ID # 1', 'Student ID # 2']:
+                student_id = self._to_student_id(team[member])
+                if student_id is not None:
+                    member_to_team.setdefault(student_id, team_index)
+
+        leaderboard_df = leaderboard_df.reset_index(drop=True)
+        submissions = leaderboard_df.to_dict('records')
+        student_ids = leaderboard_df['matricola'].map(self._to_student_id)
+        team_indexes = student_ids.map(member_to_team)
+        in_team = team_indexes.notna()
+        points = leaderboard_df['rounded_points']
+        # idxmax returns the first submission with the max points
+        for team_index, submission_index in points[in_team].groupby(
+                team_indexes[in_team]).idxmax().items():
+            team = teams[int(team_index)]
+            submission = submissions[submission_index]
+            if submission['rounded_points'] > team['max_lead_grade']:
+                team['max_lead_grade'] = float(submission['rounded_points'])
+                team['leaderboard_info'] = submission
+        for submission_index in points[~in_team].groupby(
+                student_ids[~in_team], sort=False).idxmax():
+            teams.append(self._new_solo_team(submissions[submission_index]))
+        return teams
+
+    @staticmethod
+    def _to_student_id(value) -> str | None:
+        """From the value read from the csv (int, float or str) to the student ID.
+        None if the value is empty"""
+        if value is None or value == "" or pd.isna(value):
+            return None
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+        return str(value)
+
     def update_team_max_lead_grade(self, team_id, lead_doc):
         """Update the max_lead_grade only if:
         - max_lead_grade does not exist yet
@@ -79,7 +148,10 @@ class MongoDBTeamsGrade:
 
     def insert_in_teams(self, lead_doc):
         """Create new team with only one student"""
-        document = {
+        self.teams_coll.insert_one(self._new_solo_team(lead_doc))
+
+    def _new_solo_team(self, lead_doc) -> dict:
+        return {
             "Timestamp": "",
             "project_id": self.date,
             "Student ID # 1": lead_doc["matricola"],
@@ -87,51 +159,106 @@ class MongoDBTeamsGrade:
             "max_lead_grade": float(lead_doc["rounded_points"]),
             "leaderboard_info": lead_doc
         }
-        self.teams_coll.insert_one(document)
 
-    def consume_documents_in_teams(self):
-        """update the students from teams collection"""
+    def consume_documents_in_teams(self) -> list[str]:
+        """update the students from the teams, joined with the leaderboard in memory
+        (see consume_documents_in_leaderboard_bulk), one student at a time.
+        Return the student IDs not found in the database, which are skipped"""
 
         # TODO What happen if one team does not have any leaderboard submission?
         # TODO Now we set everything to 0
-        def update_student(student_id_, team_):
-            if student_id_:  # update only if it exists
-                student_ = self.student_coll.get_student(student_id_)
-                project_grades_ = self._update_project_grade(team=team_,
-                                                             project_grades=student_[
-                                                                 'project_grades'])
-                self.student_coll.update_student_project_grade(student_id_,
-                                                               project_grades_)
-
-        self.consume_documents_in_leaderboard()
-        for team in self.teams_coll.find():
-            student_id_1 = team['Student ID # 1']
-            student_id_2 = team['Student ID # 2']
-            update_student(student_id_1, team)
-            update_student(student_id_2, team)
-        self.teams_coll.drop()
-
-    def _update_project_grade(self, team, project_grades: list):
-        project_date = [project['project_id'] for project in project_grades]
-        if team['project_id'] in project_date:
-            # update the project grade
-            for project in project_grades:
-                if project['project_id'] == team['project_id']:
-                    # update only if there is at least one submission to leaderboard
-                    # the initial value of max_lead_grade is -1
-                    # in this way the student that does not submit to leaderboard
-                    # will not have this project in the database
-                    if 'leaderboard_grade' not in project and team['max_lead_grade'] >= 0:
-                        project['leaderboard_grade'] = float(team['max_lead_grade'])
-                        project['final_grade'] += float(team['max_lead_grade'])
-                        project['team_info'] = team
-                        break
-        else:
-            # initialize the project document
-            project_grades.append({
-                'project_id': team['project_id'],
-                'leaderboard_grade': float(team['max_lead_grade']),
-                'final_grade': float(team['max_lead_grade']),
-                'team_info': team
-            })
-        return project_grades
+        members = [(self._to_student_id(team[member]), team)
+                   for team in self.consume_documents_in_leaderboard_bulk()
+                   for member in ['Student ID # 1', 'Student ID # 2']]
+        members = [(student_id, team) for student_id, team in members
+                   if student_id is not None]
+        # resolve all the students with one query, the following lookups hit the cache
+        _, missing = self.student_coll.db_id.get_db_ids_from(
+            student_id for student_id, _ in members)
+        skipped = set(missing)
+        for student_id, team in members:
+            # update only if it exists
+            if student_id not in skipped:
+                # the leaderboard grade is set only if there is at least one
+                # submission to leaderboard (the initial value of max_lead_grade is -1)
+                self.student_coll.upsert_project_grade(
+                    student_id, self._new_project_grade(team), 'leaderboard_grade',
+                    patch=team['max_lead_grade'] >= 0)
+        return missing
+
+    def consume_documents_in_teams_bulk(self) -> dict:
+        """Bulk version of consume_documents_in_teams: the teams are computed in memory
+        (see _join_leaderboard_and_teams) and the project grades of all the members are
+        sent with one unordered bulk write, without reading the students: only the
+        element of the current project is created or updated (see
+        MongoDBStudentGrade.upsert_project_grade_requests).
+
+        Returns:
+            dict: the number of students updated and the student IDs not found
+        """
+        members = self._team_of_members()
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(members)
+        updated = self.student_coll.bulk_write(
+            self._project_grade_requests(members.items(), db_ids))
+        return {"updated": updated, "missing": missing}
+
+    def consume_documents_in_teams_parallel(self, ingestion: ParallelIngestion | None = None,
+                                            journal: IngestionJournal | None = None) -> dict:
+        """Parallel version of consume_documents_in_teams_bulk: the project grades are
+        sent with one bulk write for each chunk of members, on the thread pool of the
+        ingestion.
+        With the journal, each chunk is recorded in the run of the two files, and the
+        students applied by an interrupted run of the same files are skipped.
+
+        Returns:
+            dict: as consume_documents_in_teams_bulk, with the number of chunks and
+            their errors (and the run ID and the members resumed with the journal)
+        """
+        ingestion = ingestion or ParallelIngestion()
+        journal_run = journal.start(self.teams_coll.name, self.leaderboard_csv_file_path,
+                                    self.teams_csv_file_path) if journal else None
+        members = self._team_of_members()
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(members)
+        members_df = pd.DataFrame({'student_id': list(members.keys()),
+                                   'team': list(members.values())})
+        result = ingestion.run(members_df, 'student_id', lambda chunk: {
+            "updated": self.student_coll.bulk_write(self._project_grade_requests(
+                zip(chunk['student_id'], chunk['team']), db_ids))
+        }, journal_run, missing)
+        counts = {"updated": result.get("updated", 0), "missing": missing,
+                  "chunks": result["chunks"], "errors": result["errors"]}
+        if journal_run is not None:
+            counts = journal_run.finish(counts, result["resumed"])
+        return counts
+
+    def _team_of_members(self) -> dict:
+        """The team of each student, computed in memory (see _join_leaderboard_and_teams).
+        As in consume_documents_in_teams, only the first team of a student counts"""
+        members = {}
+        for team in self.consume_documents_in_leaderboard_bulk():
+            for member in ['Student ID # 1', 'Student ID # 2']:
+                student_id = self._to_student_id(team[member])
+                if student_id is not None:
+                    members.setdefault(student_id, team)
+        return members
+
+    def _project_grade_requests(self, members, db_ids) -> list:
+        """The requests creating or updating the project grade of the (student ID, team)
+        members"""
+        requests = []
+        for student_id, team in members:
+            if student_id in db_ids:
+                requests += self.student_coll.upsert_project_grade_requests(
+                    db_ids[student_id], self._new_project_grade(team), 'leaderboard_grade',
+                    patch=team['max_lead_grade'] >= 0)
+        return requests
+
+    @staticmethod
+    def _new_project_grade(team) -> dict:
+        return {
+            'project_id': team['project_id'],
+            'date_key': to_date_key(team['project_id']),
+            'leaderboard_grade': float(team['max_lead_grade']),
+            'final_grade': float(team['max_lead_grade']),
+            'team_info': team
+        }
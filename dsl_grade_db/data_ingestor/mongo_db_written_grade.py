@@ -1,65 +1,168 @@
-import locale
-from datetime import datetime
+from __future__ import annotations
 
 import pandas as pd
-from pymongo import MongoClient
 
 from .. import MongoDBStudentGrade
+from ..date_keys import to_date_key
+from ..mongo_db_connection import get_connection
+from .ingestion_journal import IngestionJournal
+from .parallel_ingestion import ParallelIngestion
+
+# Italian month names of the dates exported by Moodle
+ITALIAN_MONTHS = {
+    'gennaio': 1, 'febbraio': 2, 'marzo': 3, 'aprile': 4, 'maggio': 5, 'giugno': 6,
+    'luglio': 7, 'agosto': 8, 'settembre': 9, 'ottobre': 10, 'novembre': 11, 'dicembre': 12
+}
 
 
 class MongoDBWrittenGrade:
     def __init__(self, database_name="DSL_grade_dbs",
-                 written_csv_file_path="written_grade.csv"):
-        self.client = MongoClient()
+                 written_csv_file_path="written_grade.csv", connection=None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
         self.written_coll = self.db['written_grade']
-        self.student_coll = MongoDBStudentGrade(database_name=database_name)
+        self.student_coll = MongoDBStudentGrade(database_name=database_name,
+                                                connection=self.connection)
+        self.written_csv_file_path = written_csv_file_path
         self.written_df = self._parse_written_csv_file(pd.read_csv(written_csv_file_path))
-        self._insert_in_collections(self.written_coll, self.written_df)
 
     @staticmethod
     def _parse_written_csv_file(df):
         # 1 create data column
         # transform from "8 settembre 2023  08:25" to "08/09/2023"
-        locale.setlocale(locale.LC_TIME, 'it_IT')
-        df['date'] = df.Iniziato.map(
-            lambda x: datetime.strptime(x, '%d %B %Y %H:%M').strftime('%d/%m/%Y')
-        )
-        # 2 remove the comma in the float values
-        columns = ['Valutazione/20,00',
-                   'D. 1 /0,00', 'D. 2 /1,50', 'D. 3 /1,50', 'D. 4 /1,50', 'D. 5 /1,50',
+        # without the locale, which is process-global and may not be installed
+        parts = df['Iniziato'].str.extract(r'^\s*(\d{1,2})\s+(\w+)\s+(\d{4})')
+        month = parts[1].str.lower().map(ITALIAN_MONTHS)
+        if month.isna().any():
+            raise ValueError(f"Dates not recognized: {df['Iniziato'][month.isna()].tolist()}")
+        dates = pd.to_datetime(pd.DataFrame({'year': parts[2].astype(int),
+                                             'month': month.astype(int),
+                                             'day': parts[0].astype(int)}))
+        df['date'] = dates.dt.strftime('%d/%m/%Y')
+        # 2 from "12,88" to 12.88, the missing answers ("-") become NaN
+        columns = ['D. 1 /0,00', 'D. 2 /1,50', 'D. 3 /1,50', 'D. 4 /1,50', 'D. 5 /1,50',
                    'D. 6 /2,50', 'D. 7 /1,50', 'D. 8 /1,50', 'D. 9 /1,50', 'D. 10 /1,50',
                    'D. 11 /1,50', 'D. 12 /2,00', 'D. 13 /2,00']
-        for col in columns:
-            df[col] = df[col].str.replace(",", ".")
+        df[columns] = df[columns].apply(MongoDBWrittenGrade._to_float)
         # 3 create a new column for student ID
         # from "01twzsm0_it_23_p1070_s313385" to "313385"
-        df['student_id'] = df['Username'].map(lambda x: x.split('_')[-1][1:])
+        df['student_id'] = df['Username'].str.rsplit('_', n=1).str[-1].str[1:]
+        # 4 the grade is required: an exam not graded yet ("-") is rejected
+        grades = MongoDBWrittenGrade._to_float(df['Valutazione/20,00'])
+        if grades.isna().any():
+            raise ValueError(f"Grades not recognized for the student IDs "
+                             f"{df['student_id'][grades.isna()].tolist()}")
+        df['Valutazione/20,00'] = grades
         return df
 
+    @staticmethod
+    def _to_float(column):
+        """From "12,88" to 12.88, NaN if not a number"""
+        return pd.to_numeric(column.astype(str).str.replace(",", ".", regex=False),
+                             errors='coerce')
+
     @staticmethod
     def _insert_in_collections(collection, df):
         collection.insert_many(df.to_dict('records'))
 
-    def consume_documents(self):
+    def consume_documents(self) -> list[str]:
+        """Append the written exams to the students.
+        Return the student IDs not found in the database, whose exams are skipped"""
+        self._insert_in_collections(self.written_coll, self.written_df)
+        # resolve all the students with one query, the following lookups hit the cache
+        _, missing = self.student_coll.db_id.get_db_ids_from(self.written_df['student_id'])
+        skipped = set(missing)
         for written_doc in self.written_coll.find():
             student_id = written_doc['student_id']
-            student = self.student_coll.get_student(student_id)
-            written_grades = self._update_written_grade(written_doc=written_doc,
-                                                        written_grades=student[
-                                                            'written_grades'])
-            self.student_coll.update_student_written_grade(student_id, written_grades)
+            if student_id in skipped:
+                continue
+            # only one written grade per date
+            self.student_coll.push_written_grade(student_id,
+                                                 self._new_written_grade(written_doc))
         # drop the consumed collection
         self.written_coll.drop()
+        return missing
+
+    def consume_documents_bulk(self) -> dict:
+        """Bulk version of consume_documents: the written exams go straight from the
+        csv file to the students with one bulk write, without the staging collection.
+        The rows are grouped by student and each exam is pushed only if the student
+        has no written grade for the same date.
 
-    def _update_written_grade(self, written_doc, written_grades: list[dict]):
-        # the written grades are recognized by the date (only one written grade per date)
-        written_dates = [written['date'] for written in written_grades]
-        if written_doc['date'] not in written_dates:
-            # initialize the written grade document
-            written_grades.append({
-                'date': written_doc['date'],
-                'grade': float(written_doc['Valutazione/20,00']),
-                'written_info': written_doc
-            })
-        return written_grades
+        Returns:
+            dict: the number of exams inserted, the number of rows skipped
+            and the student IDs not found in the database.
+        """
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(self.written_df['student_id'])
+        inserted = self._push_written_grades(self.written_df, db_ids)
+        return {"inserted": inserted, "skipped": len(self.written_df) - inserted,
+                "missing": missing}
+
+    def consume_documents_parallel(self, ingestion: ParallelIngestion | None = None,
+                                   journal: IngestionJournal | None = None) -> dict:
+        """Parallel version of consume_documents_bulk: the students are resolved with
+        one query and the exams are sent with one bulk write for each chunk of
+        students, on the thread pool of the ingestion.
+        With the journal, each chunk is recorded in the run of the file, and the
+        students applied by an interrupted run of the same file are skipped.
+
+        Returns:
+            dict: as consume_documents_bulk, with the number of chunks and their errors
+            (and the run ID and the rows resumed with the journal)
+        """
+        ingestion = ingestion or ParallelIngestion()
+        journal_run = journal.start(self.written_coll.name, self.written_csv_file_path) \
+            if journal else None
+        db_ids, missing = self.student_coll.db_id.get_db_ids_from(self.written_df['student_id'])
+        result = ingestion.run(self.written_df, 'student_id', lambda df: {
+            "inserted": self._push_written_grades(df, db_ids)
+        }, journal_run, missing)
+        inserted = result.get("inserted", 0)
+        counts = {"inserted": inserted,
+                  "skipped": len(self.written_df) - inserted - result.get("resumed", 0),
+                  "missing": missing, "chunks": result["chunks"], "errors": result["errors"]}
+        if journal_run is not None:
+            counts = journal_run.finish(counts, result["resumed"])
+        return counts
+
+    def _push_written_grades(self, written_df, db_ids) -> int:
+        """Append the exams of the rows with one bulk write and one request for each
+        student, after one read of the dates of the students.
+        Return the number of exams appended"""
+        student_db_ids = [db_ids[student_id] for student_id in written_df['student_id'].unique()
+                          if student_id in db_ids]
+        if not student_db_ids:
+            return 0
+        dates = self.student_coll.get_written_grade_dates(student_db_ids)
+        requests, inserted = self._written_grade_requests(written_df, db_ids, dates)
+        self.student_coll.bulk_write(requests)
+        return inserted
+
+    def _written_grade_requests(self, written_df, db_ids, dates) -> tuple[list, int]:
+        """The requests pushing the new exams of the rows, grouped by student: one
+        request with all the new exams of each student, and the number of exams.
+        The request also skips on the server the dates added meanwhile"""
+        requests, inserted = [], 0
+        for student_id, student_df in written_df.groupby('student_id', sort=False):
+            if student_id not in db_ids:
+                continue
+            db_id = db_ids[student_id]
+            # only one written grade per date, the first one in the file
+            written_grades = [self._new_written_grade(written_doc) for written_doc
+                              in student_df.drop_duplicates('date').to_dict('records')
+                              if written_doc['date'] not in dates.get(db_id, set())]
+            if written_grades:
+                requests.append(self.student_coll.push_written_grades_request(
+                    db_id, written_grades))
+                inserted += len(written_grades)
+        return requests, inserted
+
+    @staticmethod
+    def _new_written_grade(written_doc) -> dict:
+        return {
+            'date': written_doc['date'],
+            'date_key': to_date_key(written_doc['date']),
+            'grade': float(written_doc['Valutazione/20,00']),
+            'written_info': written_doc
+        }
@@ -0,0 +1,104 @@
+from __future__ import annotations
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Collection
+
+import pandas as pd
+from pymongo.errors import PyMongoError
+
+from .ingestion_journal import IngestionRun
+
+
+class ParallelIngestion:
+    """
+    Run the bulk writes of an ingestion on chunks of the rows, with a bounded pool of
+    threads sharing the MongoClient of the connection.
+    The rows are partitioned by student ID: all the rows of a student are in the same
+    chunk, in the order of the file, hence no two workers write the same student
+    document and the "first row in the file" rules of the bulk ingestion still hold.
+    """
+
+    def __init__(self, max_workers: int = 4, chunk_size: int = 1000):
+        if max_workers < 1 or chunk_size < 1:
+            raise ValueError("max_workers and chunk_size must be positive.")
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+
+    def partition(self, df: pd.DataFrame, key: str) -> list[pd.DataFrame]:
+        """Split the rows in chunks of about chunk_size rows (more only if a student
+        has more rows) without splitting the rows with the same key"""
+        chunks, positions = [], []
+        for group_positions in df.groupby(key, sort=False, dropna=False).indices.values():
+            positions.extend(group_positions)
+            if len(positions) >= self.chunk_size:
+                chunks.append(df.iloc[sorted(positions)])
+                positions = []
+        if positions:
+            chunks.append(df.iloc[sorted(positions)])
+        return chunks
+
+    def run(self, df: pd.DataFrame, key: str,
+            process_chunk: Callable[[pd.DataFrame], dict],
+            journal_run: IngestionRun | None = None,
+            missing: Collection[str] = ()) -> dict:
+        """
+        Process the chunks of the rows partitioned by key on the thread pool.
+        The failure of a chunk does not stop the others: the database errors are
+        collected, the other exceptions are raised.
+
+        Args:
+            df (pd.DataFrame): The rows to ingest.
+            key (str): The column with the student ID.
+            process_chunk (Callable): Write a chunk and return its counts (numbers are
+                summed, lists are concatenated in the order of the chunks).
+            journal_run (IngestionRun): If given, each chunk written is recorded in the
+                run and the rows of the students already applied by the run are skipped.
+            missing (Collection[str]): The student IDs not found in the database: their
+                rows are not written, hence they are not recorded as applied and they
+                are written when the run is executed again.
+
+        Returns:
+            dict: the aggregated counts, the number of chunks and the errors
+            (the chunk, its number of rows and the error message), and the number of
+            rows skipped because already applied if journal_run is given
+        """
+        result = {}
+        if journal_run is not None:
+            applied = df[key].astype(str).isin(journal_run.applied)
+            result["resumed"] = int(applied.sum())
+            df = df[~applied]
+            process_chunk = self._journaled(process_chunk, key, journal_run, set(missing))
+        chunks = self.partition(df, key)
+        result.update({"chunks": len(chunks), "errors": []})
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(process_chunk, chunk) for chunk in chunks]
+            for index, future in enumerate(futures):
+                try:
+                    chunk_result = future.result()
+                except PyMongoError as error:
+                    result["errors"].append({"chunk": index, "rows": len(chunks[index]),
+                                             "error": str(error)})
+                    continue
+                for name, value in chunk_result.items():
+                    if isinstance(value, list):
+                        result.setdefault(name, []).extend(value)
+                    else:
+                        result[name] = result.get(name, 0) + value
+        return result
+
+    @staticmethod
+    def _journaled(process_chunk: Callable[[pd.DataFrame], dict], key: str,
+                   journal_run: IngestionRun,
+                   missing: set[str]) -> Callable[[pd.DataFrame], dict]:
+        """process_chunk followed by the checkpoint of the students of the chunk found
+        in the database"""
+
+        def process_and_record(chunk: pd.DataFrame) -> dict:
+            counts = process_chunk(chunk)
+            student_ids = chunk[key].astype(str).unique().tolist()
+            journal_run.record_batch([student_id for student_id in student_ids
+                                      if student_id not in missing],
+                                     {"rows": len(chunk), **counts})
+            return counts
+
+        return process_and_record
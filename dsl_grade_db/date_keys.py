@@ -0,0 +1,56 @@
+from __future__ import annotations
+
+from datetime import datetime
+
+# format of the written exam dates ("08/09/2023") and of the project ids ("1/3/2023")
+DATE_FORMAT = '%d/%m/%Y'
+
+
+def to_date_key(date) -> datetime | None:
+    """The sortable key of a written exam date or of a project id: the BSON datetime
+    of the day. None if the value is not a date in DATE_FORMAT"""
+    try:
+        return datetime.strptime(date, DATE_FORMAT)
+    except (TypeError, ValueError):
+        return None
+
+
+def entry_date_key(entry: dict, field: str) -> datetime | None:
+    """The date key of an element of written_grades (field="date") or of
+    project_grades (field="project_id"), parsed from the field for the elements
+    stored before the date_key was introduced. None if the field is not a date,
+    as date_key_expression"""
+    if entry.get('date_key') is not None:
+        return entry['date_key']
+    return to_date_key(entry.get(field))
+
+
+def entry_sort_key(entry: dict, field: str) -> datetime:
+    """entry_date_key for sorting: the elements without a date come first, as null
+    in the comparisons of the server"""
+    return entry_date_key(entry, field) or datetime.min
+
+
+def date_key_expression(entry, field: str) -> dict:
+    """Aggregation expression of entry_date_key, for the entry expression (e.g. "$$this").
+    The string is split instead of parsed with $dateFromString, whose %d and %m
+    require two digits while the project ids have one. null if the field is not
+    made of three numbers"""
+
+    def part(index):
+        return {"$convert": {"input": {"$arrayElemAt": ["$$parts", index]}, "to": "int",
+                             "onError": None, "onNull": None}}
+
+    return {"$let": {
+        "vars": {"entry": entry},
+        "in": {"$ifNull": ["$$entry.date_key", {"$cond": [
+            {"$eq": [{"$type": "$$entry." + field}, "string"]},
+            {"$let": {
+                "vars": {"parts": {"$split": ["$$entry." + field, "/"]}},
+                "in": {"$cond": [
+                    {"$eq": [{"$size": "$$parts"}, 3]},
+                    {"$dateFromParts": {"year": part(2), "month": part(1), "day": part(0)}},
+                    None]}
+            }},
+            None]}]}
+    }}
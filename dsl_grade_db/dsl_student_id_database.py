@@ -1,14 +1,169 @@
 from __future__ import annotations
 
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Iterable
+
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import UpdateOne
+
+from .mongo_db_connection import MongoDBConnection, get_connection
+
+# maximum number of IDs in the $in of a single query
+IN_QUERY_CHUNK_SIZE = 1000
+
+
+class StudentIdCache:
+    """
+    The student ID <-> ObjectID mapping cached in both directions, up to cache_size
+    students (least recently used are evicted first). One cache is shared by all the
+    MongoDBStudentId and AsyncMongoDBStudentId of a connection and a database (see
+    get_student_id_cache), so that the invalidation done by one of them reaches all
+    the others. The cache is guarded by a lock, since the parallel ingestion resolves
+    the students from several threads.
+    """
+
+    def __init__(self, cache_size: int = 100_000):
+        self.cache_size = cache_size
+        self._db_ids: OrderedDict[str, ObjectId] = OrderedDict()
+        self._student_ids: dict[ObjectId, str] = {}
+        self._lock = threading.RLock()
+
+    def __len__(self) -> int:
+        return len(self._db_ids)
+
+    def clear(self):
+        with self._lock:
+            self._db_ids.clear()
+            self._student_ids.clear()
+
+    def put(self, student_id: str, db_id: ObjectId):
+        with self._lock:
+            self.invalidate(student_id)
+            # a student ID changed elsewhere: the ObjectID has one student ID only
+            old_student_id = self._student_ids.get(db_id)
+            if old_student_id is not None:
+                self.invalidate(old_student_id)
+            self._db_ids[student_id] = db_id
+            self._student_ids[db_id] = student_id
+            while len(self._db_ids) > self.cache_size:
+                _, evicted_db_id = self._db_ids.popitem(last=False)
+                self._student_ids.pop(evicted_db_id, None)
+
+    def invalidate(self, student_id: str):
+        with self._lock:
+            db_id = self._db_ids.pop(student_id, None)
+            if db_id is not None:
+                self._student_ids.pop(db_id, None)
+
+    def db_id(self, student_id: str) -> ObjectId | None:
+        with self._lock:
+            if student_id in self._db_ids:
+                self._db_ids.move_to_end(student_id)
+                return self._db_ids[student_id]
+            return None
+
+    def student_id(self, db_id: ObjectId) -> str | None:
+        with self._lock:
+            student_id = self._student_ids.get(db_id)
+            if student_id is not None:
+                self._db_ids.move_to_end(student_id)
+            return student_id
+
+    def db_ids(self, student_ids: list[str]) -> dict[str, ObjectId]:
+        """The ObjectIDs of the student IDs in the cache"""
+        db_ids = {}
+        for student_id in student_ids:
+            db_id = self.db_id(student_id)
+            if db_id is not None:
+                db_ids[student_id] = db_id
+        return db_ids
+
+    def student_ids(self, db_ids: list[ObjectId]) -> dict[ObjectId, str]:
+        """The student IDs of the ObjectIDs in the cache"""
+        student_ids = {}
+        for db_id in db_ids:
+            student_id = self.student_id(db_id)
+            if student_id is not None:
+                student_ids[db_id] = student_id
+        return student_ids
+
+
+# the caches of each connection, by database name: dropped with the connection
+_caches: weakref.WeakKeyDictionary[MongoDBConnection, dict[str, StudentIdCache]] = \
+    weakref.WeakKeyDictionary()
+_caches_lock = threading.Lock()
+
+
+def get_student_id_cache(connection: MongoDBConnection, database_name: str,
+                         cache_size: int = 100_000) -> StudentIdCache:
+    """Get the student ID cache of the database of the connection, creating it with
+    cache_size if needed"""
+    with _caches_lock:
+        caches = _caches.setdefault(connection, {})
+        if database_name not in caches:
+            caches[database_name] = StudentIdCache(cache_size)
+        return caches[database_name]
+
+
+def clear_student_id_caches():
+    """Clear the caches of all the connections, e.g. after the collection of the
+    student IDs has been modified outside of MongoDBStudentId"""
+    with _caches_lock:
+        caches = [cache for database_caches in _caches.values()
+                  for cache in database_caches.values()]
+    for cache in caches:
+        cache.clear()
+
+
+def _chunks(values: list):
+    """The chunks of values of the $in queries"""
+    for start in range(0, len(values), IN_QUERY_CHUNK_SIZE):
+        yield values[start:start + IN_QUERY_CHUNK_SIZE]
 
 
 class MongoDBStudentId:
-    def __init__(self, database_name="DSL_grade_dbs"):
-        self.client = MongoClient()
+    """
+    The student ID <-> ObjectID mapping is cached in both directions, up to cache_size
+    students (least recently used are evicted first). The cache is shared by all the
+    objects of the same connection and database and it is invalidated by
+    update_student_id and remove_student_id, hence the collection must be modified
+    only through this class while it is in use.
+    """
+
+    def __init__(self, database_name="DSL_grade_dbs",
+                 connection: MongoDBConnection | None = None,
+                 cache_size: int = 100_000):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
         self.collection = self.db["enrolled_students"]
+        self.cache = get_student_id_cache(self.connection, database_name, cache_size)
+
+    @property
+    def cache_size(self) -> int:
+        return self.cache.cache_size
+
+    @cache_size.setter
+    def cache_size(self, cache_size: int):
+        self.cache.cache_size = cache_size
+
+    def clear_cache(self):
+        self.cache.clear()
+
+    def warm_cache(self) -> int:
+        """
+        Fill the cache with a single projected scan of the collection.
+
+        Returns:
+            int: The number of students in the cache.
+        """
+        documents = self.collection.find({"MATRICOLA": {"$exists": True}},
+                                         {"MATRICOLA": 1}).limit(self.cache_size)
+        for document in documents:
+            self.cache.put(document["MATRICOLA"], document["_id"])
+        return len(self.cache)
 
     def add_student_id(self, document: dict):
         """
@@ -20,7 +175,30 @@ class MongoDBStudentId:
         document["MATRICOLA"] = str(document["MATRICOLA"])
         student_id = document['MATRICOLA']
         if not self.collection.find_one({"MATRICOLA": student_id}):
-            self.collection.insert_one(document)
+            result = self.collection.insert_one(document)
+            self.cache.put(student_id, result.inserted_id)
+
+    def add_student_ids(self, documents: list[dict]) -> int:
+        """
+        Add many student IDs to the database with a single bulk write.
+        As for add_student_id, a student ID is added ONLY IF it does not exist yet.
+
+        Args:
+            documents (list[dict]): The documents to be added to the database.
+
+        Returns:
+            int: The number of student IDs actually inserted.
+        """
+        requests = []
+        for document in documents:
+            document = {**document, "MATRICOLA": str(document["MATRICOLA"])}
+            requests.append(UpdateOne({"MATRICOLA": document["MATRICOLA"]},
+                                      {"$setOnInsert": document},
+                                      upsert=True))
+        if not requests:
+            return 0
+        result = self.collection.bulk_write(requests, ordered=False)
+        return result.upserted_count
 
     def remove_student_id(self, student_id: str):
         """
@@ -30,6 +208,7 @@ class MongoDBStudentId:
             student_id (str): The student ID to be removed.
         """
         self.collection.delete_one({"MATRICOLA": student_id})
+        self.cache.invalidate(student_id)
 
     def update_student_id(self, student_id: str, new_student_id: str):
         """
@@ -45,6 +224,8 @@ class MongoDBStudentId:
             new_student_id = str(new_student_id)
         self.collection.update_one({"MATRICOLA": student_id},
                                    {"$set": {"MATRICOLA": new_student_id}})
+        self.cache.invalidate(student_id)
+        self.cache.invalidate(new_student_id)
 
     def get_db_id_from(self, student_id: str) -> ObjectId | None:
         """
@@ -58,9 +239,13 @@ class MongoDBStudentId:
         """
         if not isinstance(student_id, str):
             student_id = str(student_id)
-        document = self.collection.find_one({"MATRICOLA": student_id})
+        db_id = self.cache.db_id(student_id)
+        if db_id is not None:
+            return db_id
+        document = self.collection.find_one({"MATRICOLA": student_id}, {"_id": 1})
         if not document:
             raise KeyError(f"Student ID '{student_id}' not found in the database.")
+        self.cache.put(student_id, document["_id"])
         return document["_id"]
 
     def get_student_id_from(self, db_id: ObjectId) -> str | None:
@@ -73,11 +258,64 @@ class MongoDBStudentId:
         Returns:
             str: The student ID value associated with the specified ObjectID.
         """
-        document = self.collection.find_one({"_id": db_id})
+        student_id = self.cache.student_id(db_id)
+        if student_id is not None:
+            return student_id
+        document = self.collection.find_one({"_id": db_id}, {"MATRICOLA": 1})
         if not document:
             raise KeyError(f"Database ID '{db_id}' not found in the database.")
+        self.cache.put(document["MATRICOLA"], db_id)
         return document["MATRICOLA"]
 
+    def get_db_ids_from(self, student_ids: Iterable[str]) -> tuple[
+        dict[str, ObjectId], list[str]]:
+        """
+        Retrieves the ObjectID values for many student IDs, with one query for each
+        chunk of student IDs not in the cache.
+
+        Args:
+            student_ids (Iterable[str]): The student IDs for which to retrieve the ObjectID.
+
+        Returns:
+            dict: The ObjectID associated with each student ID found in the database.
+            list: The student IDs not found in the database.
+        """
+        student_ids = list(dict.fromkeys(str(student_id) for student_id in student_ids))
+        db_ids = self.cache.db_ids(student_ids)
+        not_cached = [student_id for student_id in student_ids
+                      if student_id not in db_ids]
+        for chunk in _chunks(not_cached):
+            for document in self.collection.find({"MATRICOLA": {"$in": chunk}},
+                                                 {"MATRICOLA": 1}):
+                db_ids[document["MATRICOLA"]] = document["_id"]
+                self.cache.put(document["MATRICOLA"], document["_id"])
+        missing = [student_id for student_id in student_ids if student_id not in db_ids]
+        return db_ids, missing
+
+    def get_student_ids_from(self, db_ids: Iterable[ObjectId]) -> tuple[
+        dict[ObjectId, str], list[ObjectId]]:
+        """
+        Retrieves the student ID values for many ObjectIDs, with one query for each
+        chunk of ObjectIDs not in the cache.
+
+        Args:
+            db_ids (Iterable[ObjectId]): The ObjectIDs for which to retrieve the student ID.
+
+        Returns:
+            dict: The student ID associated with each ObjectID found in the database.
+            list: The ObjectIDs not found in the database.
+        """
+        db_ids = list(dict.fromkeys(db_ids))
+        student_ids = self.cache.student_ids(db_ids)
+        not_cached = [db_id for db_id in db_ids if db_id not in student_ids]
+        for chunk in _chunks(not_cached):
+            for document in self.collection.find({"_id": {"$in": chunk}},
+                                                 {"MATRICOLA": 1}):
+                student_ids[document["_id"]] = document["MATRICOLA"]
+                self.cache.put(document["MATRICOLA"], document["_id"])
+        missing = [db_id for db_id in db_ids if db_id not in student_ids]
+        return student_ids, missing
+
     def set_project_id(self, project_id: str):
         if not isinstance(project_id, str):
             project_id = str(project_id)
@@ -89,5 +327,5 @@ class MongoDBStudentId:
         return self.collection.find_one({"project_id": "project_id"})['id']
 
     def close(self):
-        """Close the database"""
-        self.client.close()
+        """Kept for compatibility: the connection is shared with the other objects
+        using it, hence only its owner closes it (MongoDBConnection.close)"""
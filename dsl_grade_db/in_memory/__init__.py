@@ -0,0 +1,11 @@
+"""
+Pure-Python storage engine with the subset of the pymongo (and motor) API used by the
+library: queries with the operators of the library ($elemMatch, $or, $in, $lt, ...),
+update operators and update pipelines, aggregation, bulk writes and hash indexes
+(unique and partial) used by the equality queries. Select it with
+MongoDBConnection(backend="memory") or DSL_GRADE_DB_BACKEND=memory.
+"""
+from .asynchronous import AsyncInMemoryClient
+from .client import InMemoryClient, InMemoryStorage
+
+__all__ = ['InMemoryClient', 'InMemoryStorage', 'AsyncInMemoryClient']
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+from pymongo.errors import OperationFailure
+
+from .expressions import evaluate, get_field
+from .query import matches, project
+from .values import MISSING, clone, hashable, sort_key, truthy
+
+# Stages allowed in the update pipelines
+_UPDATE_STAGES = {"$addFields", "$set", "$project", "$unset", "$replaceRoot",
+                  "$replaceWith"}
+
+
+def run_stages(documents, pipeline: list, update_pipeline: bool = False,
+               database=None, collection=None):
+    """Run the aggregation pipeline on the iterable of documents"""
+    documents = iter(documents)
+    for stage in pipeline:
+        if len(stage) != 1:
+            raise OperationFailure("A pipeline stage specification object must contain "
+                                   "exactly one field.")
+        name, argument = next(iter(stage.items()))
+        if update_pipeline and name not in _UPDATE_STAGES:
+            raise OperationFailure(f"{name} is not allowed to be used within an update")
+        if name not in _STAGES:
+            raise OperationFailure(f"Unrecognized pipeline stage name: '{name}'")
+        documents = _STAGES[name](documents, argument, database, collection)
+    return list(documents)
+
+
+def _match(documents, query, database, collection):
+    return (document for document in documents if matches(document, query))
+
+
+def _set_computed(document: dict, path: str, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        child = document.get(part)
+        if not isinstance(child, dict):
+            child = document[part] = {}
+        document = child
+    if value is MISSING:
+        document.pop(parts[-1], None)
+    else:
+        document[parts[-1]] = value
+
+
+def _add_fields(documents, fields, database, collection):
+    for document in documents:
+        result = clone(document)
+        for path, expression in fields.items():
+            # the expressions see the document before the stage
+            _set_computed(result, path, evaluate(expression, document))
+        yield result
+
+
+def _is_computed(value) -> bool:
+    return not (isinstance(value, (bool, int, float)) and not isinstance(value, str))
+
+
+def _project(documents, projection, database, collection):
+    computed = {key: value for key, value in projection.items()
+                if _is_computed(value)}
+    plain = {key: value for key, value in projection.items()
+             if key not in computed}
+    if not computed:
+        yield from (project(document, plain) for document in documents)
+        return
+    if any(not truthy(value) for key, value in plain.items() if key != "_id"):
+        raise OperationFailure("Cannot use expressions in an exclusion projection")
+    include_id = truthy(plain.pop("_id", 1)) and "_id" not in computed
+    for document in documents:
+        result = project(document, {**plain, "_id": 0}) if plain else {}
+        if include_id and "_id" in document:
+            result = {"_id": document["_id"], **result}
+        for path, expression in computed.items():
+            _set_computed(result, path, evaluate(expression, document))
+        yield result
+
+
+def _unset(documents, fields, database, collection):
+    fields = [fields] if isinstance(fields, str) else fields
+    return _project(documents, {field: 0 for field in fields}, database, collection)
+
+
+def _replace_root(documents, argument, database, collection):
+    for document in documents:
+        root = evaluate(argument["newRoot"], document)
+        if not isinstance(root, dict):
+            raise OperationFailure("'newRoot' expression must evaluate to an object")
+        yield root
+
+
+def _replace_with(documents, argument, database, collection):
+    return _replace_root(documents, {"newRoot": argument}, database, collection)
+
+
+def sort_documents(documents: list, sort) -> list:
+    documents = list(documents)
+    for field, direction in reversed(list(sort.items())):
+        documents.sort(key=lambda document: sort_key(_sort_value(document, field,
+                                                                 direction)),
+                       reverse=direction < 0)
+    return documents
+
+
+def _sort_value(document, field: str, direction: int):
+    value = get_field(document, field)
+    if isinstance(value, list):
+        # the arrays are sorted by their smallest (ascending) or largest element
+        if not value:
+            return MISSING
+        return (min if direction > 0 else max)(value, key=sort_key)
+    return value
+
+
+def _sort(documents, sort, database, collection):
+    return iter(sort_documents(documents, sort))
+
+
+def _limit(documents, limit, database, collection):
+    for index, document in enumerate(documents):
+        if index >= limit:
+            return
+        yield document
+
+
+def _skip(documents, skip, database, collection):
+    for index, document in enumerate(documents):
+        if index >= skip:
+            yield document
+
+
+def _count(documents, field, database, collection):
+    count = sum(1 for _ in documents)
+    return iter([{field: count}] if count else [])
+
+
+_ACCUMULATORS = {"$sum", "$avg", "$max", "$min", "$first", "$last", "$push",
+                 "$addToSet", "$count"}
+
+
+def _group(documents, specification, database, collection):
+    groups = {}
+    for document in documents:
+        key = evaluate(specification["_id"], document)
+        key = None if key is MISSING else key
+        group = groups.setdefault(hashable(key), {"_id": key, "values": {}})
+        for field, accumulator in specification.items():
+            if field == "_id":
+                continue
+            operator, expression = next(iter(accumulator.items()))
+            if operator not in _ACCUMULATORS:
+                raise OperationFailure(f"unknown group operator '{operator}'")
+            value = 1 if operator == "$count" else evaluate(expression, document)
+            group["values"].setdefault(field, []).append(value)
+    for group in groups.values():
+        result = {"_id": group["_id"]}
+        for field, accumulator in specification.items():
+            if field == "_id":
+                continue
+            operator = next(iter(accumulator))
+            result[field] = _accumulate(operator, group["values"].get(field, []))
+        yield result
+
+
+def _accumulate(operator: str, values: list):
+    present = [value for value in values if value is not MISSING]
+    numbers = [value for value in present if isinstance(value, (int, float))
+               and not isinstance(value, bool)]
+    if operator in ("$sum", "$count"):
+        return sum(numbers)
+    if operator == "$avg":
+        return sum(numbers) / len(numbers) if numbers else None
+    if operator in ("$max", "$min"):
+        present = [value for value in present if value is not None]
+        if not present:
+            return None
+        return (max if operator == "$max" else min)(present, key=sort_key)
+    if operator == "$first":
+        return None if not values or values[0] is MISSING else values[0]
+    if operator == "$last":
+        return None if not values or values[-1] is MISSING else values[-1]
+    if operator == "$push":
+        return present
+    unique = {}
+    for value in present:
+        unique.setdefault(hashable(value), value)
+    return list(unique.values())
+
+
+def _unwind(documents, argument, database, collection):
+    if isinstance(argument, str):
+        argument = {"path": argument}
+    path = argument["path"][1:]
+    keep_empty = argument.get("preserveNullAndEmptyArrays", False)
+    index_field = argument.get("includeArrayIndex")
+    for document in documents:
+        value = get_field(document, path)
+        if isinstance(value, list) and value:
+            for index, item in enumerate(value):
+                result = clone(document)
+                _set_computed(result, path, item)
+                if index_field:
+                    result[index_field] = index
+                yield result
+        elif isinstance(value, list) or value is MISSING or value is None:
+            if keep_empty:
+                result = clone(document)
+                if index_field:
+                    result[index_field] = None
+                yield result
+        else:
+            result = clone(document)
+            if index_field:
+                result[index_field] = None
+            yield result
+
+
+def _lookup(documents, argument, database, collection):
+    if database is None:
+        raise OperationFailure("$lookup requires a database")
+    foreign = database[argument["from"]]
+    foreign_documents = foreign.find({})
+    foreign_documents = list(foreign_documents)
+    for document in documents:
+        local = get_field(document, argument["localField"])
+        local_values = local if isinstance(local, list) else [local]
+        keys = {hashable(value) for value in local_values}
+        result = clone(document)
+        result[argument["as"]] = [
+            foreign_document for foreign_document in foreign_documents
+            if _foreign_matches(foreign_document, argument["foreignField"], keys)]
+        yield result
+
+
+def _foreign_matches(document, field: str, keys: set) -> bool:
+    value = get_field(document, field)
+    values = value if isinstance(value, list) else [value]
+    return any(hashable(item) in keys for item in values)
+
+
+def _index_stats(documents, argument, database, collection):
+    if collection is None:
+        raise OperationFailure("$indexStats requires a collection")
+    return iter(collection._index_stats())
+
+
+_STAGES = {
+    "$match": _match,
+    "$addFields": _add_fields,
+    "$set": _add_fields,
+    "$project": _project,
+    "$unset": _unset,
+    "$replaceRoot": _replace_root,
+    "$replaceWith": _replace_with,
+    "$sort": _sort,
+    "$limit": _limit,
+    "$skip": _skip,
+    "$count": _count,
+    "$group": _group,
+    "$unwind": _unwind,
+    "$lookup": _lookup,
+    "$indexStats": _index_stats,
+}
@@ -0,0 +1,129 @@
+from __future__ import annotations
+
+from .client import InMemoryClient, InMemoryStorage
+from .collection import InMemoryCollection, InMemoryCursor
+
+
+class AsyncInMemoryCursor:
+    """Cursor with the asyncio interface of motor's cursors"""
+
+    def __init__(self, cursor: InMemoryCursor):
+        self._cursor = cursor
+
+    def sort(self, key_or_list, direction=None):
+        self._cursor.sort(key_or_list, direction)
+        return self
+
+    def limit(self, limit: int):
+        self._cursor.limit(limit)
+        return self
+
+    def skip(self, skip: int):
+        self._cursor.skip(skip)
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._cursor.batch_size(batch_size)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._cursor)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length: int | None = None) -> list:
+        documents = []
+        for document in self._cursor:
+            documents.append(document)
+            if length and len(documents) >= length:
+                break
+        return documents
+
+    def close(self):
+        self._cursor.close()
+
+
+class AsyncInMemoryCollection:
+    """Collection with the asyncio interface of motor: the operations are coroutines
+    and the queries return AsyncInMemoryCursor"""
+
+    def __init__(self, collection: InMemoryCollection):
+        self.delegate = collection
+        self.name = collection.name
+
+    def find(self, *args, **kwargs) -> AsyncInMemoryCursor:
+        return AsyncInMemoryCursor(self.delegate.find(*args, **kwargs))
+
+    def aggregate(self, pipeline: list, **kwargs) -> AsyncInMemoryCursor:
+        return AsyncInMemoryCursor(self.delegate.aggregate(pipeline, **kwargs))
+
+    def list_indexes(self) -> AsyncInMemoryCursor:
+        return AsyncInMemoryCursor(self.delegate.list_indexes())
+
+    def __getattr__(self, name: str):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        method = getattr(self.delegate, name)
+
+        async def coroutine(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return coroutine
+
+
+class AsyncInMemoryDatabase:
+    def __init__(self, database):
+        self.delegate = database
+        self.name = database.name
+
+    def __getitem__(self, name: str) -> AsyncInMemoryCollection:
+        return AsyncInMemoryCollection(self.delegate[name])
+
+    def __getattr__(self, name: str) -> AsyncInMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> AsyncInMemoryCollection:
+        return self[name]
+
+    async def list_collection_names(self, **kwargs) -> list[str]:
+        return self.delegate.list_collection_names()
+
+    async def drop_collection(self, name_or_collection, **kwargs):
+        self.delegate.drop_collection(getattr(name_or_collection, "name",
+                                              name_or_collection))
+
+    async def command(self, command, **kwargs) -> dict:
+        return self.delegate.command(command, **kwargs)
+
+
+class AsyncInMemoryClient:
+    """In-process replacement of motor's AsyncIOMotorClient, on the same storage of
+    InMemoryClient"""
+
+    def __init__(self, host=None, storage: InMemoryStorage | None = None,
+                 event_listeners=None, **kwargs):
+        self.delegate = InMemoryClient(host, storage=storage,
+                                       event_listeners=event_listeners)
+
+    def __getitem__(self, name: str) -> AsyncInMemoryDatabase:
+        return AsyncInMemoryDatabase(self.delegate[name])
+
+    def __getattr__(self, name: str) -> AsyncInMemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> AsyncInMemoryDatabase:
+        return self[name]
+
+    async def drop_database(self, name_or_database):
+        self.delegate.drop_database(getattr(name_or_database, "name", name_or_database))
+
+    def close(self):
+        self.delegate.close()
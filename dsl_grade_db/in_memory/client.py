@@ -0,0 +1,175 @@
+from __future__ import annotations
+
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+
+from pymongo.errors import BulkWriteError, InvalidOperation, OperationFailure, WriteError
+
+from .collection import CollectionData, InMemoryCollection
+
+
+class InMemoryStorage:
+    """The databases of the in-memory engine: the clients sharing a storage see
+    the same data, as the clients connected to the same server"""
+
+    def __init__(self):
+        self.databases: dict[str, dict[str, CollectionData]] = {}
+        self.lock = threading.Lock()
+
+    def collection_data(self, database_name: str, name: str) -> CollectionData:
+        with self.lock:
+            collections = self.databases.setdefault(database_name, {})
+            if name not in collections:
+                collections[name] = CollectionData()
+            return collections[name]
+
+    def drop_collection(self, database_name: str, name: str):
+        with self.lock:
+            self.databases.get(database_name, {}).pop(name, None)
+
+    def drop_database(self, database_name: str):
+        with self.lock:
+            self.databases.pop(database_name, None)
+
+
+class InMemoryDatabase:
+    def __init__(self, client: InMemoryClient, name: str):
+        self.client = client
+        self.name = name
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        return InMemoryCollection(self, name)
+
+    def __getattr__(self, name: str) -> InMemoryCollection:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name: str, **kwargs) -> InMemoryCollection:
+        return self[name]
+
+    def _collection_data(self, name: str) -> CollectionData:
+        return self.client._storage.collection_data(self.name, name)
+
+    def list_collection_names(self, **kwargs) -> list[str]:
+        return list(self.client._storage.databases.get(self.name, {}))
+
+    def drop_collection(self, name_or_collection, **kwargs):
+        name = getattr(name_or_collection, "name", name_or_collection)
+        self.client._storage.drop_collection(self.name, name)
+
+    def command(self, command, **kwargs) -> dict:
+        """Only ping, the one command sent by the library (to check the server).
+        The other commands fail as the commands unknown to the server"""
+        name = command if isinstance(command, str) else next(iter(command))
+        with self.client._command(self.name, name, {name: 1} if isinstance(command, str)
+                                  else dict(command)):
+            if name == "ping":
+                return {"ok": 1.0}
+            raise OperationFailure(f"no such command: '{name}' (in-memory storage)", 59)
+
+
+class _CommandEvent:
+    """The attributes of pymongo's command monitoring events read by the listeners"""
+
+    def __init__(self, command_name: str, database_name: str, command: dict,
+                 request_id: int, duration_micros: int = 0):
+        self.command_name = command_name
+        self.database_name = database_name
+        self.command = command
+        self.request_id = request_id
+        self.operation_id = request_id
+        self.connection_id = ("memory", 0)
+        self.duration_micros = duration_micros
+        self.reply = {"ok": 1}
+        self.failure = None
+
+
+class InMemoryClient:
+    """In-process replacement of MongoClient: every operation is executed on the
+    InMemoryStorage, without network round trips"""
+
+    _default_storage = InMemoryStorage()
+    _request_ids = itertools.count(1)
+
+    def __init__(self, host=None, storage: InMemoryStorage | None = None,
+                 event_listeners=None, **kwargs):
+        self._shared_storage = storage or InMemoryClient._default_storage
+        self._listeners = [listener for listener in event_listeners or []
+                           if hasattr(listener, "succeeded")]
+        self._closed = False
+
+    def _check_open(self):
+        """Raise InvalidOperation once closed, as MongoClient: a closed client is not
+        reopened, a new one is needed"""
+        if self._closed:
+            raise InvalidOperation("Cannot use MongoClient after close")
+
+    @property
+    def _storage(self) -> InMemoryStorage:
+        self._check_open()
+        return self._shared_storage
+
+    def __getitem__(self, name: str) -> InMemoryDatabase:
+        return InMemoryDatabase(self, name)
+
+    def __getattr__(self, name: str) -> InMemoryDatabase:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name: str, **kwargs) -> InMemoryDatabase:
+        return self[name]
+
+    def list_database_names(self) -> list[str]:
+        return list(self._storage.databases)
+
+    def drop_database(self, name_or_database):
+        name = getattr(name_or_database, "name", name_or_database)
+        self._storage.drop_database(name)
+
+    @contextmanager
+    def _command(self, database_name: str, command_name: str, command: dict):
+        """Execute the block as one command sent to the server: the started event is
+        published to the command listeners before the block, the succeeded event
+        (or the failed one) with the duration of the block after it. As on a server,
+        the write errors are in the reply of a command that succeeded."""
+        self._check_open()
+        if not self._listeners:
+            yield
+            return
+        request_id = next(InMemoryClient._request_ids)
+        started = _CommandEvent(command_name, database_name, command, request_id)
+        for listener in self._listeners:
+            listener.started(started)
+        start = time.perf_counter()
+        failure = None
+        try:
+            yield
+        except (WriteError, BulkWriteError):
+            raise
+        except Exception as error:
+            failure = error
+            raise
+        finally:
+            finished = _CommandEvent(command_name, database_name, command, request_id,
+                                     int((time.perf_counter() - start) * 1e6))
+            if failure is None:
+                for listener in self._listeners:
+                    listener.succeeded(finished)
+            else:
+                finished.failure = {"ok": 0, "errmsg": str(failure)}
+                for listener in self._listeners:
+                    if hasattr(listener, "failed"):
+                        listener.failed(finished)
+
+    def close(self):
+        self._closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
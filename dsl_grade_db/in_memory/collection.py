@@ -0,0 +1,590 @@
+from __future__ import annotations
+
+import threading
+from typing import Any, Iterable, Mapping
+
+from bson import ObjectId
+from pymongo import IndexModel
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure, \
+    WriteError
+from pymongo.operations import DeleteMany, DeleteOne, InsertOne, ReplaceOne, \
+    UpdateMany, UpdateOne
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, \
+    InsertOneResult, UpdateResult
+
+from .aggregation import run_stages, sort_documents
+from .query import _expand, is_operator_dict, lookup, matches, project
+from .update import apply_update, seed_document, validate_update
+from .values import clone, hashable
+
+
+class _HashIndex:
+    """Hash index on the first field of the key, with the unique constraint on the
+    whole key. The documents outside the partial filter are not indexed."""
+
+    def __init__(self, name: str, key: list[tuple[str, Any]], unique: bool = False,
+                 partial_filter: dict | None = None):
+        self.name = name
+        self.key = key
+        self.field = key[0][0]
+        self.unique = unique
+        self.partial_filter = partial_filter
+        self.entries: dict[Any, set] = {}
+
+    def info(self) -> dict:
+        info = {"v": 2, "key": list(self.key)}
+        if self.unique:
+            info["unique"] = True
+        if self.partial_filter is not None:
+            info["partialFilterExpression"] = self.partial_filter
+        return info
+
+    def covers(self, document: dict) -> bool:
+        return self.partial_filter is None or matches(document, self.partial_filter)
+
+    def serves(self, values: list) -> bool:
+        """Whether all the documents with one of the values of the field are indexed:
+        always without partial filter, otherwise only if the filter is on the field
+        and it holds for the values (e.g. {"$exists": True} for the values not null)"""
+        if self.partial_filter is None:
+            return True
+        if any(key != self.field for key in self.partial_filter) or None in values:
+            return False
+        return all(matches(seed_document({self.field: value}), self.partial_filter)
+                   for value in values)
+
+    def hash_values(self, document: dict) -> set:
+        values = _expand(lookup(document, self.field)) or [None]
+        return {hashable(value) for value in values}
+
+    def unique_key(self, document: dict):
+        return tuple(hashable(lookup(document, field)) for field, _ in self.key)
+
+    def add(self, document_key, document: dict):
+        if self.covers(document):
+            for value in self.hash_values(document):
+                self.entries.setdefault(value, set()).add(document_key)
+
+    def remove(self, document_key, document: dict):
+        if self.covers(document):
+            for value in self.hash_values(document):
+                keys = self.entries.get(value)
+                if keys is not None:
+                    keys.discard(document_key)
+                    if not keys:
+                        del self.entries[value]
+
+    def candidates(self, values: Iterable) -> set:
+        keys = set()
+        for value in values:
+            keys |= self.entries.get(hashable(value), set())
+        return keys
+
+
+class CollectionData:
+    """The documents of a collection, shared by all the clients of the storage"""
+
+    def __init__(self):
+        self.documents: dict[Any, dict] = {}
+        self.indexes: dict[str, _HashIndex] = {
+            "_id_": _HashIndex("_id_", [("_id", 1)], unique=True)}
+        self.accesses: dict[str, int] = {}
+        self.lock = threading.RLock()
+
+
+class InMemoryCursor:
+    """Cursor over the result of a query, with the options of pymongo's Cursor"""
+
+    def __init__(self, fetch, sort=None, limit: int = 0, skip: int = 0):
+        self._fetch = fetch
+        self._sort = sort
+        self._limit = limit
+        self._skip = skip
+        self._iterator = None
+
+    def _check_not_started(self):
+        if self._iterator is not None:
+            raise OperationFailure("cannot set options after executing query")
+
+    def sort(self, key_or_list, direction=None):
+        self._check_not_started()
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = dict(key_or_list)
+        return self
+
+    def limit(self, limit: int):
+        self._check_not_started()
+        self._limit = limit
+        return self
+
+    def skip(self, skip: int):
+        self._check_not_started()
+        self._skip = skip
+        return self
+
+    def batch_size(self, batch_size: int):
+        self._check_not_started()
+        return self
+
+    def _documents(self):
+        documents = self._fetch(self._sort)
+        if self._skip:
+            documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:abs(self._limit)]
+        return iter(documents)
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._iterator is None:
+            self._iterator = self._documents()
+        return next(self._iterator)
+
+    next = __next__
+
+    def rewind(self):
+        self._iterator = None
+        return self
+
+    def close(self):
+        self._iterator = iter(())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def _index_key(keys) -> list[tuple[str, Any]]:
+    if isinstance(keys, str):
+        return [(keys, 1)]
+    if isinstance(keys, Mapping):
+        return list(keys.items())
+    return [(key, 1) if isinstance(key, str) else tuple(key) for key in keys]
+
+
+def _default_index_name(key: list[tuple[str, Any]]) -> str:
+    return "_".join(f"{field}_{direction}" for field, direction in key)
+
+
+class InMemoryCollection:
+    """Collection of the in-memory storage with the subset of the API of
+    pymongo's Collection used by the library"""
+
+    def __init__(self, database, name: str):
+        self.database = database
+        self.name = name
+        self.full_name = f"{database.name}.{name}"
+
+    def __getitem__(self, name: str) -> InMemoryCollection:
+        return self.database[f"{self.name}.{name}"]
+
+    def __eq__(self, other):
+        return isinstance(other, InMemoryCollection) and \
+            self.full_name == other.full_name
+
+    def __hash__(self):
+        return hash(self.full_name)
+
+    def __repr__(self):
+        return f"InMemoryCollection({self.full_name!r})"
+
+    @property
+    def _data(self) -> CollectionData:
+        return self.database._collection_data(self.name)
+
+    def _command(self, command_name: str, command: dict):
+        return self.database.client._command(self.database.name, command_name, command)
+
+    # ---- reads ----
+
+    def _candidates(self, data: CollectionData, query: dict | None) -> list:
+        """Keys of the documents that can match the query, through a hash index
+        when the query has an equality on an indexed field"""
+        for key, condition in (query or {}).items():
+            if key.startswith("$"):
+                continue
+            if is_operator_dict(condition):
+                if "$eq" in condition:
+                    values = [condition["$eq"]]
+                elif "$in" in condition and not any(
+                        isinstance(value, (dict, list)) for value in condition["$in"]):
+                    values = condition["$in"]
+                else:
+                    continue
+            elif isinstance(condition, (dict, list)) or condition is None:
+                continue
+            else:
+                values = [condition]
+            for index in data.indexes.values():
+                if index.field == key and index.serves(values):
+                    data.accesses[index.name] = data.accesses.get(index.name, 0) + 1
+                    keys = index.candidates(values)
+                    return [document_key for document_key in data.documents
+                            if document_key in keys] if len(keys) > 1 else list(keys)
+        return list(data.documents)
+
+    def _matching(self, data: CollectionData, query: dict | None) -> list:
+        if query is not None and not isinstance(query, Mapping):
+            query = {"_id": query}
+        return [document_key for document_key in self._candidates(data, query)
+                if matches(data.documents[document_key], query)]
+
+    def find(self, filter: dict | None = None, projection=None, skip: int = 0,
+             limit: int = 0, sort=None, batch_size: int = 0, **kwargs):
+        if isinstance(projection, (list, tuple)):
+            projection = {field: 1 for field in projection}
+        if sort is not None and not isinstance(sort, Mapping):
+            sort = dict(_index_key(sort))
+
+        def fetch(cursor_sort):
+            with self._command("find", {"find": self.name, "filter": filter or {}}):
+                data = self._data
+                with data.lock:
+                    documents = [data.documents[document_key]
+                                 for document_key in self._matching(data, filter)]
+                    if cursor_sort:
+                        documents = sort_documents(documents, cursor_sort)
+                    return [project(document, projection) for document in documents]
+
+        return InMemoryCursor(fetch, sort, limit, skip)
+
+    def find_one(self, filter=None, *args, **kwargs):
+        if filter is not None and not isinstance(filter, Mapping):
+            filter = {"_id": filter}
+        for document in self.find(filter, *args, **kwargs).limit(1):
+            return document
+        return None
+
+    def count_documents(self, filter: dict, **kwargs) -> int:
+        with self._command("aggregate", {"aggregate": self.name, "count": filter}):
+            data = self._data
+            with data.lock:
+                return len(self._matching(data, filter))
+
+    def estimated_document_count(self, **kwargs) -> int:
+        with self._command("count", {"count": self.name}):
+            return len(self._data.documents)
+
+    def distinct(self, key: str, filter: dict | None = None, **kwargs) -> list:
+        with self._command("distinct", {"distinct": self.name, "key": key}):
+            data = self._data
+            values = {}
+            with data.lock:
+                for document_key in self._matching(data, filter):
+                    for value in _expand(lookup(data.documents[document_key], key)):
+                        if not isinstance(value, list):
+                            values.setdefault(hashable(value), clone(value))
+            return list(values.values())
+
+    def aggregate(self, pipeline: list, **kwargs):
+        with self._command("aggregate", {"aggregate": self.name, "pipeline": pipeline}):
+            data = self._data
+            stages = pipeline
+            with data.lock:
+                if pipeline and "$indexStats" in pipeline[0]:
+                    documents = []
+                elif pipeline and "$match" in pipeline[0]:
+                    # the first $match selects the documents through the indexes
+                    documents = [data.documents[document_key] for document_key
+                                 in self._matching(data, pipeline[0]["$match"])]
+                    stages = pipeline[1:]
+                else:
+                    documents = list(data.documents.values())
+            # the stored documents are replaced by the writes, never modified, and the
+            # stages do not modify their input: only the results are cloned
+            results = [clone(document) for document in run_stages(
+                documents, stages, database=self.database, collection=self)]
+        return InMemoryCursor(lambda sort: results)
+
+    # ---- writes ----
+
+    def _check_unique(self, data: CollectionData, document: dict,
+                      document_key=None):
+        for index in data.indexes.values():
+            if not index.unique or not index.covers(document):
+                continue
+            unique_key = index.unique_key(document)
+            for other_key in index.candidates(
+                    [value for value in _expand(lookup(document, index.field))]
+                    or [None]):
+                if other_key != document_key and index.unique_key(
+                        data.documents[other_key]) == unique_key:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.full_name} "
+                        f"index: {index.name}", 11000,
+                        {"index": 0, "code": 11000, "keyPattern": dict(index.key),
+                         "errmsg": f"E11000 duplicate key error index: {index.name}"})
+
+    def _insert(self, data: CollectionData, document: dict):
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        stored = clone(document)
+        self._check_unique(data, stored)
+        document_key = hashable(stored["_id"])
+        data.documents[document_key] = stored
+        for index in data.indexes.values():
+            index.add(document_key, stored)
+        return stored["_id"]
+
+    def _replace(self, data: CollectionData, document_key, new_document: dict):
+        old_document = data.documents[document_key]
+        self._check_unique(data, new_document, document_key)
+        for index in data.indexes.values():
+            index.remove(document_key, old_document)
+        data.documents[document_key] = new_document
+        for index in data.indexes.values():
+            index.add(document_key, new_document)
+
+    def insert_one(self, document: dict, **kwargs) -> InsertOneResult:
+        with self._command("insert", {"insert": self.name, "documents": [document]}):
+            data = self._data
+            with data.lock:
+                return InsertOneResult(self._insert(data, document), True)
+
+    def insert_many(self, documents: Iterable[dict], ordered: bool = True,
+                    **kwargs) -> InsertManyResult:
+        documents = list(documents)
+        if not documents:
+            raise TypeError("documents must be a non-empty list")
+        with self._command("insert", {"insert": self.name, "documents": documents}):
+            self._bulk([InsertOne(document) for document in documents], ordered)
+        return InsertManyResult([document["_id"] for document in documents], True)
+
+    def _update(self, data: CollectionData, filter: dict, update, upsert: bool,
+                multi: bool, array_filters=None) -> dict:
+        validate_update(update)
+        keys = self._matching(data, filter)
+        if not multi:
+            keys = keys[:1]
+        result = {"n": len(keys), "nModified": 0}
+        for document_key in keys:
+            document = clone(data.documents[document_key])
+            before = hashable(document)
+            apply_update(document, update, filter, array_filters)
+            if hashable(document) != before:
+                self._replace(data, document_key, document)
+                result["nModified"] += 1
+        if not keys and upsert:
+            document = seed_document(filter)
+            if isinstance(update, list) or any(key.startswith("$") for key in update):
+                apply_update(document, update, filter, array_filters, is_insert=True)
+            result = {"n": 1, "nModified": 0, "upserted": self._insert(data, document)}
+        return result
+
+    def update_one(self, filter: dict, update, upsert: bool = False,
+                   array_filters=None, **kwargs) -> UpdateResult:
+        with self._command("update", {"update": self.name, "updates": [
+                {"q": filter, "u": update}]}):
+            data = self._data
+            with data.lock:
+                return UpdateResult(self._update(data, filter, update, upsert, False,
+                                                 array_filters), True)
+
+    def update_many(self, filter: dict, update, upsert: bool = False,
+                    array_filters=None, **kwargs) -> UpdateResult:
+        with self._command("update", {"update": self.name, "updates": [
+                {"q": filter, "u": update, "multi": True}]}):
+            data = self._data
+            with data.lock:
+                return UpdateResult(self._update(data, filter, update, upsert, True,
+                                                 array_filters), True)
+
+    def _replace_one(self, data: CollectionData, filter: dict, replacement: dict,
+                     upsert: bool) -> dict:
+        if any(key.startswith("$") for key in replacement):
+            raise ValueError("replacement can not include $ operators")
+        keys = self._matching(data, filter)[:1]
+        if keys:
+            document = clone(replacement)
+            document["_id"] = data.documents[keys[0]]["_id"]
+            modified = hashable(document) != hashable(data.documents[keys[0]])
+            self._replace(data, keys[0], document)
+            return {"n": 1, "nModified": int(modified)}
+        if upsert:
+            document = {**seed_document(filter), **clone(replacement)}
+            return {"n": 1, "nModified": 0, "upserted": self._insert(data, document)}
+        return {"n": 0, "nModified": 0}
+
+    def replace_one(self, filter: dict, replacement: dict, upsert: bool = False,
+                    **kwargs) -> UpdateResult:
+        with self._command("update", {"update": self.name, "updates": [
+                {"q": filter, "u": replacement}]}):
+            data = self._data
+            with data.lock:
+                return UpdateResult(self._replace_one(data, filter, replacement, upsert),
+                                    True)
+
+    def _delete(self, data: CollectionData, filter: dict, multi: bool) -> int:
+        keys = self._matching(data, filter)
+        if not multi:
+            keys = keys[:1]
+        for document_key in keys:
+            document = data.documents.pop(document_key)
+            for index in data.indexes.values():
+                index.remove(document_key, document)
+        return len(keys)
+
+    def delete_one(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._command("delete", {"delete": self.name, "deletes": [{"q": filter}]}):
+            data = self._data
+            with data.lock:
+                return DeleteResult({"n": self._delete(data, filter, False)}, True)
+
+    def delete_many(self, filter: dict, **kwargs) -> DeleteResult:
+        with self._command("delete", {"delete": self.name, "deletes": [{"q": filter}]}):
+            data = self._data
+            with data.lock:
+                return DeleteResult({"n": self._delete(data, filter, True)}, True)
+
+    def find_one_and_update(self, filter: dict, update, projection=None,
+                            upsert: bool = False, return_document: bool = False,
+                            array_filters=None, **kwargs):
+        with self._command("findAndModify", {"findAndModify": self.name,
+                                             "query": filter}):
+            data = self._data
+            with data.lock:
+                keys = self._matching(data, filter)[:1]
+                before = clone(data.documents[keys[0]]) if keys else None
+                result = self._update(data, filter, update, upsert, False, array_filters)
+                if not return_document:
+                    return project(before, projection) if before is not None else None
+                document_key = keys[0] if keys else hashable(result.get("upserted"))
+                after = data.documents.get(document_key)
+                return project(after, projection) if after is not None else None
+
+    def bulk_write(self, requests: list, ordered: bool = True,
+                   **kwargs) -> BulkWriteResult:
+        requests = list(requests)
+        if not requests:
+            raise OperationFailure("No operations provided")
+        with self._command("bulkWrite", {"bulkWrite": self.name, "ops": len(requests)}):
+            return self._bulk(requests, ordered)
+
+    def _bulk(self, requests: list, ordered: bool) -> BulkWriteResult:
+        result = {"writeErrors": [], "writeConcernErrors": [], "nInserted": 0,
+                  "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+                  "upserted": []}
+        data = self._data
+        with data.lock:
+            for index, request in enumerate(requests):
+                try:
+                    self._apply_request(data, index, request, result)
+                except (WriteError, OperationFailure) as error:
+                    result["writeErrors"].append({
+                        "index": index, "code": error.code or 2,
+                        "errmsg": str(error), "op": _request_document(request)})
+                    if ordered:
+                        break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    def _apply_request(self, data: CollectionData, index: int, request, result: dict):
+        if isinstance(request, InsertOne):
+            self._insert(data, request._doc)
+            result["nInserted"] += 1
+            return
+        if isinstance(request, (UpdateOne, UpdateMany)):
+            outcome = self._update(data, request._filter, request._doc,
+                                   bool(request._upsert),
+                                   isinstance(request, UpdateMany),
+                                   request._array_filters)
+        elif isinstance(request, ReplaceOne):
+            outcome = self._replace_one(data, request._filter, request._doc,
+                                        bool(request._upsert))
+        elif isinstance(request, (DeleteOne, DeleteMany)):
+            result["nRemoved"] += self._delete(data, request._filter,
+                                               isinstance(request, DeleteMany))
+            return
+        else:
+            raise TypeError(f"{request!r} is not a valid request")
+        if "upserted" in outcome:
+            result["nUpserted"] += 1
+            result["upserted"].append({"index": index, "_id": outcome["upserted"]})
+        else:
+            result["nMatched"] += outcome["n"]
+            result["nModified"] += outcome["nModified"]
+
+    # ---- indexes ----
+
+    def create_index(self, keys, **kwargs) -> str:
+        return self.create_indexes([IndexModel(keys, **kwargs)])[0]
+
+    def create_indexes(self, indexes: list, **kwargs) -> list[str]:
+        with self._command("createIndexes", {"createIndexes": self.name}):
+            names = []
+            data = self._data
+            with data.lock:
+                for model in indexes:
+                    spec = model.document
+                    key = _index_key(spec["key"])
+                    name = spec.get("name") or _default_index_name(key)
+                    index = _HashIndex(name, key, spec.get("unique", False),
+                                       spec.get("partialFilterExpression"))
+                    existing = data.indexes.get(name)
+                    if existing is not None:
+                        if existing.info() != index.info():
+                            raise OperationFailure(
+                                f"An existing index has the same name as the requested "
+                                f"index: {name}", 86)
+                        names.append(name)
+                        continue
+                    for document_key, document in data.documents.items():
+                        if index.unique and index.covers(document):
+                            unique_key = index.unique_key(document)
+                            for other_key in index.candidates(
+                                    _expand(lookup(document, index.field)) or [None]):
+                                if index.unique_key(
+                                        data.documents[other_key]) == unique_key:
+                                    raise DuplicateKeyError(
+                                        f"E11000 duplicate key error collection: "
+                                        f"{self.full_name} index: {name}", 11000)
+                        index.add(document_key, document)
+                    data.indexes[name] = index
+                    names.append(name)
+            return names
+
+    def index_information(self) -> dict:
+        with self._command("listIndexes", {"listIndexes": self.name}):
+            return {name: index.info() for name, index in self._data.indexes.items()}
+
+    def list_indexes(self):
+        return iter([{"name": name, **info}
+                     for name, info in self.index_information().items()])
+
+    def drop_index(self, index_or_name, **kwargs):
+        name = index_or_name if isinstance(index_or_name, str) \
+            else _default_index_name(_index_key(index_or_name))
+        if name == "_id_":
+            raise OperationFailure("cannot drop _id index")
+        data = self._data
+        with data.lock:
+            if data.indexes.pop(name, None) is None:
+                raise OperationFailure(f"index not found with name [{name}]", 27)
+
+    def drop_indexes(self, **kwargs):
+        data = self._data
+        with data.lock:
+            for name in [name for name in data.indexes if name != "_id_"]:
+                del data.indexes[name]
+
+    def _index_stats(self) -> list[dict]:
+        data = self._data
+        return [{"name": name, "key": dict(index.key),
+                 "accesses": {"ops": data.accesses.get(name, 0)}}
+                for name, index in data.indexes.items()]
+
+    def drop(self, **kwargs):
+        with self._command("drop", {"drop": self.name}):
+            self.database.drop_collection(self.name)
+
+
+def _request_document(request) -> dict:
+    if isinstance(request, InsertOne):
+        return request._doc
+    return {"q": request._filter, "u": getattr(request, "_doc", None)}
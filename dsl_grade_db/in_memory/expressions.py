@@ -0,0 +1,507 @@
+from __future__ import annotations
+
+import datetime
+import math
+
+from pymongo.errors import OperationFailure
+
+from .values import MISSING, clone, compare, equal, sort_key, truthy, type_name
+
+# $$REMOVE: the field is removed from the result
+REMOVE = MISSING
+
+
+def evaluate(expression, document, variables: dict | None = None):
+    """Evaluate the aggregation expression on the document"""
+    if variables is None:
+        variables = {}
+    variables.setdefault("ROOT", document)
+    variables.setdefault("CURRENT", document)
+    return _evaluate(expression, variables)
+
+
+def _evaluate(expression, variables: dict):
+    if isinstance(expression, str):
+        if expression.startswith("$$"):
+            name, _, path = expression[2:].partition(".")
+            if name == "REMOVE":
+                return REMOVE
+            if name == "NOW":
+                return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+            if name not in variables:
+                raise OperationFailure(f"Use of undefined variable: {name}")
+            return get_field(variables[name], path) if path else variables[name]
+        if expression.startswith("$"):
+            return get_field(variables["CURRENT"], expression[1:])
+        return expression
+    if isinstance(expression, list):
+        return [_evaluate(item, variables) for item in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            operator, argument = next(iter(expression.items()))
+            if operator.startswith("$"):
+                if operator not in _OPERATORS:
+                    raise OperationFailure(f"Unrecognized expression '{operator}'")
+                return _OPERATORS[operator](argument, variables)
+        result = {}
+        for key, item in expression.items():
+            value = _evaluate(item, variables)
+            if value is not MISSING:
+                result[key] = value
+        return result
+    return expression
+
+
+def get_field(value, path: str):
+    """Value of a field path ("a.b") as in aggregation: the arrays are mapped"""
+    for part in path.split("."):
+        value = _get_part(value, part)
+    return value
+
+
+def _get_part(value, part: str):
+    if isinstance(value, dict):
+        return value.get(part, MISSING)
+    if isinstance(value, list):
+        items = [_get_part(item, part) for item in value
+                 if isinstance(item, (dict, list))]
+        return [item for item in items if item is not MISSING]
+    return MISSING
+
+
+def _arguments(argument, variables: dict) -> list:
+    if not isinstance(argument, list):
+        argument = [argument]
+    return [_evaluate(item, variables) for item in argument]
+
+
+def _is_null(value) -> bool:
+    return value is None or value is MISSING
+
+
+def _array(value, operator: str) -> list:
+    if not isinstance(value, list):
+        raise OperationFailure(f"{operator} requires an array, found {type_name(value)}")
+    return value
+
+
+def _literal(argument, variables):
+    return clone(argument)
+
+
+def _let(argument, variables):
+    scope = dict(variables)
+    for name, expression in argument["vars"].items():
+        scope[name] = _evaluate(expression, variables)
+    return _evaluate(argument["in"], scope)
+
+
+def _cond(argument, variables):
+    if isinstance(argument, dict):
+        argument = [argument["if"], argument["then"], argument["else"]]
+    condition, then, otherwise = argument
+    return _evaluate(then if truthy(_evaluate(condition, variables)) else otherwise,
+                     variables)
+
+
+def _if_null(argument, variables):
+    for expression in argument[:-1]:
+        value = _evaluate(expression, variables)
+        if not _is_null(value):
+            return value
+    return _evaluate(argument[-1], variables)
+
+
+def _and(argument, variables):
+    return all(truthy(_evaluate(item, variables)) for item in argument)
+
+
+def _or(argument, variables):
+    return any(truthy(_evaluate(item, variables)) for item in argument)
+
+
+def _not(argument, variables):
+    return not truthy(_arguments(argument, variables)[0])
+
+
+def _comparison(check):
+    def operator(argument, variables):
+        first, second = _arguments(argument, variables)
+        return check(compare(first, second, missing_as_null=False))
+
+    return operator
+
+
+def _cmp(argument, variables):
+    first, second = _arguments(argument, variables)
+    return compare(first, second, missing_as_null=False)
+
+
+def _in(argument, variables):
+    value, array = _arguments(argument, variables)
+    return any(equal(value, item) for item in _array(array, "$in"))
+
+
+def _arithmetic(function):
+    def operator(argument, variables):
+        values = _arguments(argument, variables)
+        if any(_is_null(value) for value in values):
+            return None
+        return function(values)
+
+    return operator
+
+
+def _add(values):
+    dates = [value for value in values if isinstance(value, datetime.datetime)]
+    total = sum(value for value in values if not isinstance(value, datetime.datetime))
+    if dates:
+        return dates[0] + datetime.timedelta(milliseconds=total)
+    return total
+
+
+def _subtract(values):
+    first, second = values
+    if isinstance(first, datetime.datetime) and isinstance(second, datetime.datetime):
+        return int((first - second).total_seconds() * 1000)
+    if isinstance(first, datetime.datetime):
+        return first - datetime.timedelta(milliseconds=second)
+    return first - second
+
+
+def _multiply(values):
+    return math.prod(values)
+
+
+def _divide(values):
+    return values[0] / values[1]
+
+
+def _group_values(argument, variables) -> list:
+    """Values of $max/$min/$sum/$avg: the elements when the only argument is an array"""
+    values = _arguments(argument, variables)
+    if len(values) == 1 and isinstance(values[0], list):
+        values = values[0]
+    return [value for value in values if not _is_null(value)]
+
+
+def _max(argument, variables):
+    values = _group_values(argument, variables)
+    return max(values, key=sort_key) if values else None
+
+
+def _min(argument, variables):
+    values = _group_values(argument, variables)
+    return min(values, key=sort_key) if values else None
+
+
+def _sum(argument, variables):
+    return sum(value for value in _group_values(argument, variables)
+               if isinstance(value, (int, float)) and not isinstance(value, bool))
+
+
+def _avg(argument, variables):
+    values = [value for value in _group_values(argument, variables)
+              if isinstance(value, (int, float)) and not isinstance(value, bool)]
+    return sum(values) / len(values) if values else None
+
+
+def _size(argument, variables):
+    return len(_array(_arguments(argument, variables)[0], "$size"))
+
+
+def _array_elem_at(argument, variables):
+    array, index = _arguments(argument, variables)
+    if _is_null(array):
+        return None
+    array = _array(array, "$arrayElemAt")
+    if -len(array) <= index < len(array):
+        return array[index]
+    return MISSING
+
+
+def _first(argument, variables):
+    array = _arguments(argument, variables)[0]
+    if _is_null(array):
+        return None
+    array = _array(array, "$first")
+    return array[0] if array else MISSING
+
+
+def _last(argument, variables):
+    array = _arguments(argument, variables)[0]
+    if _is_null(array):
+        return None
+    array = _array(array, "$last")
+    return array[-1] if array else MISSING
+
+
+def _concat_arrays(argument, variables):
+    arrays = _arguments(argument, variables)
+    if any(_is_null(array) for array in arrays):
+        return None
+    return [item for array in arrays for item in _array(array, "$concatArrays")]
+
+
+def _filter(argument, variables):
+    array = _evaluate(argument["input"], variables)
+    if _is_null(array):
+        return None
+    name = argument.get("as", "this")
+    limit = _evaluate(argument["limit"], variables) if "limit" in argument else None
+    result = []
+    for item in _array(array, "$filter"):
+        if truthy(_evaluate(argument["cond"], {**variables, name: item})):
+            result.append(item)
+            if limit is not None and len(result) >= limit:
+                break
+    return result
+
+
+def _map(argument, variables):
+    array = _evaluate(argument["input"], variables)
+    if _is_null(array):
+        return None
+    name = argument.get("as", "this")
+    result = []
+    for item in _array(array, "$map"):
+        value = _evaluate(argument["in"], {**variables, name: item})
+        result.append(None if value is MISSING else value)
+    return result
+
+
+def _reduce(argument, variables):
+    array = _evaluate(argument["input"], variables)
+    if _is_null(array):
+        return None
+    value = _evaluate(argument["initialValue"], variables)
+    for item in _array(array, "$reduce"):
+        value = _evaluate(argument["in"], {**variables, "this": item, "value": value})
+    return value
+
+
+def _merge_objects(argument, variables):
+    result = {}
+    for value in _arguments(argument, variables):
+        if _is_null(value):
+            continue
+        if not isinstance(value, dict):
+            raise OperationFailure("$mergeObjects requires object inputs")
+        result.update(value)
+    return result
+
+
+def _python_format(mongo_format: str) -> str:
+    return mongo_format.replace("%L", "%f").replace("%z", "%z")
+
+
+def _date_from_string(argument, variables):
+    date_string = _evaluate(argument["dateString"], variables)
+    if _is_null(date_string):
+        return _evaluate(argument["onNull"], variables) if "onNull" in argument else None
+    try:
+        if not isinstance(date_string, str):
+            raise ValueError(f"$dateFromString requires a string, found {date_string}")
+        if "format" in argument:
+            return datetime.datetime.strptime(
+                date_string, _python_format(_evaluate(argument["format"], variables)))
+        return datetime.datetime.fromisoformat(date_string)
+    except ValueError as error:
+        if "onError" in argument:
+            return _evaluate(argument["onError"], variables)
+        raise OperationFailure(f"Error parsing date string '{date_string}': {error}")
+
+
+def _date_to_string(argument, variables):
+    date = _evaluate(argument["date"], variables)
+    if _is_null(date):
+        return _evaluate(argument["onNull"], variables) if "onNull" in argument else None
+    mongo_format = _evaluate(argument.get("format", "%Y-%m-%dT%H:%M:%S.%LZ"), variables)
+    return date.strftime(_python_format(mongo_format))
+
+
+def _type(argument, variables):
+    return type_name(_arguments(argument, variables)[0])
+
+
+def _is_array(argument, variables):
+    return isinstance(_arguments(argument, variables)[0], list)
+
+
+def _slice(argument, variables):
+    values = _arguments(argument, variables)
+    if _is_null(values[0]):
+        return None
+    array = _array(values[0], "$slice")
+    if len(values) == 2:
+        count = values[1]
+        return array[:count] if count >= 0 else array[count:]
+    position, count = values[1], values[2]
+    if position < 0:
+        position = max(len(array) + position, 0)
+    return array[position:position + count]
+
+
+def _index_of_array(argument, variables):
+    values = _arguments(argument, variables)
+    if _is_null(values[0]):
+        return None
+    array = _array(values[0], "$indexOfArray")
+    start = values[2] if len(values) > 2 else 0
+    end = values[3] if len(values) > 3 else len(array)
+    for index in range(start, min(end, len(array))):
+        if equal(array[index], values[1]):
+            return index
+    return -1
+
+
+def _range(argument, variables):
+    values = _arguments(argument, variables)
+    return list(range(*values))
+
+
+def _get_field(argument, variables):
+    if not isinstance(argument, dict):
+        return get_field(variables["CURRENT"], argument)
+    value = _evaluate(argument.get("input", "$$CURRENT"), variables)
+    return value.get(argument["field"], MISSING) if isinstance(value, dict) else MISSING
+
+
+def _sort_array(argument, variables):
+    array = _evaluate(argument["input"], variables)
+    if _is_null(array):
+        return None
+    array = list(_array(array, "$sortArray"))
+    sort_by = argument["sortBy"]
+    if isinstance(sort_by, dict):
+        for field, direction in reversed(list(sort_by.items())):
+            array.sort(key=lambda item: sort_key(get_field(item, field)),
+                       reverse=direction < 0)
+    else:
+        array.sort(key=sort_key, reverse=sort_by < 0)
+    return array
+
+
+def _any_element_true(argument, variables):
+    return any(truthy(item) for item in _array(_arguments(argument, variables)[0],
+                                               "$anyElementTrue"))
+
+
+def _all_elements_true(argument, variables):
+    return all(truthy(item) for item in _array(_arguments(argument, variables)[0],
+                                               "$allElementsTrue"))
+
+
+def _to_string(argument, variables):
+    value = _arguments(argument, variables)[0]
+    if _is_null(value):
+        return None
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+    return str(value)
+
+
+def _to_double(argument, variables):
+    value = _arguments(argument, variables)[0]
+    return None if _is_null(value) else float(value)
+
+
+def _split(argument, variables):
+    string, delimiter = _arguments(argument, variables)
+    if _is_null(string):
+        return None
+    if not isinstance(string, str):
+        raise OperationFailure("$split requires an expression that evaluates to a string")
+    return string.split(delimiter)
+
+
+def _to_int(argument, variables):
+    value = _arguments(argument, variables)[0]
+    if _is_null(value):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise OperationFailure(f"Failed to parse number '{value}' in $convert")
+
+
+def _convert(argument, variables):
+    """$convert to int, double or string, with onError and onNull"""
+    value = _evaluate(argument["input"], variables)
+    if _is_null(value):
+        return _evaluate(argument.get("onNull"), variables)
+    converters = {"int": _to_int, "double": _to_double, "string": _to_string}
+    to = _evaluate(argument["to"], variables)
+    if to not in converters:
+        raise OperationFailure(f"$convert to {to} not supported by the in-memory engine")
+    try:
+        return converters[to]({"$literal": value}, variables)
+    except (OperationFailure, TypeError, ValueError):
+        if "onError" in argument:
+            return _evaluate(argument["onError"], variables)
+        raise OperationFailure(f"Failed to parse number '{value}' in $convert")
+
+
+def _date_from_parts(argument, variables):
+    parts = {name: _evaluate(argument.get(name, default), variables)
+             for name, default in [("year", 1970), ("month", 1), ("day", 1),
+                                   ("hour", 0), ("minute", 0), ("second", 0)]}
+    if any(_is_null(value) for value in parts.values()):
+        return None
+    try:
+        return datetime.datetime(**parts)
+    except ValueError as error:
+        raise OperationFailure(f"$dateFromParts: {error}")
+
+
+_OPERATORS = {
+    "$split": _split,
+    "$toInt": _to_int,
+    "$convert": _convert,
+    "$dateFromParts": _date_from_parts,
+    "$literal": _literal,
+    "$let": _let,
+    "$cond": _cond,
+    "$ifNull": _if_null,
+    "$and": _and,
+    "$or": _or,
+    "$not": _not,
+    "$eq": _comparison(lambda result: result == 0),
+    "$ne": _comparison(lambda result: result != 0),
+    "$gt": _comparison(lambda result: result > 0),
+    "$gte": _comparison(lambda result: result >= 0),
+    "$lt": _comparison(lambda result: result < 0),
+    "$lte": _comparison(lambda result: result <= 0),
+    "$cmp": _cmp,
+    "$in": _in,
+    "$add": _arithmetic(_add),
+    "$subtract": _arithmetic(_subtract),
+    "$multiply": _arithmetic(_multiply),
+    "$divide": _arithmetic(_divide),
+    "$max": _max,
+    "$min": _min,
+    "$sum": _sum,
+    "$avg": _avg,
+    "$size": _size,
+    "$arrayElemAt": _array_elem_at,
+    "$first": _first,
+    "$last": _last,
+    "$concatArrays": _concat_arrays,
+    "$filter": _filter,
+    "$map": _map,
+    "$reduce": _reduce,
+    "$mergeObjects": _merge_objects,
+    "$dateFromString": _date_from_string,
+    "$dateToString": _date_to_string,
+    "$type": _type,
+    "$isArray": _is_array,
+    "$slice": _slice,
+    "$indexOfArray": _index_of_array,
+    "$range": _range,
+    "$getField": _get_field,
+    "$sortArray": _sort_array,
+    "$anyElementTrue": _any_element_true,
+    "$allElementsTrue": _all_elements_true,
+    "$toString": _to_string,
+    "$toDouble": _to_double,
+}
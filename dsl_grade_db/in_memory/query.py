@@ -0,0 +1,235 @@
+from __future__ import annotations
+
+import re
+
+from pymongo.errors import OperationFailure
+
+from .values import MISSING, compare, equal, clone, truthy, type_name
+
+_NUMBER_TYPES = {"int", "long", "double", "decimal"}
+_TYPE_CODES = {1: "double", 2: "string", 3: "object", 4: "array", 5: "binData",
+               7: "objectId", 8: "bool", 9: "date", 10: "null", 11: "regex",
+               16: "int", 18: "long"}
+
+
+def lookup(document, path: str) -> list:
+    """All the values at the path (dotted notation) of the document, following the
+    arrays as the MongoDB queries do. The arrays found at the end are not expanded."""
+    values = []
+    _lookup(document, path.split("."), values)
+    return values
+
+
+def _lookup(value, parts: list[str], values: list):
+    if not parts:
+        values.append(value)
+        return
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, dict):
+        if head in value:
+            _lookup(value[head], rest, values)
+    elif isinstance(value, list):
+        if head.isdigit():
+            if int(head) < len(value):
+                _lookup(value[int(head)], rest, values)
+        else:
+            for item in value:
+                if isinstance(item, dict):
+                    _lookup(item, parts, values)
+
+
+def _expand(values: list) -> list:
+    """The values and the elements of the values that are arrays"""
+    expanded = []
+    for value in values:
+        expanded.append(value)
+        if isinstance(value, list):
+            expanded.extend(value)
+    return expanded
+
+
+def is_operator_dict(condition) -> bool:
+    return isinstance(condition, dict) and bool(condition) and all(
+        key.startswith("$") for key in condition)
+
+
+def matches(document: dict, query: dict | None) -> bool:
+    """True if the document satisfies the query filter"""
+    if not query:
+        return True
+    for key, condition in query.items():
+        if key == "$and":
+            if not all(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key == "$or":
+            if not any(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, sub_query) for sub_query in condition):
+                return False
+        elif key == "$expr":
+            from .expressions import evaluate
+            if not truthy(evaluate(condition, document)):
+                return False
+        elif key == "$comment":
+            continue
+        elif key.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {key}")
+        elif not match_condition(lookup(document, key), condition):
+            return False
+    return True
+
+
+def match_condition(values: list, condition) -> bool:
+    """True if the values found at a path satisfy the condition"""
+    if is_operator_dict(condition):
+        return all(_match_operator(values, operator, argument, condition)
+                   for operator, argument in condition.items()
+                   if operator != "$options")
+    return _match_equal(values, condition)
+
+
+def _match_equal(values: list, target) -> bool:
+    if isinstance(target, re.Pattern):
+        return any(isinstance(value, str) and target.search(value)
+                   for value in _expand(values))
+    if not values:
+        return target is None
+    return any(equal(value, target) for value in _expand(values))
+
+
+def _match_operator(values: list, operator: str, argument, condition: dict) -> bool:
+    if operator == "$eq":
+        return _match_equal(values, argument)
+    if operator == "$ne":
+        return not _match_equal(values, argument)
+    if operator in ("$gt", "$gte", "$lt", "$lte"):
+        return any(_compare_same_type(value, argument, operator)
+                   for value in _expand(values))
+    if operator == "$in":
+        return any(_match_equal(values, target) for target in argument)
+    if operator == "$nin":
+        return not any(_match_equal(values, target) for target in argument)
+    if operator == "$exists":
+        return bool(values) == bool(argument)
+    if operator == "$type":
+        types = argument if isinstance(argument, list) else [argument]
+        types = {_TYPE_CODES.get(type_, type_) for type_ in types}
+        if "number" in types:
+            types |= _NUMBER_TYPES
+        return any(type_name(value) in types for value in _expand(values))
+    if operator == "$size":
+        return any(isinstance(value, list) and len(value) == argument
+                   for value in values)
+    if operator == "$elemMatch":
+        return any(isinstance(value, list) and any(
+            _match_element(item, argument) for item in value) for value in values)
+    if operator == "$all":
+        return all(_match_equal(values, target) for target in argument)
+    if operator == "$not":
+        return not match_condition(values, argument)
+    if operator == "$regex":
+        flags = re.IGNORECASE if "i" in condition.get("$options", "") else 0
+        pattern = argument if isinstance(argument, re.Pattern) \
+            else re.compile(argument, flags)
+        return _match_equal(values, pattern)
+    raise OperationFailure(f"unknown operator: {operator}")
+
+
+def _compare_same_type(value, argument, operator: str) -> bool:
+    """The comparison operators match only values of the same type"""
+    type_value, type_argument = type_name(value), type_name(argument)
+    if type_value != type_argument and not (
+            type_value in _NUMBER_TYPES and type_argument in _NUMBER_TYPES):
+        return False
+    result = compare(value, argument)
+    return {"$gt": result > 0, "$gte": result >= 0,
+            "$lt": result < 0, "$lte": result <= 0}[operator]
+
+
+def _match_element(item, query) -> bool:
+    """$elemMatch: the query is on the fields of the element or on the element itself"""
+    if is_operator_dict(query) and not any(key in ("$and", "$or", "$nor")
+                                           for key in query):
+        return match_condition([item], query)
+    return isinstance(item, dict) and matches(item, query)
+
+
+def match_array_filter(item, identifier: str, array_filter: dict) -> bool:
+    """True if the element of the array satisfies the array filter of the identifier"""
+    query = {}
+    for key, condition in array_filter.items():
+        if key == identifier:
+            if not match_condition([item], condition):
+                return False
+        else:
+            query[key[len(identifier) + 1:]] = condition
+    return not query or (isinstance(item, dict) and matches(item, query))
+
+
+def project(document: dict, projection: dict | None) -> dict:
+    """Apply the inclusion or exclusion projection of find()"""
+    if not projection:
+        return clone(document)
+    include_id = bool(projection.get("_id", 1))
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if not fields:
+        projected = clone(document)
+        if not include_id:
+            projected.pop("_id", None)
+        return projected
+    if all(truthy(value) for value in fields.values()):
+        projected = _include(document, _path_tree(fields))
+        if include_id and "_id" in document:
+            projected = {"_id": document["_id"], **projected}
+        return projected
+    if any(truthy(value) for value in fields.values()):
+        raise OperationFailure("Cannot do inclusion and exclusion in the same projection")
+    projected = clone(document)
+    _exclude(projected, _path_tree(fields))
+    if not include_id:
+        projected.pop("_id", None)
+    return projected
+
+
+def _path_tree(fields) -> dict:
+    tree = {}
+    for path in fields:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+
+def _include(value, tree: dict):
+    if isinstance(value, list):
+        return [_include(item, tree) for item in value if isinstance(item, (dict, list))]
+    projected = {}
+    for key, item in value.items():
+        if key not in tree:
+            continue
+        if tree[key] is True:
+            projected[key] = clone(item)
+        elif isinstance(item, (dict, list)):
+            projected[key] = _include(item, tree[key])
+    return projected
+
+
+def _exclude(value, tree: dict):
+    if isinstance(value, list):
+        for item in value:
+            if isinstance(item, (dict, list)):
+                _exclude(item, tree)
+        return
+    for key, subtree in tree.items():
+        if key not in value:
+            continue
+        if subtree is True:
+            del value[key]
+        elif isinstance(value[key], (dict, list)):
+            _exclude(value[key], subtree)
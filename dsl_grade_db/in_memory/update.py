@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+from pymongo.errors import OperationFailure, WriteError
+
+from .query import is_operator_dict, lookup, match_array_filter, match_condition, \
+    matches
+from .values import MISSING, clone, compare, equal, sort_key
+
+_MODIFIERS = {"$set", "$setOnInsert", "$unset", "$inc", "$mul", "$max", "$min",
+              "$push", "$addToSet", "$pull", "$pullAll", "$pop", "$rename",
+              "$currentDate"}
+
+
+def is_pipeline(update) -> bool:
+    return isinstance(update, list)
+
+
+def validate_update(update):
+    if is_pipeline(update):
+        return
+    if not update or not all(key.startswith("$") for key in update):
+        raise ValueError("update only works with $ operators")
+    for operator in update:
+        if operator not in _MODIFIERS:
+            raise WriteError(f"Unknown modifier: {operator}", code=9)
+
+
+def seed_document(query: dict) -> dict:
+    """The document an upsert starts from: the equality conditions of the query"""
+    document = {}
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            for sub_query in condition:
+                for sub_key, value in seed_document(sub_query).items():
+                    document[sub_key] = value
+            continue
+        if key.startswith("$"):
+            continue
+        if is_operator_dict(condition):
+            if "$eq" not in condition:
+                continue
+            condition = condition["$eq"]
+        _set_path(document, key.split("."), clone(condition))
+    return document
+
+
+def apply_update(document: dict, update, query: dict | None = None,
+                 array_filters: list | None = None, is_insert: bool = False):
+    """Apply the update document or the update pipeline to the document in place"""
+    if is_pipeline(update):
+        from .aggregation import run_stages
+        result = run_stages([document], update, update_pipeline=True)[0]
+        document.clear()
+        document.update(result)
+        return
+    array_filters = array_filters or []
+    # the positional operators are resolved on the document before the update
+    changes = []
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not is_insert:
+            continue
+        for path, argument in fields.items():
+            if path == "_id" or path.startswith("_id."):
+                if operator in ("$set", "$setOnInsert") and equal(
+                        document.get("_id", MISSING), argument):
+                    continue
+                if not is_insert:
+                    raise WriteError("Performing an update on the path '_id' would "
+                                     "modify the immutable field '_id'", code=66)
+            for parent, key in _targets(document, path.split("."), query,
+                                        array_filters, operator != "$unset"):
+                changes.append((operator, parent, key, argument, path))
+    for operator, parent, key, argument, path in changes:
+        _apply(operator, parent, key, argument, path)
+
+
+def _targets(document, parts: list[str], query, array_filters, create: bool):
+    """The (container, key) pairs the path resolves to"""
+    targets = []
+    _resolve(document, parts, query, array_filters, create, targets, [])
+    return targets
+
+
+def _resolve(value, parts, query, array_filters, create, targets, prefix):
+    head, rest = parts[0], parts[1:]
+    if isinstance(value, list):
+        indexes = _array_indexes(value, head, query, array_filters, prefix)
+    else:
+        indexes = [head]
+    for key in indexes:
+        if not rest:
+            targets.append((value, key))
+            continue
+        child = _child(value, key)
+        if child is MISSING or child is None:
+            if not create:
+                continue
+            child = {}
+            _assign(value, key, child)
+        elif not isinstance(child, (dict, list)):
+            raise WriteError(f"Cannot create field '{rest[0]}' in element "
+                             f"{{{key}: {child!r}}}", code=28)
+        _resolve(child, rest, query, array_filters, create, targets, prefix + [head])
+
+
+def _array_indexes(array: list, head: str, query, array_filters, prefix) -> list:
+    if head == "$[]":
+        return list(range(len(array)))
+    if head.startswith("$[") and head.endswith("]"):
+        identifier = head[2:-1]
+        array_filter = next((array_filter for array_filter in array_filters
+                             if any(key.split(".")[0] == identifier
+                                    for key in array_filter)), None)
+        if array_filter is None:
+            raise WriteError(f"No array filter found for identifier '{identifier}'",
+                             code=2)
+        return [index for index, item in enumerate(array)
+                if match_array_filter(item, identifier, array_filter)]
+    if head == "$":
+        index = _positional_index(array, query or {}, ".".join(prefix))
+        if index is None:
+            raise WriteError("The positional operator did not find the match needed "
+                             "from the query.", code=2)
+        return [index]
+    if head.isdigit():
+        return [int(head)]
+    raise WriteError(f"Cannot apply array updates to non-array element with '{head}'",
+                     code=28)
+
+
+def _positional_index(array: list, query: dict, array_path: str):
+    """The index of the first element matched by the query conditions on the array"""
+    conditions = {}
+    for key, condition in query.items():
+        if key == "$and":
+            for sub_query in condition:
+                for sub_key, sub_condition in sub_query.items():
+                    conditions.setdefault(sub_key, sub_condition)
+        else:
+            conditions[key] = condition
+    for index, item in enumerate(array):
+        for key, condition in conditions.items():
+            if key == array_path and is_operator_dict(condition) \
+                    and "$elemMatch" in condition:
+                if isinstance(item, dict) and matches(item, condition["$elemMatch"]) \
+                        or not isinstance(item, dict) \
+                        and match_condition([item], condition["$elemMatch"]):
+                    return index
+            elif key == array_path:
+                if match_condition([item], condition):
+                    return index
+            elif key.startswith(array_path + "."):
+                sub_path = key[len(array_path) + 1:]
+                if isinstance(item, dict) and match_condition(lookup(item, sub_path),
+                                                              condition):
+                    return index
+    return None
+
+
+def _child(container, key):
+    if isinstance(container, list):
+        index = int(key)
+        return container[index] if index < len(container) else MISSING
+    return container.get(key, MISSING)
+
+
+def _assign(container, key, value):
+    if isinstance(container, list):
+        index = int(key)
+        while len(container) <= index:
+            container.append(None)
+        container[index] = value
+    else:
+        container[key] = value
+
+
+def _set_path(document: dict, parts: list[str], value):
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+
+def _number(value, path: str):
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        raise WriteError(f"Cannot apply $inc to a value of non-numeric type at {path}",
+                         code=14)
+    return value
+
+
+def _apply(operator: str, container, key, argument, path: str):
+    current = _child(container, key)
+    if operator in ("$set", "$setOnInsert"):
+        _assign(container, key, clone(argument))
+    elif operator == "$unset":
+        if current is MISSING:
+            return
+        if isinstance(container, list):
+            container[int(key)] = None
+        else:
+            del container[key]
+    elif operator == "$inc":
+        _number(argument, path)
+        _assign(container, key, argument if current is MISSING
+                else _number(current, path) + argument)
+    elif operator == "$mul":
+        _assign(container, key, 0 if current is MISSING
+                else _number(current, path) * argument)
+    elif operator == "$max":
+        if current is MISSING or compare(argument, current) > 0:
+            _assign(container, key, clone(argument))
+    elif operator == "$min":
+        if current is MISSING or compare(argument, current) < 0:
+            _assign(container, key, clone(argument))
+    elif operator in ("$push", "$addToSet"):
+        array = _array_for_update(container, key, current, operator, path)
+        if isinstance(argument, dict) and "$each" in argument:
+            items = argument["$each"]
+        else:
+            items, argument = [argument], {}
+        for item in items:
+            if operator == "$addToSet" and any(equal(item, value) for value in array):
+                continue
+            if "$position" in argument:
+                position = argument["$position"]
+                array.insert(position if position >= 0 else len(array) + position,
+                             clone(item))
+                argument = {**argument, "$position": position + 1} \
+                    if position >= 0 else argument
+            else:
+                array.append(clone(item))
+        if "$sort" in argument:
+            _sort_array(array, argument["$sort"])
+        if "$slice" in argument:
+            count = argument["$slice"]
+            array[:] = array[:count] if count >= 0 else array[count:]
+    elif operator == "$pull":
+        if current is MISSING:
+            return
+        array = _array_for_update(container, key, current, operator, path)
+        array[:] = [item for item in array if not _pull_matches(item, argument)]
+    elif operator == "$pullAll":
+        if current is MISSING:
+            return
+        array = _array_for_update(container, key, current, operator, path)
+        array[:] = [item for item in array
+                    if not any(equal(item, value) for value in argument)]
+    elif operator == "$pop":
+        if current is MISSING:
+            return
+        array = _array_for_update(container, key, current, operator, path)
+        if array:
+            array.pop(0 if argument < 0 else -1)
+    elif operator == "$rename":
+        raise OperationFailure("$rename is not supported by the in-memory storage")
+    elif operator == "$currentDate":
+        import datetime
+        _assign(container, key, datetime.datetime.now(datetime.timezone.utc)
+                .replace(tzinfo=None, microsecond=0))
+
+
+def _array_for_update(container, key, current, operator: str, path: str) -> list:
+    if current is MISSING:
+        current = []
+        _assign(container, key, current)
+    if not isinstance(current, list):
+        raise WriteError(f"The field '{path}' must be an array to apply {operator}",
+                         code=2)
+    return current
+
+
+def _pull_matches(item, condition) -> bool:
+    if isinstance(condition, dict) and not is_operator_dict(condition):
+        return isinstance(item, dict) and matches(item, condition)
+    return match_condition([item], condition)
+
+
+def _sort_array(array: list, sort):
+    if isinstance(sort, dict):
+        for field, direction in reversed(list(sort.items())):
+            array.sort(key=lambda item: sort_key(
+                lookup(item, field)[0] if lookup(item, field) else MISSING),
+                       reverse=direction < 0)
+    else:
+        array.sort(key=sort_key, reverse=sort < 0)
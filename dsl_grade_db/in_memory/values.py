@@ -0,0 +1,136 @@
+from __future__ import annotations
+
+import datetime
+import functools
+import math
+import re
+
+from bson import ObjectId
+
+
+class _Missing:
+    """A field that is not in the document, different from a null value"""
+
+    def __repr__(self):
+        return "MISSING"
+
+    def __bool__(self):
+        return False
+
+
+MISSING = _Missing()
+
+# BSON comparison order of the types
+_TYPE_ORDER = {"missing": 0, "null": 1, "number": 2, "string": 3, "object": 4,
+               "array": 5, "binData": 6, "objectId": 7, "bool": 8, "date": 9,
+               "regex": 10}
+
+
+def type_name(value) -> str:
+    """The BSON type alias of the value, as returned by the $type operator"""
+    if value is MISSING:
+        return "missing"
+    if value is None:
+        return "null"
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int" if -2 ** 31 <= value < 2 ** 31 else "long"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, str):
+        return "string"
+    if isinstance(value, dict):
+        return "object"
+    if isinstance(value, (list, tuple)):
+        return "array"
+    if isinstance(value, bytes):
+        return "binData"
+    if isinstance(value, ObjectId):
+        return "objectId"
+    if isinstance(value, datetime.datetime):
+        return "date"
+    if isinstance(value, re.Pattern):
+        return "regex"
+    raise TypeError(f"Type {type(value)} not supported by the in-memory storage.")
+
+
+def _type_group(value) -> str:
+    name = type_name(value)
+    return "number" if name in ("int", "long", "double") else name
+
+
+def compare(a, b, missing_as_null: bool = True) -> int:
+    """Compare two values with the BSON order: -1, 0 or 1"""
+    if missing_as_null:
+        a = None if a is MISSING else a
+        b = None if b is MISSING else b
+    group_a, group_b = _type_group(a), _type_group(b)
+    if group_a != group_b:
+        return -1 if _TYPE_ORDER[group_a] < _TYPE_ORDER[group_b] else 1
+    if group_a in ("missing", "null"):
+        return 0
+    if group_a == "number":
+        # NaN is smaller than every number and equal to itself
+        if math.isnan(a) or math.isnan(b):
+            return (not math.isnan(a)) - (not math.isnan(b))
+        return (a > b) - (a < b)
+    if group_a == "object":
+        for (key_a, value_a), (key_b, value_b) in zip(a.items(), b.items()):
+            result = compare(value_a, value_b, missing_as_null) \
+                if key_a == key_b else (key_a > key_b) - (key_a < key_b)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    if group_a == "array":
+        for value_a, value_b in zip(a, b):
+            result = compare(value_a, value_b, missing_as_null)
+            if result:
+                return result
+        return (len(a) > len(b)) - (len(a) < len(b))
+    if group_a == "regex":
+        return (a.pattern > b.pattern) - (a.pattern < b.pattern)
+    return (a > b) - (a < b)
+
+
+def equal(a, b) -> bool:
+    return compare(a, b) == 0
+
+
+sort_key = functools.cmp_to_key(compare)
+
+
+def hashable(value):
+    """Hashable version of the value, equal for the values equal in BSON"""
+    if isinstance(value, dict):
+        return "object", tuple((key, hashable(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return "array", tuple(hashable(item) for item in value)
+    if value is MISSING or value is None:
+        return "null", None
+    if isinstance(value, bool):
+        return "bool", value
+    if isinstance(value, (int, float)):
+        return ("nan", None) if isinstance(value, float) and math.isnan(value) \
+            else ("number", value)
+    if isinstance(value, re.Pattern):
+        return "regex", value.pattern
+    return type_name(value), value
+
+
+def clone(value):
+    """Deep copy of dicts and lists, the other BSON values are immutable"""
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [clone(item) for item in value]
+    return value
+
+
+def truthy(value) -> bool:
+    """Truth value of the aggregation expressions"""
+    if value is MISSING or value is None or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    return True
@@ -0,0 +1,180 @@
+from __future__ import annotations
+
+import sys
+import threading
+from contextlib import contextmanager
+
+import bson
+from bson.errors import InvalidDocument
+from pymongo import monitoring
+
+# the commands of the frames outside these classes are attributed to OTHER
+OTHER = "<other>"
+
+
+def _tracked_classes() -> tuple[type, ...]:
+    # imported here: the ingestors import the modules of this package
+    from .data_ingestor import MongoDBEnrolledStudent, MongoDBReportGrade, \
+        MongoDBTeamsGrade, MongoDBWrittenGrade
+    from .dsl_student_id_database import MongoDBStudentId
+    from .mongo_db_student_grade import MongoDBStudentGrade
+    return (MongoDBStudentGrade, MongoDBStudentId, MongoDBEnrolledStudent,
+            MongoDBWrittenGrade, MongoDBTeamsGrade, MongoDBReportGrade)
+
+
+def _bson_size(document) -> int:
+    try:
+        return len(bson.encode(document))
+    except (InvalidDocument, TypeError):
+        return 0
+
+
+def _new_stats() -> dict:
+    return {"commands": 0, "failures": 0, "bytes_sent": 0, "bytes_received": 0,
+            "seconds": 0.0, "by_command": {}}
+
+
+def _subtract(stats: dict, before: dict) -> dict:
+    """The stats of each method minus the ones of the same method in before"""
+    difference = {}
+    for method, method_stats in stats.items():
+        old = before.get(method, _new_stats())
+        by_command = {name: count - old["by_command"].get(name, 0)
+                      for name, count in method_stats["by_command"].items()}
+        method_difference = {name: method_stats[name] - old[name]
+                             for name in ["commands", "failures", "bytes_sent",
+                                          "bytes_received", "seconds"]}
+        method_difference["by_command"] = {name: count for name, count in by_command.items()
+                                           if count}
+        if method_difference["commands"]:
+            difference[method] = method_difference
+    return difference
+
+
+class Measurement:
+    """The stats of the commands sent inside CommandInstrumentation.measure(),
+    available when the block is exited"""
+
+    def __init__(self):
+        self.stats: dict[str, dict] = {}
+
+    def round_trips(self, method: str | None = None) -> int:
+        """The commands sent by the method (e.g. "MongoDBStudentGrade.get_final_grade_given"),
+        by all the methods if None"""
+        if method is not None:
+            return self.stats.get(method, _new_stats())["commands"]
+        return sum(method_stats["commands"] for method_stats in self.stats.values())
+
+    def assert_round_trips(self, budget: int | dict[str, int]):
+        """
+        Raise AssertionError if the commands sent exceed the budget: a total or a
+        maximum for each method, e.g. {"MongoDBReportGrade.consume_documents_bulk": 4}
+        """
+        if isinstance(budget, int):
+            budget = {None: budget}
+        exceeded = {method or "total": (self.round_trips(method), maximum)
+                    for method, maximum in budget.items()
+                    if self.round_trips(method) > maximum}
+        if exceeded:
+            details = ", ".join(f"{method}: {sent} > {maximum}"
+                                for method, (sent, maximum) in exceeded.items())
+            raise AssertionError(f"Round trip budget exceeded ({details}), "
+                                 f"commands sent: {self.stats}")
+
+
+class CommandInstrumentation(monitoring.CommandListener):
+    """
+    Opt-in command listener attributing each command sent to the server to the method
+    of MongoDBStudentGrade, MongoDBStudentId or of an ingestor that sent it: the
+    outermost public method of these classes in the stack of the calling thread, e.g.
+    the update of a student done by MongoDBReportGrade.consume_documents_bulk is
+    attributed to it and not to MongoDBStudentGrade.bulk_write. The commands sent from
+    elsewhere are attributed to OTHER. For each method it counts the commands (one
+    round trip each), the failures, the BSON bytes of the commands and of the replies,
+    the seconds waited for the server and the commands by name.
+
+        instrumentation = CommandInstrumentation()
+        connection = MongoDBConnection(event_listeners=[instrumentation])
+
+    The commands of the worker threads of ParallelIngestion are attributed to the
+    method called by the worker (e.g. MongoDBStudentGrade.bulk_write). The asyncio API
+    is not attributed, motor runs the commands in its own threads.
+    """
+
+    def __init__(self, classes: tuple[type, ...] | None = None):
+        self.classes = classes
+        self._stats: dict[str, dict] = {}
+        # the method of each command started and not finished yet
+        self._started: dict[tuple, str] = {}
+        self._lock = threading.Lock()
+
+    def _caller(self) -> str:
+        if self.classes is None:
+            self.classes = _tracked_classes()
+        caller = OTHER
+        frame = sys._getframe(2)
+        while frame is not None:
+            name = frame.f_code.co_name
+            if not name.startswith("_"):
+                owner = frame.f_locals.get("self", frame.f_locals.get("cls"))
+                owner_class = owner if isinstance(owner, type) else type(owner)
+                if owner is not None and issubclass(owner_class, self.classes):
+                    caller = f"{owner_class.__name__}.{name}"
+            frame = frame.f_back
+        return caller
+
+    @staticmethod
+    def _key(event) -> tuple:
+        return event.connection_id, event.request_id
+
+    def started(self, event):
+        caller = self._caller()
+        sent = _bson_size(event.command)
+        with self._lock:
+            stats = self._stats.setdefault(caller, _new_stats())
+            stats["commands"] += 1
+            stats["bytes_sent"] += sent
+            stats["by_command"][event.command_name] = \
+                stats["by_command"].get(event.command_name, 0) + 1
+            self._started[self._key(event)] = caller
+
+    def _finished(self, event, received: int = 0, failed: bool = False):
+        with self._lock:
+            caller = self._started.pop(self._key(event), OTHER)
+            stats = self._stats.setdefault(caller, _new_stats())
+            stats["seconds"] += event.duration_micros / 1e6
+            stats["bytes_received"] += received
+            stats["failures"] += failed
+
+    def succeeded(self, event):
+        self._finished(event, received=_bson_size(event.reply))
+
+    def failed(self, event):
+        self._finished(event, failed=True)
+
+    def snapshot(self) -> dict[str, dict]:
+        """A copy of the stats of each method"""
+        with self._lock:
+            return {method: {**stats, "by_command": dict(stats["by_command"])}
+                    for method, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    @contextmanager
+    def measure(self):
+        """
+        Measure the commands sent inside the block, by all the threads using the
+        connection:
+
+            with instrumentation.measure() as measurement:
+                student_db.get_final_grade_given("123")
+            measurement.assert_round_trips({"MongoDBStudentGrade.get_final_grade_given": 1})
+        """
+        measurement = Measurement()
+        before = self.snapshot()
+        try:
+            yield measurement
+        finally:
+            measurement.stats = _subtract(self.snapshot(), before)
@@ -0,0 +1,115 @@
+from __future__ import annotations
+
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.database import Database
+
+# the storage backends: a MongoDB server or the in-memory engine of the process
+BACKENDS = ["mongodb", "memory"]
+# the backend used when none is given, "mongodb" if not set
+BACKEND_ENV_VAR = "DSL_GRADE_DB_BACKEND"
+
+
+def default_backend() -> str:
+    backend = os.environ.get(BACKEND_ENV_VAR, "mongodb")
+    if backend not in BACKENDS:
+        raise ValueError(f"{BACKEND_ENV_VAR}={backend} not supported, use {BACKENDS}.")
+    return backend
+
+
+class MongoDBConnection:
+    """
+    Connection shared by all the classes of the library, so that a process uses a
+    single MongoClient (one connection pool and one set of monitor threads).
+    The client is created at the first use and it does not connect to the server
+    until the first operation. The asyncio API uses its own AsyncIOMotorClient,
+    see async_client.
+    With backend="memory" the clients are the ones of the in-memory engine (see
+    dsl_grade_db.in_memory): no server is needed and the data lives in the process,
+    shared by all its connections (the host is ignored).
+    """
+
+    def __init__(self, host: str | None = None, backend: str | None = None,
+                 **client_kwargs):
+        backend = backend or default_backend()
+        if backend not in BACKENDS:
+            raise ValueError(f"Backend {backend} not supported, use {BACKENDS}.")
+        self.host = host
+        self.backend = backend
+        self.client_kwargs = client_kwargs
+        self._client = None
+        self._async_client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> MongoClient:
+        """The shared MongoClient (InMemoryClient with the memory backend), created at
+        the first access"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._new_client()
+        return self._client
+
+    def _new_client(self):
+        if self.backend == "memory":
+            from .in_memory import InMemoryClient
+            return InMemoryClient(self.host, **self.client_kwargs)
+        return MongoClient(self.host, connect=False, **self.client_kwargs)
+
+    @property
+    def async_client(self):
+        """The shared AsyncIOMotorClient of the asyncio API, created at the first access.
+        motor is imported only here, so that it is needed only by the asyncio API.
+        As every motor client, it must be used by a single event loop."""
+        if self._async_client is None:
+            with self._lock:
+                if self._async_client is None:
+                    self._async_client = self._new_async_client()
+        return self._async_client
+
+    def _new_async_client(self):
+        if self.backend == "memory":
+            from .in_memory import AsyncInMemoryClient
+            return AsyncInMemoryClient(self.host, **self.client_kwargs)
+        from motor.motor_asyncio import AsyncIOMotorClient
+        return AsyncIOMotorClient(self.host, **self.client_kwargs)
+
+    def get_database(self, database_name: str) -> Database:
+        return self.client[database_name]
+
+    def close(self):
+        """Close the client shared by all the objects using this connection.
+        The objects created before closing cannot be used anymore, while the
+        following ones open a new client at the first use."""
+        with self._lock:
+            if self._client is not None:
+                self._client.close()
+                self._client = None
+            if self._async_client is not None:
+                self._async_client.close()
+                self._async_client = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+_connections: dict[tuple[str | None, str], MongoDBConnection] = {}
+_connections_lock = threading.Lock()
+
+
+def get_connection(host: str | None = None,
+                   backend: str | None = None) -> MongoDBConnection:
+    """Get the connection of the process for the given host and backend (by default
+    the one of DSL_GRADE_DB_BACKEND), creating it if needed.
+    The classes of the library use it when no connection is provided."""
+    key = (host, backend or default_backend())
+    with _connections_lock:
+        if key not in _connections:
+            _connections[key] = MongoDBConnection(*key)
+        return _connections[key]
@@ -0,0 +1,105 @@
+from __future__ import annotations
+
+from pymongo import ASCENDING, IndexModel
+from pymongo.database import Database
+from pymongo.errors import OperationFailure
+
+# Indexes behind every lookup of the library, for each collection.
+# - enrolled_students also stores the project_id document (without MATRICOLA),
+#   hence the unique index is partial.
+# - the multikey compound index on project_grades serves the $elemMatch on the
+#   project_id of get_student_id_to_correct and get_students_project_session.
+# - final_grade is a summary field: its index serves the range queries on it.
+# - teams_grade is a staging collection: its indexes serve the $or on the two team
+#   members in MongoDBTeamsGrade and are created again every time the collection is
+#   populated, since it is dropped once consumed. Both members are stored in every
+#   team (a blank member as "" or NaN), hence the indexes are not partial.
+# - ingestion_checkpoints has one document for each batch of a journaled ingestion:
+#   the run_id index serves the read of the checkpoints when a run is resumed.
+INDEXES = {
+    "enrolled_students": [
+        IndexModel([("MATRICOLA", ASCENDING)], name="MATRICOLA_unique", unique=True,
+                   partialFilterExpression={"MATRICOLA": {"$exists": True}}),
+    ],
+    "student_grade": [
+        IndexModel([("db_id", ASCENDING)], name="db_id_unique", unique=True),
+        IndexModel([("project_grades.project_id", ASCENDING),
+                    ("project_grades.report_grade", ASCENDING)],
+                   name="project_grades_project_id_report_grade"),
+        IndexModel([("final_grade", ASCENDING)], name="final_grade"),
+    ],
+    "teams_grade": [
+        IndexModel([("Student ID # 1", ASCENDING)], name="student_id_1"),
+        IndexModel([("Student ID # 2", ASCENDING)], name="student_id_2"),
+    ],
+    "ingestion_checkpoints": [
+        IndexModel([("run_id", ASCENDING)], name="run_id"),
+    ],
+}
+
+
+def ensure_indexes(db: Database, collections: list[str] | None = None,
+                   check_usage: bool = False) -> dict[str, list[str]]:
+    """
+    Create the missing indexes of INDEXES and verify the existing ones.
+    It is idempotent: the indexes already present are left untouched.
+
+    Args:
+        db (Database): The database where the indexes are created.
+        collections (list[str]): Restrict the check to these collections, all by default.
+        check_usage (bool): Also report the indexes never used since the server started.
+
+    Returns:
+        dict: The "collection.index" names grouped by outcome:
+            - created: indexes that were missing and have been created
+            - present: indexes already present with the expected definition
+            - mismatched: indexes present with the same name but a different definition
+            - unexpected: indexes present in the database but no longer declared
+            - unused: indexes with no access since the server started (only with check_usage)
+    """
+    report = {"created": [], "present": [], "mismatched": [], "unexpected": [],
+              "unused": []}
+    for collection_name, models in INDEXES.items():
+        if collections is not None and collection_name not in collections:
+            continue
+        collection = db[collection_name]
+        existing = collection.index_information()
+        missing = []
+        for model in models:
+            spec = model.document
+            name = f"{collection_name}.{spec['name']}"
+            if spec["name"] not in existing:
+                missing.append(model)
+                report["created"].append(name)
+            elif _same_definition(spec, existing[spec["name"]]):
+                report["present"].append(name)
+            else:
+                report["mismatched"].append(name)
+        if missing:
+            collection.create_indexes(missing)
+        declared = {model.document["name"] for model in models} | {"_id_"}
+        report["unexpected"] += [f"{collection_name}.{index_name}"
+                                 for index_name in existing
+                                 if index_name not in declared]
+        if check_usage:
+            report["unused"] += _unused_indexes(collection)
+    return report
+
+
+def _same_definition(spec: dict, index_info: dict) -> bool:
+    """Compare the IndexModel document with the output of index_information()"""
+    return (list(spec["key"].items()) == [tuple(key) for key in index_info["key"]]
+            and spec.get("unique", False) == index_info.get("unique", False)
+            and spec.get("partialFilterExpression") == index_info.get(
+                "partialFilterExpression"))
+
+
+def _unused_indexes(collection) -> list[str]:
+    """Indexes of the collection without accesses according to $indexStats"""
+    try:
+        stats = list(collection.aggregate([{"$indexStats": {}}]))
+    except OperationFailure:
+        # $indexStats requires the clusterMonitor role
+        return []
+    return [f"{collection.name}.{stat['name']}" for stat in stats
+            if stat["name"] != "_id_" and stat["accesses"]["ops"] == 0]
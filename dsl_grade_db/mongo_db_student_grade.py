@@ -1,42 +1,75 @@
 from __future__ import annotations
 
-from datetime import datetime
+import itertools
 
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import UpdateOne
 
+from .date_keys import entry_sort_key
 from .dsl_student_id_database import MongoDBStudentId
+from .mongo_db_connection import MongoDBConnection, get_connection
+from .student_grade_queries import DATE_KEYS_PROJECTION, FINAL_GRADE_PROJECTION, \
+    GRADE_FIELDS, LEGACY_PROJECTION, check_grades_found, checked_db_id, \
+    date_key_requests, final_grade_rows, grade_counts_pipeline, legacy_query, \
+    max_project_grade, max_written_grade, missing_date_keys_query, new_student_document, \
+    project_session_query, push_written_grade_request, push_written_grades_request, \
+    read_projection, rows_of_student_ids, summary_stages, to_correct_pipeline, \
+    upsert_project_grade_requests, with_summary, without_last_request
 
 
 class MongoDBStudentGrade:
-    def __init__(self, database_name="DSL_grade_dbs"):
-        self.client = MongoClient()
+    def __init__(self, database_name="DSL_grade_dbs",
+                 connection: MongoDBConnection | None = None):
+        self.connection = connection or get_connection()
+        self.client = self.connection.client
         self.db = self.client[database_name]
         self.collection = self.db["student_grade"]
-        self.db_id = MongoDBStudentId(database_name=database_name)
+        self.db_id = MongoDBStudentId(database_name=database_name,
+                                      connection=self.connection)
 
     def _get_db_id_from(self, student_id: str) -> ObjectId:
         """get the db_id from the student_id.
         Raise an error if the student_id is not in the database"""
-        db_id = self.db_id.get_db_id_from(student_id)
-        if db_id is None:
-            raise ValueError("Student ID not found in the database.")
-        return db_id
+        return checked_db_id(self.db_id.get_db_id_from(student_id))
+
+    # the request builders, kept on the class for the ingestors, see student_grade_queries
+    push_written_grade_request = staticmethod(push_written_grade_request)
+    push_written_grades_request = staticmethod(push_written_grades_request)
+    upsert_project_grade_requests = staticmethod(upsert_project_grade_requests)
+    with_summary = staticmethod(with_summary)
+    summary_stages = staticmethod(summary_stages)
+    _get_max_written_grade = staticmethod(max_written_grade)
+    _get_max_project_grade = staticmethod(max_project_grade)
 
     def insert_student(self, document: dict):
         """ Document comes from mongo_db_enrolled_student.py in data ingestor"""
         # Insert the student only if it does not exist yet
-        document = {
-            "student_id": str(document['MATRICOLA']),
-            "db_id": self._get_db_id_from(str(document['MATRICOLA'])),
-            "name": document['NOME'],
-            "surname": document['COGNOME - (*) Inserito dal docente'],
-            "written_grades": [],
-            "project_grades": []
-        }
-        if not self.collection.find_one({"db_id": document["db_id"]}):
+        document = new_student_document(
+            document, self._get_db_id_from(str(document['MATRICOLA'])))
+        if not self.collection.find_one({"db_id": document["db_id"]}, {"_id": 1}):
             self.collection.insert_one(document)
 
+    def insert_students(self, documents: list[dict]) -> int:
+        """Bulk version of insert_student: the students are inserted with a single
+        bulk write of upserts keyed on db_id, only if they do not exist yet.
+        Raise KeyError if one of the students is not in the student ID database.
+        Return the number of students actually inserted."""
+        db_ids, missing = self.db_id.get_db_ids_from(
+            [document['MATRICOLA'] for document in documents])
+        if missing:
+            raise KeyError(f"Student IDs {missing} not found in the database.")
+        requests = []
+        for document in documents:
+            document = new_student_document(
+                document, db_ids[str(document['MATRICOLA'])])
+            requests.append(UpdateOne({"db_id": document["db_id"]},
+                                      {"$setOnInsert": document},
+                                      upsert=True))
+        if not requests:
+            return 0
+        result = self.collection.bulk_write(requests, ordered=False)
+        return result.upserted_count
+
     def remove_student(self, student_id: str):
         """Delete a student from the database"""
         db_id = self._get_db_id_from(student_id)
@@ -55,101 +88,215 @@ class MongoDBStudentGrade:
 
     def update_students_have_rejected(self, student_ids: list[str]):
         """Update the students that have rejected the project"""
+        # resolve all the students before updating any of them
+        db_ids, missing = self.db_id.get_db_ids_from(student_ids)
+        if missing:
+            raise KeyError(f"Student IDs {missing} not found in the database.")
         for student_id in student_ids:
-            db_id = self._get_db_id_from(student_id)
-            student = self.collection.find_one({"db_id": db_id})
+            student = self.collection.find_one({"db_id": db_ids[str(student_id)]},
+                                               {"written_grades": 1, "project_grades": 1})
             # get and sort project_grades
             project_grades = student['project_grades']
-            project_grades.sort(
-                key=lambda x: datetime.strptime(x['project_id'], '%d/%m/%Y'))
+            project_grades.sort(key=lambda x: entry_sort_key(x, 'project_id'))
             # get and sort written_grades
             written_grades = student['written_grades']
-            written_grades.sort(key=lambda x: datetime.strptime(x['date'], '%d/%m/%Y'))
+            written_grades.sort(key=lambda x: entry_sort_key(x, 'date'))
             # update student
             self.update_student_written_grade(student_id, written_grades[:-1])
             self.update_student_project_grade(student_id, project_grades[:-1])
 
-    def get_student(self, student_id: str) -> dict:
-        """Get a student from the database"""
+    def update_students_have_rejected_bulk(self, student_ids: list[str]) -> dict:
+        """
+        Bulk version of update_students_have_rejected: the last written grade and the
+        last project grade of all the students are removed on the server with one
+        bulk write of update pipelines, after one read of the array sizes.
+        Raise KeyError, before writing anything, if one of the students is not in the
+        database or has no grades document.
+
+        Returns:
+            dict: the number of students updated and the student IDs
+            with no written and no project grade to remove
+        """
+        db_ids, missing = self.db_id.get_db_ids_from(student_ids)
+        if missing:
+            raise KeyError(f"Student IDs {missing} not found in the database.")
+        student_ids_by_db_id = {db_id: student_id for student_id, db_id in db_ids.items()}
+        sizes = list(self.collection.aggregate(
+            grade_counts_pipeline(list(db_ids.values()))))
+        check_grades_found(student_ids_by_db_id, sizes)
+        requests, nothing_to_drop = [], []
+        for student in sizes:
+            if student["grades"] == 0:
+                nothing_to_drop.append(student_ids_by_db_id[student["db_id"]])
+                continue
+            requests.append(without_last_request(student["db_id"]))
+        return {"updated": self.bulk_write(requests), "nothing_to_drop": nothing_to_drop}
+
+    def get_student(self, student_id: str, projection: dict | None = None,
+                    lean: bool = False) -> dict:
+        """Get a student from the database.
+        Only the fields of the projection are returned if given, and the raw csv rows
+        of the grades are not returned if lean"""
         db_id = self._get_db_id_from(str(student_id))
-        student = self.collection.find_one({"db_id": db_id})
+        student = self.collection.find_one({"db_id": db_id},
+                                           read_projection(projection, lean))
         return student
 
     def get_final_grade_given(self, student_id):
         """Get the final grade of a student"""
         db_id = self._get_db_id_from(student_id)
-        student = self.collection.find_one({"db_id": db_id})
-        written = self._get_max_written_grade(student['written_grades'])
-        project = self._get_max_project_grade(student['project_grades'])
+        student = self.collection.find_one({"db_id": db_id}, {"final_grade": 1})
+        if "final_grade" in student:
+            return student["final_grade"]
+        # student stored before the summary fields: compute it from the grades
+        student = self.collection.find_one({"db_id": db_id},
+                                           {field: 1 for field in GRADE_FIELDS})
+        written = max_written_grade(student['written_grades'])
+        project = max_project_grade(student['project_grades'])
         return written + project if written and project else None
 
-    def _get_max_written_grade(self, written_grades) -> float | None:
-        """Get the max written grade of a student"""
-        # TODO: this is not the max written grade, but the last one for this version
-        # order based on date, ascending
-        written_grades.sort(key=lambda x: datetime.strptime(x['date'], '%d/%m/%Y'))
-        return written_grades[-1]["grade"] if written_grades else None
-
-    def _get_max_project_grade(self, project_grades) -> float | None:
-        """Get the max report grade of a student"""
-        # select only the projects where there is the report and the leaderboard grade
-        # project_grades = [project for project in project_grades
-        #                   if 'report_grade' in project and 'leaderboard_grade' in project]
-        # # sort the projects based on project_id (date)
-        # project_grades.sort(key=lambda x: x['project_id'])
-        # return project_grades[-1]["final_grade"] if project_grades else None
-        grades = [project['final_grade'] for project in project_grades
-                  if 'report_grade' in project and 'leaderboard_grade' in project]
-        return max(grades) if grades else None
-
-    def get_student_id_to_correct(self, threshold: float):
+    def get_final_grades(self, student_ids: list[str] | None = None, batch_size: int = 1000):
+        """
+        Cohort-wide version of get_final_grade_given: the final grades of all the
+        students, in the order they were inserted, or of the given student IDs, in
+        their order, with one projected scan of the summary fields. The students stored
+        before the summary fields are computed from their grades, with one more query
+        for each batch of batch_size students.
+        Raise KeyError if one of the student IDs is not in the database or has no
+        grades document.
+
+        Yields:
+            tuple: (student_id, last written grade, best project grade, final grade)
+        """
+        if student_ids is None:
+            cursor = self.collection.find({}, FINAL_GRADE_PROJECTION).sort("_id", 1)
+            cursor = cursor.batch_size(batch_size)
+            while students := list(itertools.islice(cursor, batch_size)):
+                for _, row in self._final_grade_rows(students):
+                    yield row
+            return
+        db_ids, missing = self.db_id.get_db_ids_from(student_ids)
+        if missing:
+            raise KeyError(f"Student IDs {missing} not found in the database.")
+        students = list(self.collection.find({"db_id": {"$in": list(db_ids.values())}},
+                                             FINAL_GRADE_PROJECTION))
+        yield from rows_of_student_ids(self._final_grade_rows(students), student_ids, db_ids)
+
+    def _final_grade_rows(self, students: list[dict]) -> list[tuple]:
+        query = legacy_query(students)
+        legacy_students = list(self.collection.find(query, LEGACY_PROJECTION)) if query else []
+        return final_grade_rows(students, legacy_students)
+
+    def iter_student_id_with_final_grade(self, min_grade: float, batch_size: int = 1000):
+        """The student ID of the students with a final grade of at least min_grade,
+        selected with a range scan of the final_grade index"""
+        cursor = self.collection.find({"final_grade": {"$gte": min_grade}},
+                                      {"_id": 0, "student_id": 1}).batch_size(batch_size)
+        return (student["student_id"] for student in cursor)
+
+    def get_student_id_to_correct(self, threshold: float) -> list[str]:
         """Get the student ID of the students that have to correct their report"""
+        return list(self.iter_student_id_to_correct(threshold))
+
+    def iter_student_id_to_correct(self, threshold: float, batch_size: int = 1000):
+        """Streaming version of get_student_id_to_correct: the students are selected
+        on the server by a single aggregation and only their student ID is returned"""
         project_id = self.db_id.get_project_id()
-        # There is at least one project with the current projectID
-        # and the report grade not yet assigned
-        # TODO: if No submission to leaderboard, we should not consider it
-        # TODO: consume_documents_in_teams() in teams_grade.py
-        students = self.collection.find({
-            "project_grades": {
-                "$elemMatch": {
-                    "project_id": project_id,
-                    "report_grade": {"$exists": False},
-                }}
-        })
-        # now we have all the students that participate in the projectID
-        # select only those with a max_written_grade >= Threshold
-        students_ids = [self.db_id.get_student_id_from(student["db_id"])
-                        for student in students
-                        if self._get_max_written_grade(
-                student['written_grades']) >= threshold]
-        return students_ids
-
-    def get_students_project_session(self) -> list[dict]:
-        """Get the final students"""
+        pipeline = to_correct_pipeline(project_id, threshold)
+        cursor = self.collection.aggregate(pipeline, batchSize=batch_size)
+        return (student["student_id"] for student in cursor)
+
+    def get_students_project_session(self, projection: dict | None = None,
+                                     lean: bool = False) -> list[dict]:
+        """Get the final students, with the projection or lean read of get_student"""
+        return list(self.iter_students_project_session(projection, lean))
+
+    def iter_students_project_session(self, projection: dict | None = None,
+                                      lean: bool = False, batch_size: int = 1000):
+        """Streaming version of get_students_project_session: the cursor over the
+        students, fetched from the server in batches of batch_size"""
         # Return the students that have completed the current session project
         project_id = self.db_id.get_project_id()
-        students = self.collection.find({
-            "project_grades": {
-                "$elemMatch": {
-                    "project_id": project_id,
-                    "report_grade": {"$exists": True},
-                    "leaderboard_grade": {"$exists": True}
-                }}
-        })
-        return list(students)
+        students = self.collection.find(project_session_query(project_id),
+                                        read_projection(projection, lean))
+        return students.batch_size(batch_size)
 
     def update_student_project_grade(self, student_id: str, project_grades: list):
         """Update the project grade of a student"""
         db_id = self.db_id.get_db_id_from(student_id)
-        self.collection.update_one({"db_id": db_id},
-                                   {"$set": {"project_grades": project_grades}})
+        self.collection.update_one({"db_id": db_id}, with_summary(
+            [{"$set": {"project_grades": {"$literal": project_grades}}}]))
 
     def update_student_written_grade(self, student_id: str, written_grades: list):
         """Update the written grade of a student"""
         db_id = self.db_id.get_db_id_from(student_id)
-        self.collection.update_one({"db_id": db_id},
-                                   {"$set": {"written_grades": written_grades}})
+        self.collection.update_one({"db_id": db_id}, with_summary(
+            [{"$set": {"written_grades": {"$literal": written_grades}}}]))
+
+    def push_written_grade(self, student_id: str, written_grade: dict) -> bool:
+        """Append the written grade to the student only if the student has no written
+        grade with the same date. Return True if it has been appended"""
+        db_id = self._get_db_id_from(str(student_id))
+        result = self.collection.bulk_write([push_written_grade_request(db_id,
+                                                                        written_grade)])
+        return result.modified_count > 0
+
+    def get_written_grade_dates(self, db_ids: list[ObjectId]) -> dict[ObjectId, set[str]]:
+        """The dates of the written grades of each student, read with one query"""
+        students = self.collection.find({"db_id": {"$in": db_ids}},
+                                        {"_id": 0, "db_id": 1, "written_grades.date": 1})
+        return {student["db_id"]: {grade["date"] for grade in student.get("written_grades", [])}
+                for student in students}
+
+    def upsert_project_grade(self, student_id: str, project_grade: dict, grade_field: str,
+                             patch: bool = True) -> bool:
+        """
+        Add the project grade to the student, or patch the element of the student with
+        the same project_id. See upsert_project_grade_requests.
+        Return True if the student has been modified.
+        """
+        db_id = self._get_db_id_from(str(student_id))
+        requests = upsert_project_grade_requests(db_id, project_grade, grade_field, patch)
+        return self.bulk_write(requests) > 0
+
+    def bulk_write(self, requests: list[UpdateOne]) -> int:
+        """Send the requests of the *_request(s) methods with one unordered bulk write.
+        Return the number of students modified"""
+        if not requests:
+            return 0
+        return self.collection.bulk_write(requests, ordered=False).modified_count
+
+    def rebuild_summaries(self) -> int:
+        """Compute the summary fields of all the students, for the students stored
+        before they were introduced. Return the number of students changed"""
+        return self.collection.update_many({}, summary_stages()).modified_count
+
+    def migrate_date_keys(self, batch_size: int = 1000) -> dict:
+        """
+        Add the date_key to the written and project grades stored without it.
+        The students are processed in batches of batch_size, each one with a single
+        bulk write. The migration is resumable: only the elements without the
+        date_key are selected and updated, hence an interrupted migration continues
+        from the students not migrated yet when it is run again.
+        The project ids that are not a date get a null date_key.
+
+        Returns:
+            dict: the number of students migrated and of batches written
+        """
+        counts = {"students": 0, "batches": 0}
+        last_id = None
+        while True:
+            students = list(self.collection.find(missing_date_keys_query(last_id),
+                                                 DATE_KEYS_PROJECTION)
+                            .sort("_id", 1).limit(batch_size))
+            if not students:
+                return counts
+            requests = date_key_requests(students)
+            self.bulk_write(requests)
+            counts["students"] += len(requests)
+            counts["batches"] += 1
+            last_id = students[-1]["_id"]
 
     def close(self):
-        """Close the database"""
-        self.client.close()
+        """Kept for compatibility: the connection is shared with the other objects
+        using it, hence only its owner closes it (MongoDBConnection.close)"""
@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import time
+
+from .data_ingestor import MongoDBEnrolledStudent, MongoDBReportGrade, MongoDBTeamsGrade, \
+    MongoDBWrittenGrade, ParallelIngestion
+from .instrumentation import CommandInstrumentation
+from .mongo_db_connection import MongoDBConnection
+from .mongo_db_student_grade import MongoDBStudentGrade
+from .session_exporter import export_students_project_session
+
+# the stages of a grading session, in the order of the 01-06 scripts
+STAGES = ["enrolled", "written", "teams", "to_correct", "report", "final_grades"]
+
+
+class SessionPipeline:
+    """
+    Run the stages of a grading session (the 01-06 scripts) in one process.
+    The stages share one connection and one MongoDBStudentGrade, hence the student ID
+    cache filled by a stage is used by the following ones. The input files are needed
+    only by the stages that are run.
+    For each stage run() reports the wall time, the rows processed (the main count of
+    the stage: students inserted, exams inserted, students updated or written to the
+    output file) and the round trips to the server.
+    With backend="memory" the session runs on the in-memory engine, e.g. to simulate
+    the grades of a session without a server.
+    """
+
+    def __init__(self, database_name="DSL_grade_dbs", host: str | None = None,
+                 enrolled_csv_file_path: str | None = None,
+                 written_csv_file_path: str | None = None,
+                 teams_csv_file_path: str | None = None,
+                 leaderboard_csv_file_path: str | None = None,
+                 report_csv_file_path: str | None = None,
+                 threshold: float = 15,
+                 students_id_to_correct_file: str = "students_id_to_correct.txt",
+                 students_final_grade_file: str = "students_final_grade.ndjson",
+                 file_format: str = "ndjson",
+                 ingestion: ParallelIngestion | None = None,
+                 backend: str | None = None):
+        self.database_name = database_name
+        self.files = {"enrolled": enrolled_csv_file_path, "written": written_csv_file_path,
+                      "teams": teams_csv_file_path, "leaderboard": leaderboard_csv_file_path,
+                      "report": report_csv_file_path}
+        self.threshold = threshold
+        self.students_id_to_correct_file = students_id_to_correct_file
+        self.students_final_grade_file = students_final_grade_file
+        self.file_format = file_format
+        # the ingestors use the parallel methods if given, the bulk ones otherwise
+        self.ingestion = ingestion
+        self.instrumentation = CommandInstrumentation()
+        self.connection = MongoDBConnection(host, backend,
+                                            event_listeners=[self.instrumentation])
+        self.student_db = MongoDBStudentGrade(database_name=database_name,
+                                              connection=self.connection)
+
+    def run(self, stages: list[str] | None = None) -> list[dict]:
+        """
+        Run the stages (all of them by default) in the order of STAGES.
+
+        Returns:
+            list[dict]: for each stage its name, seconds, rows, round_trips and the
+            result of the stage
+        """
+        stages = stages or STAGES
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if unknown:
+            raise ValueError(f"Stages {unknown} not supported, use {STAGES}.")
+        report = []
+        for stage in [stage for stage in STAGES if stage in stages]:
+            start = time.perf_counter()
+            with self.instrumentation.measure() as measurement:
+                rows, result = getattr(self, f"_{stage}")()
+            report.append({"stage": stage,
+                           "seconds": time.perf_counter() - start,
+                           "rows": rows,
+                           "round_trips": measurement.round_trips(),
+                           "result": result})
+        return report
+
+    def _file(self, name: str) -> str:
+        if self.files[name] is None:
+            raise ValueError(f"The {name} csv file is needed by the stages run.")
+        return self.files[name]
+
+    def _warm_cache(self):
+        """The stages after the enrolled one resolve the students from the cache"""
+        if not len(self.student_db.db_id.cache):
+            self.student_db.db_id.warm_cache()
+
+    def _enrolled(self) -> tuple[int, dict]:
+        ingestor = MongoDBEnrolledStudent(self._file("enrolled"), self.database_name,
+                                          connection=self.connection)
+        ingestor.mongo_db_student_id = self.student_db.db_id
+        ingestor.mongo_db_student_grade = self.student_db
+        result = ingestor.consume_file_parallel(self.ingestion) if self.ingestion \
+            else ingestor.consume_file_bulk()
+        return result["inserted"], result
+
+    def _written(self) -> tuple[int, dict]:
+        self._warm_cache()
+        ingestor = MongoDBWrittenGrade(self.database_name, self._file("written"),
+                                       connection=self.connection)
+        ingestor.student_coll = self.student_db
+        result = ingestor.consume_documents_parallel(self.ingestion) if self.ingestion \
+            else ingestor.consume_documents_bulk()
+        return result["inserted"], result
+
+    def _teams(self) -> tuple[int, dict]:
+        self._warm_cache()
+        ingestor = MongoDBTeamsGrade(self.database_name, self._file("leaderboard"),
+                                     self._file("teams"), connection=self.connection)
+        ingestor.student_coll = self.student_db
+        result = ingestor.consume_documents_in_teams_parallel(self.ingestion) \
+            if self.ingestion else ingestor.consume_documents_in_teams_bulk()
+        return result["updated"], result
+
+    def _to_correct(self) -> tuple[int, dict]:
+        student_ids = list(self.student_db.iter_student_id_to_correct(self.threshold))
+        with open(self.students_id_to_correct_file, "w") as file:
+            file.write("\n".join(student_ids))
+        return len(student_ids), {"file": self.students_id_to_correct_file}
+
+    def _report(self) -> tuple[int, dict]:
+        self._warm_cache()
+        ingestor = MongoDBReportGrade(self.database_name, self._file("report"),
+                                      connection=self.connection)
+        ingestor.student_coll = self.student_db
+        result = ingestor.consume_documents_parallel(self.ingestion) if self.ingestion \
+            else ingestor.consume_documents_bulk()
+        return result["updated"], result
+
+    def _final_grades(self) -> tuple[int, dict]:
+        exported = export_students_project_session(self.student_db,
+                                                   self.students_final_grade_file,
+                                                   file_format=self.file_format)
+        return exported, {"file": self.students_final_grade_file}
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def format_report(report: list[dict]) -> str:
+    """The report of SessionPipeline.run as a table"""
+    lines = [f"{'stage':<14}{'seconds':>10}{'rows':>10}{'round trips':>14}"]
+    for stage in report:
+        lines.append(f"{stage['stage']:<14}{stage['seconds']:>10.3f}{stage['rows']:>10}"
+                     f"{stage['round_trips']:>14}")
+    lines.append(f"{'total':<14}{sum(stage['seconds'] for stage in report):>10.3f}"
+                 f"{sum(stage['rows'] for stage in report):>10}"
+                 f"{sum(stage['round_trips'] for stage in report):>14}")
+    return "\n".join(lines)
@@ -0,0 +1,110 @@
+from __future__ import annotations
+
+import csv
+import json
+import math
+from datetime import datetime
+from typing import IO, Iterable
+
+from bson import Decimal128, ObjectId
+
+from .mongo_db_student_grade import MongoDBStudentGrade
+
+# the columns of the csv export by default, the dotted fields are read from the
+# sub-documents and the nested values are written as JSON
+CSV_FIELDS = ["student_id", "name", "surname",
+              "last_written_grade", "best_project_grade", "final_grade"]
+
+
+class BSONEncoder(json.JSONEncoder):
+    """JSON encoder of the documents read from MongoDB:
+    ObjectId and Decimal128 become strings and the dates ISO 8601 strings"""
+
+    def default(self, o):
+        if isinstance(o, (ObjectId, Decimal128)):
+            return str(o)
+        if isinstance(o, datetime):
+            return o.isoformat()
+        return super().default(o)
+
+
+def _without_nan(value):
+    """The NaN of the empty csv cells stored with the grades are not valid JSON"""
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if isinstance(value, dict):
+        return {key: _without_nan(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_without_nan(item) for item in value]
+    return value
+
+
+def to_json(document: dict) -> str:
+    return json.dumps(_without_nan(document), cls=BSONEncoder, allow_nan=False)
+
+
+def _field(document: dict, field: str):
+    for key in field.split("."):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+def write_ndjson(documents: Iterable[dict], file: IO[str]) -> int:
+    """Write one JSON document per line, as they are read from the cursor.
+    Return the number of documents written"""
+    count = 0
+    for document in documents:
+        file.write(to_json(document) + "\n")
+        count += 1
+    return count
+
+
+def write_csv(documents: Iterable[dict], file: IO[str],
+              fields: list[str] | None = None) -> int:
+    """Write one csv row per document with the given (dotted) fields, as they are
+    read from the cursor. Return the number of documents written"""
+    fields = fields or CSV_FIELDS
+    writer = csv.writer(file)
+    writer.writerow(fields)
+    count = 0
+    for document in documents:
+        row = []
+        for field in fields:
+            value = _without_nan(_field(document, field))
+            if isinstance(value, (dict, list)):
+                value = to_json(value)
+            elif isinstance(value, (ObjectId, Decimal128, datetime)):
+                value = BSONEncoder().default(value)
+            row.append(value)
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def export_students_project_session(student_db: MongoDBStudentGrade, path: str,
+                                    file_format: str = "ndjson", batch_size: int = 1000,
+                                    lean: bool = False, fields: list[str] | None = None) -> int:
+    """
+    Stream the students of get_students_project_session to the file, row by row,
+    so that the memory does not grow with the number of students.
+
+    Args:
+        student_db (MongoDBStudentGrade): The student grade database.
+        path (str): The output file.
+        file_format (str): "ndjson" (one document per line) or "csv" (the given fields).
+        batch_size (int): The number of students fetched for each round trip.
+        lean (bool): Do not export the raw csv rows stored with the grades.
+        fields (list[str]): The columns of the csv export, CSV_FIELDS by default.
+
+    Returns:
+        int: The number of students exported.
+    """
+    if file_format not in ("ndjson", "csv"):
+        raise ValueError(f"Format {file_format} not supported, use ndjson or csv.")
+    students = student_db.iter_students_project_session(lean=lean, batch_size=batch_size)
+    with open(path, "w", newline="" if file_format == "csv" else None) as file:
+        if file_format == "csv":
+            return write_csv(students, file, fields)
+        return write_ndjson(students, file)
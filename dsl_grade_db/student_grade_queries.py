@@ -0,0 +1,375 @@
+"""
+The queries, the aggregation pipelines and the update requests on the student_grade
+collection, shared by MongoDBStudentGrade and AsyncMongoDBStudentGrade: the two
+classes only send them, hence the documents written by the two are the same.
+"""
+from __future__ import annotations
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from .date_keys import date_key_expression, entry_sort_key, to_date_key
+
+# the raw csv rows stored with each grade, excluded by the lean reads
+RAW_INFO_FIELDS = ["written_grades.written_info", "project_grades.report_info",
+                   "project_grades.team_info", "project_grades.leaderboard_info"]
+# the fields of the grades used to compute the final grade
+GRADE_FIELDS = ["written_grades.date", "written_grades.date_key", "written_grades.grade",
+                "project_grades.project_id", "project_grades.report_grade",
+                "project_grades.leaderboard_grade", "project_grades.final_grade"]
+
+# the fields read by get_final_grades: the summary fields, and the grades of the
+# students stored before them
+FINAL_GRADE_PROJECTION = {"db_id": 1, "student_id": 1, "last_written_grade": 1,
+                          "best_project_grade": 1, "final_grade": 1}
+LEGACY_PROJECTION = {"db_id": 1, "student_id": 1, **{field: 1 for field in GRADE_FIELDS}}
+
+
+def checked_db_id(db_id: ObjectId | None) -> ObjectId:
+    """The db_id resolved from a student ID. Raise ValueError if it is missing"""
+    if db_id is None:
+        raise ValueError("Student ID not found in the database.")
+    return db_id
+
+
+def new_student_document(document: dict, db_id: ObjectId) -> dict:
+    """Create the student_grade document from an enrolled student row"""
+    return {
+        "student_id": str(document['MATRICOLA']),
+        "db_id": db_id,
+        "name": document['NOME'],
+        "surname": document['COGNOME - (*) Inserito dal docente'],
+        "written_grades": [],
+        "project_grades": [],
+        # summary fields, see summary_stages()
+        "last_written_grade": None,
+        "best_project_grade": None,
+        "final_grade": None
+    }
+
+
+def read_projection(projection: dict | None, lean: bool) -> dict | None:
+    """The projection of the getters: the given one, or the whole document without
+    the raw csv rows (RAW_INFO_FIELDS) if lean"""
+    if projection is not None and lean:
+        raise ValueError("Use either a projection or a lean read.")
+    if lean:
+        return {field: 0 for field in RAW_INFO_FIELDS}
+    return projection
+
+
+def max_written_grade(written_grades) -> float | None:
+    """Get the max written grade of a student"""
+    # TODO: this is not the max written grade, but the last one for this version
+    # order based on date, ascending
+    written_grades.sort(key=lambda x: entry_sort_key(x, 'date'))
+    return written_grades[-1]["grade"] if written_grades else None
+
+
+def max_project_grade(project_grades) -> float | None:
+    """Get the max report grade of a student"""
+    # select only the projects where there is the report and the leaderboard grade
+    # project_grades = [project for project in project_grades
+    #                   if 'report_grade' in project and 'leaderboard_grade' in project]
+    # # sort the projects based on project_id (date)
+    # project_grades.sort(key=lambda x: x['project_id'])
+    # return project_grades[-1]["final_grade"] if project_grades else None
+    grades = [project['final_grade'] for project in project_grades
+              if 'report_grade' in project and 'leaderboard_grade' in project]
+    return max(grades) if grades else None
+
+
+def max_written_grade_expression() -> dict:
+    """Aggregation expression of max_written_grade: the grade of the written
+    exam with the most recent date (the last one in the array for the same date).
+    The date is parsed only for the exams stored without the date_key"""
+    return {"$let": {
+        "vars": {"last": {"$reduce": {
+            "input": "$written_grades",
+            "initialValue": None,
+            "in": {"$cond": [{"$gte": [date_key_expression("$$this", "date"),
+                                       date_key_expression("$$value", "date")]},
+                             "$$this", "$$value"]}
+        }}},
+        "in": "$$last.grade"
+    }}
+
+
+def summary_stages() -> list[dict]:
+    """Update pipeline stages computing the summary fields from the grades,
+    with the same rules of get_final_grade_given:
+    - last_written_grade: the grade of the most recent written exam
+    - best_project_grade: the max final grade of the projects with both
+      the report and the leaderboard grade
+    - final_grade: their sum, None if one of them is missing (or zero)
+    """
+
+    def exists(field):
+        return {"$ne": [{"$type": field}, "missing"]}
+
+    completed_projects = {"$filter": {
+        "input": "$project_grades",
+        "cond": {"$and": [exists("$$this.report_grade"),
+                          exists("$$this.leaderboard_grade")]}
+    }}
+    return [
+        {"$set": {
+            "last_written_grade": {"$ifNull": [max_written_grade_expression(),
+                                               None]},
+            "best_project_grade": {"$max": {"$map": {"input": completed_projects,
+                                                     "in": "$$this.final_grade"}}},
+        }},
+        {"$set": {
+            "final_grade": {"$cond": [
+                {"$and": ["$last_written_grade", "$best_project_grade"]},
+                {"$add": ["$last_written_grade", "$best_project_grade"]},
+                None]},
+        }},
+    ]
+
+
+def with_summary(stages: list[dict]) -> list[dict]:
+    """The update pipeline that applies the stages and then refreshes the summary
+    fields, so that they change atomically with the grades.
+    Every update of written_grades or project_grades must go through it."""
+    return stages + summary_stages()
+
+
+def push_written_grade_request(db_id: ObjectId, written_grade: dict) -> UpdateOne:
+    """The request of push_written_grade, for the bulk writes. Only the new element
+    is sent, while the server rewrites the array with the update pipeline: the
+    update is atomic on the document, hence the concurrent updates of the other
+    elements are not lost"""
+    return UpdateOne(
+        {"db_id": db_id, "written_grades.date": {"$ne": written_grade['date']}},
+        with_summary([{"$set": {"written_grades": {
+            "$concatArrays": ["$written_grades", [{"$literal": written_grade}]]
+        }}}])
+    )
+
+
+def push_written_grades_request(db_id: ObjectId, written_grades: list[dict]) -> UpdateOne:
+    """The request appending the written grades of one student, with one date each:
+    only the ones with a date the student has no written grade for are appended"""
+    return UpdateOne({"db_id": db_id}, with_summary([{"$set": {"written_grades": {
+        "$concatArrays": ["$written_grades", {"$filter": {
+            "input": {"$literal": written_grades},
+            "cond": {"$not": [{"$in": ["$$this.date",
+                                       {"$ifNull": ["$written_grades.date", []]}]}]}
+        }}]
+    }}}]))
+
+
+def upsert_project_grade_requests(db_id: ObjectId, project_grade: dict,
+                                  grade_field: str, patch: bool = True) -> list[UpdateOne]:
+    """
+    The requests of upsert_project_grade, for the bulk writes. They exclude each
+    other, hence they can be executed in any order:
+    - push the project grade if the student has no project with its project_id
+    - otherwise, if patch and the grade_field (e.g. "report_grade") is not set yet,
+      set the fields of the project grade in the existing element and add the
+      grade to its final_grade
+    Only the new or changed fields are sent, while the server rewrites the whole
+    array with the update pipeline ($concatArrays, $map and $mergeObjects). The
+    update is atomic on the document, hence the concurrent updates of the other
+    elements are not lost. The raw csv rows go through $literal, so that their
+    column names (with dots, e.g. "D. 1 /0,00") are not parsed as field paths.
+    """
+    project_id = project_grade['project_id']
+    requests = [UpdateOne(
+        {"db_id": db_id, "project_grades.project_id": {"$ne": project_id}},
+        with_summary([{"$set": {"project_grades": {
+            "$concatArrays": ["$project_grades", [{"$literal": project_grade}]]
+        }}}])
+    )]
+    if patch:
+        fields = {field: value for field, value in project_grade.items()
+                  if field not in ('project_id', 'date_key', 'final_grade')}
+        requests.append(UpdateOne(
+            {"db_id": db_id,
+             "project_grades": {"$elemMatch": {"project_id": project_id,
+                                               grade_field: {"$exists": False}}}},
+            with_summary([{"$set": {"project_grades": {"$map": {
+                "input": "$project_grades",
+                "in": {"$cond": [
+                    {"$and": [{"$eq": ["$$this.project_id", project_id]},
+                              {"$eq": [{"$type": f"$$this.{grade_field}"}, "missing"]}]},
+                    {"$mergeObjects": [
+                        "$$this",
+                        {"$literal": fields},
+                        {"final_grade": {"$add": ["$$this.final_grade",
+                                                  fields[grade_field]]}}]},
+                    "$$this"]}
+            }}}}])
+        ))
+    return requests
+
+
+def grade_counts_pipeline(db_ids: list[ObjectId]) -> list[dict]:
+    """The number of written and project grades of each student"""
+    return [
+        {"$match": {"db_id": {"$in": db_ids}}},
+        {"$project": {"_id": 0, "db_id": 1,
+                      "grades": {"$add": [{"$size": "$written_grades"},
+                                          {"$size": "$project_grades"}]}}}
+    ]
+
+
+def check_grades_found(student_ids_by_db_id: dict, sizes: list[dict]):
+    """Raise KeyError for the enrolled students without a grades document, which
+    are not in the result of grade_counts_pipeline"""
+    found = {student["db_id"] for student in sizes}
+    not_found = [student_id for db_id, student_id in student_ids_by_db_id.items()
+                 if db_id not in found]
+    if not_found:
+        raise KeyError(f"Student IDs {not_found} have no grades in the database.")
+
+
+def without_last_request(db_id: ObjectId) -> UpdateOne:
+    """The request of update_students_have_rejected_bulk for one student"""
+    return UpdateOne({"db_id": db_id}, with_summary([
+        {"$set": {
+            "written_grades": without_last_expression("$written_grades", "date"),
+            "project_grades": without_last_expression("$project_grades", "project_id")}}
+    ]))
+
+
+def without_last_expression(grades: str, field: str) -> dict:
+    """Aggregation expression of the grades without the one with the most recent
+    date (the last one in the array for the same date), as the sort and slice of
+    update_students_have_rejected"""
+
+    def date_key(index):
+        return date_key_expression({"$arrayElemAt": [grades, index]}, field)
+
+    indexes = {"$range": [0, {"$size": grades}]}
+    last_index = {"$reduce": {
+        "input": indexes,
+        "initialValue": -1,
+        "in": {"$cond": [{"$or": [{"$eq": ["$$value", -1]},
+                                  {"$gte": [date_key("$$this"), date_key("$$value")]}]},
+                         "$$this", "$$value"]}
+    }}
+    return {"$let": {
+        "vars": {"last": last_index},
+        "in": {"$map": {
+            "input": {"$filter": {"input": indexes, "as": "index",
+                                  "cond": {"$ne": ["$$index", "$$last"]}}},
+            "as": "index",
+            "in": {"$arrayElemAt": [grades, "$$index"]}
+        }}
+    }}
+
+
+def to_correct_pipeline(project_id: str, threshold: float) -> list[dict]:
+    """The aggregation of iter_student_id_to_correct"""
+    return [
+        # There is at least one project with the current projectID
+        # and the report grade not yet assigned
+        # TODO: if No submission to leaderboard, we should not consider it
+        # TODO: consume_documents_in_teams() in teams_grade.py
+        {"$match": {
+            "project_grades": {
+                "$elemMatch": {
+                    "project_id": project_id,
+                    "report_grade": {"$exists": False},
+                }}
+        }},
+        # now we have all the students that participate in the projectID
+        # select only those with a max_written_grade >= Threshold
+        {"$project": {"_id": 0, "student_id": 1,
+                      "written_grade": max_written_grade_expression()}},
+        {"$match": {"written_grade": {"$gte": threshold}}},
+        {"$project": {"student_id": 1}},
+    ]
+
+
+def project_session_query(project_id: str) -> dict:
+    """The students with both the report and the leaderboard grade of the project"""
+    return {
+        "project_grades": {
+            "$elemMatch": {
+                "project_id": project_id,
+                "report_grade": {"$exists": True},
+                "leaderboard_grade": {"$exists": True}
+            }}
+    }
+
+
+def missing_date_keys_query(last_id: ObjectId | None = None) -> dict:
+    """The students with grades without the date_key, after last_id if given: the
+    batches of migrate_date_keys, sorted by _id"""
+    missing_key = {"$elemMatch": {"date_key": {"$exists": False}}}
+    query = {"$or": [{"written_grades": missing_key}, {"project_grades": missing_key}]}
+    return query if last_id is None else {**query, "_id": {"$gt": last_id}}
+
+
+# the fields read by migrate_date_keys
+DATE_KEYS_PROJECTION = {"written_grades.date": 1, "written_grades.date_key": 1,
+                        "project_grades.project_id": 1, "project_grades.date_key": 1}
+
+
+def date_key_requests(students: list[dict]) -> list[UpdateOne]:
+    """The requests of a batch of migrate_date_keys, one for each student to migrate"""
+    requests = [date_key_request(student) for student in students]
+    return [request for request in requests if request is not None]
+
+
+def date_key_request(student: dict) -> UpdateOne | None:
+    """Set the date_key of the elements without it, one array filter for each date.
+    The array filters also require the date_key to be missing, so that the elements
+    added or migrated meanwhile are left untouched"""
+    update, array_filters = {}, []
+    for array, field in [("written_grades", "date"), ("project_grades", "project_id")]:
+        values = {entry[field] for entry in student.get(array, [])
+                  if "date_key" not in entry and field in entry}
+        for value in values:
+            identifier = f"{field.replace('_', '')}{len(array_filters)}"
+            update[f"{array}.$[{identifier}].date_key"] = to_date_key(value)
+            array_filters.append({f"{identifier}.{field}": value,
+                                  f"{identifier}.date_key": {"$exists": False}})
+    if not update:
+        return None
+    return UpdateOne({"_id": student["_id"]}, {"$set": update},
+                     array_filters=array_filters)
+
+
+def legacy_query(students: list[dict]) -> dict | None:
+    """The query of the grades of the students stored before the summary fields,
+    see final_grade_rows. None if there are none"""
+    legacy_ids = [student["_id"] for student in students if "final_grade" not in student]
+    return {"_id": {"$in": legacy_ids}} if legacy_ids else None
+
+
+def final_grade_rows(students: list[dict],
+                     legacy_students: list[dict]) -> list[tuple[ObjectId, tuple]]:
+    """
+    The rows of get_final_grades of a batch of students read with
+    FINAL_GRADE_PROJECTION, in the same order, with their db_id. The students stored
+    before the summary fields are computed from their grades (legacy_students).
+    """
+    legacy = {student["_id"]: student for student in legacy_students}
+    rows = []
+    for student in students:
+        if "final_grade" in student:
+            row = (student["student_id"], student["last_written_grade"],
+                   student["best_project_grade"], student["final_grade"])
+        else:
+            grades = legacy[student["_id"]]
+            written = max_written_grade(grades['written_grades'])
+            project = max_project_grade(grades['project_grades'])
+            row = (student["student_id"], written, project,
+                   written + project if written and project else None)
+        rows.append((student["db_id"], row))
+    return rows
+
+
+def rows_of_student_ids(rows: list[tuple[ObjectId, tuple]], student_ids: list[str],
+                        db_ids: dict[str, ObjectId]) -> list[tuple]:
+    """The rows of final_grade_rows in the order of the student IDs.
+    Raise KeyError for the student IDs without a grades document"""
+    by_db_id = dict(rows)
+    not_found = [student_id for student_id, db_id in db_ids.items() if db_id not in by_db_id]
+    if not_found:
+        raise KeyError(f"Student IDs {not_found} have no grades in the database.")
+    return [by_db_id[db_ids[str(student_id)]] for student_id in student_ids]
@@ -0,0 +1,41 @@
+import argparse
+
+from dsl_grade_db import MongoDBStudentGrade, ensure_indexes, get_connection
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintenance commands for the grade database")
+    parser.add_argument("--database-name", default="DSL_grade_dbs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    indexes_parser = subparsers.add_parser(
+        "ensure-indexes", help="create the missing indexes and report the others")
+    indexes_parser.add_argument("--check-usage", action="store_true",
+                                help="also report the indexes never used")
+    date_keys_parser = subparsers.add_parser(
+        "migrate-date-keys", help="add the date_key to the grades stored without it")
+    date_keys_parser.add_argument("--batch-size", type=int, default=1000)
+    subparsers.add_parser("rebuild-summaries",
+                          help="compute the summary fields of all the students")
+    args = parser.parse_args()
+
+    connection = get_connection()
+    db = connection.get_database(args.database_name)
+    if args.command == "ensure-indexes":
+        report = ensure_indexes(db, check_usage=args.check_usage)
+        for outcome, indexes in report.items():
+            for index in indexes:
+                print(f"{outcome}: {index}")
+    elif args.command == "migrate-date-keys":
+        student_db = MongoDBStudentGrade(database_name=args.database_name,
+                                         connection=connection)
+        counts = student_db.migrate_date_keys(batch_size=args.batch_size)
+        print(f"migrated {counts['students']} students in {counts['batches']} batches")
+    elif args.command == "rebuild-summaries":
+        student_db = MongoDBStudentGrade(database_name=args.database_name,
+                                         connection=connection)
+        print(f"updated {student_db.rebuild_summaries()} students")
+    connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import argparse
+
+from dsl_grade_db.data_ingestor import ParallelIngestion
+from dsl_grade_db.mongo_db_connection import BACKENDS
+from dsl_grade_db.pipeline import STAGES, SessionPipeline, format_report
+
+# the stages can also be selected with the number of their script
+STAGE_NUMBERS = {f"{number:02d}": stage for number, stage in enumerate(STAGES, start=1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run the stages of a grading session (the 01-06 scripts) in one process")
+    parser.add_argument("stages", nargs="*", default=STAGES,
+                        help=f"the stages to run, by name or number: {STAGE_NUMBERS}")
+    parser.add_argument("--database-name", default="DSL_grade_dbs")
+    parser.add_argument("--host", default=None)
+    parser.add_argument("--backend", choices=BACKENDS, default=None,
+                        help="the storage backend (default: DSL_GRADE_DB_BACKEND or mongodb)")
+    parser.add_argument("--enrolled", help="the enrolled students csv file (01)")
+    parser.add_argument("--written", help="the written exams csv file (02)")
+    parser.add_argument("--teams", help="the teams csv file (03)")
+    parser.add_argument("--leaderboard", help="the leaderboard csv file (03)")
+    parser.add_argument("--report", help="the report grades csv file (05)")
+    parser.add_argument("--threshold", type=float, default=15)
+    parser.add_argument("--to-correct-file", default="students_id_to_correct.txt")
+    parser.add_argument("--final-grade-file", default="students_final_grade.ndjson")
+    parser.add_argument("--format", choices=["ndjson", "csv"], default="ndjson")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="ingest with this number of threads (0: one bulk write)")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    ingestion = ParallelIngestion(args.workers, args.chunk_size) if args.workers else None
+    with SessionPipeline(database_name=args.database_name, host=args.host,
+                         enrolled_csv_file_path=args.enrolled,
+                         written_csv_file_path=args.written,
+                         teams_csv_file_path=args.teams,
+                         leaderboard_csv_file_path=args.leaderboard,
+                         report_csv_file_path=args.report,
+                         threshold=args.threshold,
+                         students_id_to_correct_file=args.to_correct_file,
+                         students_final_grade_file=args.final_grade_file,
+                         file_format=args.format,
+                         ingestion=ingestion,
+                         backend=args.backend) as pipeline:
+        report = pipeline.run([STAGE_NUMBERS.get(stage, stage) for stage in args.stages])
+    print(format_report(report))
+
+
+if __name__ == "__main__":
+    main()
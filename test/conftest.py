@@ -0,0 +1,50 @@
+import os
+
+import pytest
+from pymongo.errors import PyMongoError
+
+from dsl_grade_db.dsl_student_id_database import clear_student_id_caches
+from dsl_grade_db.mongo_db_connection import MongoDBConnection
+
+# the tests run on the in-memory engine, DSL_GRADE_DB_BACKEND=mongodb runs them on the
+# MongoDB server of localhost
+os.environ.setdefault("DSL_GRADE_DB_BACKEND", "memory")
+
+
+@pytest.fixture(autouse=True)
+def student_id_caches():
+    """The tests drop the collections directly, bypassing the student ID caches"""
+    clear_student_id_caches()
+    yield
+    clear_student_id_caches()
+
+
+def pytest_configure(config):
+    config.addinivalue_line(
+        "markers", "mongodb: runs on the MongoDB server of localhost whatever the backend, "
+                   "skipped if the server is not reachable (pytest -m mongodb)")
+
+
+@pytest.fixture(scope="session")
+def mongodb_connection():
+    """Connection to the MongoDB server of localhost, for the mongodb tests: what the
+    in-memory engine cannot prove, e.g. that the server accepts the update pipelines"""
+    connection = MongoDBConnection(backend="mongodb", serverSelectionTimeoutMS=2000)
+    try:
+        connection.client.admin.command("ping")
+    except PyMongoError as error:
+        connection.close()
+        pytest.skip(f"MongoDB server not reachable: {error}")
+    yield connection
+    connection.close()
+
+
+@pytest.fixture(params=["default", pytest.param("mongodb", marks=pytest.mark.mongodb)])
+def backend(request, monkeypatch):
+    """The backend of the query and ingestion tests (pytestmark of their modules): the
+    default one, and the MongoDB server of localhost with the mongodb marker, so that
+    the update pipelines and the bulk writes also run on a real server"""
+    if request.param == "mongodb":
+        request.getfixturevalue("mongodb_connection")
+        monkeypatch.setenv("DSL_GRADE_DB_BACKEND", "mongodb")
+    return request.param
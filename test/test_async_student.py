@@ -0,0 +1,155 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from dsl_grade_db import AsyncMongoDBStudentGrade, AsyncMongoDBStudentId, \
+    MongoDBConnection
+from dsl_grade_db.student_grade_queries import push_written_grade_request
+
+pytestmark = pytest.mark.usefixtures("backend")
+
+STUDENTS = [{"MATRICOLA": student_id, "NOME": "Simone",
+             "COGNOME - (*) Inserito dal docente": "Papicchio"}
+            for student_id in ["123", "122", "121"]]
+
+
+def run(scenario):
+    """Run the scenario with the asyncio API of a new connection, closed at the end:
+    each motor client is bound to the event loop of asyncio.run"""
+
+    async def main():
+        connection = MongoDBConnection()
+        db = AsyncMongoDBStudentGrade(database_name="DSL_grade_test",
+                                      connection=connection)
+        try:
+            await db.db_id.add_student_ids(STUDENTS)
+            await db.db_id.set_project_id("1/3/2021")
+            await db.insert_students(STUDENTS)
+            return await scenario(db)
+        finally:
+            await db.collection.drop()
+            await db.db_id.collection.drop()
+            connection.close()
+
+    return asyncio.run(main())
+
+
+def written(date, grade):
+    return {"date": date, "date_key": datetime.strptime(date, "%d/%m/%Y"),
+            "grade": grade, "written_info": {}}
+
+
+def project(project_id, **grades):
+    return {"project_id": project_id,
+            "date_key": datetime.strptime(project_id, "%d/%m/%Y"),
+            "final_grade": sum(grades.values()), **grades}
+
+
+def test_async_student_id():
+    async def scenario(db):
+        student_ids = AsyncMongoDBStudentId(database_name="DSL_grade_test",
+                                            connection=db.connection)
+        db_ids, missing = await student_ids.get_db_ids_from(["123", "122", "999"])
+        assert missing == ["999"]
+        assert await student_ids.get_db_id_from("123") == db_ids["123"]
+        assert await student_ids.get_student_id_from(db_ids["122"]) == "122"
+        await student_ids.update_student_id("123", "124")
+        with pytest.raises(KeyError):
+            await student_ids.get_db_id_from("123")
+        assert await student_ids.get_db_id_from("124") == db_ids["123"]
+        assert await student_ids.get_project_id() == "1/3/2021"
+
+    run(scenario)
+
+
+def test_async_grades():
+    async def scenario(db):
+        assert await db.push_written_grade("123", written("08/09/2021", 20))
+        # same date, not appended
+        assert not await db.push_written_grade("123", written("08/09/2021", 25))
+        assert await db.upsert_project_grade("123", project("1/3/2021", report_grade=7),
+                                             "report_grade")
+        assert await db.upsert_project_grade("123",
+                                             project("1/3/2021", leaderboard_grade=3),
+                                             "leaderboard_grade")
+        await db.push_written_grade("122", written("08/09/2021", 10))
+        await db.upsert_project_grade("122", project("1/3/2021", leaderboard_grade=2),
+                                      "leaderboard_grade")
+        assert await db.get_final_grade_given("123") == 30
+        final_grades = [grades async for grades in db.get_final_grades()]
+        assert final_grades == [("123", 20, 10, 30), ("122", 10, None, None),
+                                ("121", None, None, None)]
+        assert [grades async for grades in db.get_final_grades(["121", "123"])] == [
+            ("121", None, None, None), ("123", 20, 10, 30)]
+        await db.db_id.add_student_id({"MATRICOLA": "120"})
+        with pytest.raises(KeyError, match="120"):
+            [grades async for grades in db.get_final_grades(["120"])]
+        assert [student_id async for student_id
+                in db.iter_student_id_with_final_grade(18)] == ["123"]
+        assert await db.get_student_id_to_correct(5) == ["122"]
+        students = await db.get_students_project_session(lean=True)
+        assert [student["student_id"] for student in students] == ["123"]
+        assert "written_info" not in students[0]["written_grades"][0]
+
+    run(scenario)
+
+
+def test_async_students_have_rejected():
+    async def scenario(db):
+        for student_id in ["123", "122"]:
+            await db.update_student_written_grade(
+                student_id, [written("08/09/2021", 20), written("08/09/2020", 18)])
+            await db.update_student_project_grade(
+                student_id, [project("1/3/2021", report_grade=7, leaderboard_grade=3),
+                             project("1/3/2020", report_grade=5, leaderboard_grade=3)])
+        await db.update_students_have_rejected(["123"])
+        result = await db.update_students_have_rejected_bulk(["122", "121"])
+        assert result == {"updated": 1, "nothing_to_drop": ["121"]}
+        for student_id in ["123", "122"]:
+            student = await db.get_student(student_id)
+            assert [grade["date"] for grade in student["written_grades"]] == ["08/09/2020"]
+            assert [grade["project_id"] for grade in student["project_grades"]] \
+                   == ["1/3/2020"]
+            assert student["final_grade"] == 26
+        with pytest.raises(KeyError):
+            await db.update_students_have_rejected_bulk(["999"])
+        # enrolled without a grades document
+        await db.db_id.add_student_id({"MATRICOLA": "120"})
+        with pytest.raises(KeyError, match="120"):
+            await db.update_students_have_rejected_bulk(["122", "120"])
+
+    run(scenario)
+
+
+def test_async_invalid_input_rejected():
+    async def scenario(db):
+        with pytest.raises(ValueError):
+            await db.get_student("123", projection={"name": 1}, lean=True)
+
+        async def no_db_id(student_id):
+            return None
+
+        # same check of MongoDBStudentGrade._get_db_id_from
+        db.db_id.get_db_id_from = no_db_id
+        with pytest.raises(ValueError):
+            await db.get_final_grade_given("123")
+
+    run(scenario)
+
+
+def test_async_bulk_write_and_migrate_date_keys():
+    async def scenario(db):
+        db_ids = await db._get_db_ids_from(["123", "122"])
+        assert await db.bulk_write([]) == 0
+        # stored before the date_key
+        assert await db.bulk_write([
+            push_written_grade_request(db_ids["123"], {"date": "08/09/2021", "grade": 20}),
+            push_written_grade_request(db_ids["122"], {"date": "08/09/2021", "grade": 10}),
+        ]) == 2
+        assert await db.migrate_date_keys(batch_size=1) == {"students": 2, "batches": 2}
+        student = await db.get_student("123")
+        assert student["written_grades"][0]["date_key"] == datetime(2021, 9, 8)
+        assert await db.migrate_date_keys() == {"students": 0, "batches": 0}
+
+    run(scenario)
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+from benchmarks.cohort import CohortGenerator
+from benchmarks.run_benchmarks import benchmark_cohort, compare
+from dsl_grade_db.data_ingestor import MongoDBTeamsGrade, MongoDBWrittenGrade
+from dsl_grade_db.mongo_db_connection import get_connection
+
+
+def test_cohort_is_deterministic(tmp_path):
+    first = CohortGenerator(50, sessions=2, seed=7).write(os.path.join(tmp_path, "first"))
+    second = CohortGenerator(50, sessions=2, seed=7).write(os.path.join(tmp_path, "second"))
+    assert [session["rows"] for session in first] == [session["rows"] for session in second]
+    for first_session, second_session in zip(first, second):
+        for name, path in first_session["files"].items():
+            with open(path) as first_file, open(second_session["files"][name]) as second_file:
+                assert first_file.read() == second_file.read()
+
+
+@pytest.fixture
+def test_database():
+    yield "DSL_grade_test"
+    # the teams ingestor stores the project id of the cohort
+    get_connection().client.drop_database("DSL_grade_test")
+
+
+def test_cohort_files_are_read_by_the_ingestors(tmp_path, test_database):
+    files = CohortGenerator(50).write(str(tmp_path))[0]["files"]
+    written = MongoDBWrittenGrade(test_database, files["written"])
+    assert written.written_df["date"].eq("08/01/2023").all()
+    assert written.written_df["student_id"].astype(int).ge(300000).all()
+    teams = MongoDBTeamsGrade(test_database, files["leaderboard"], files["teams"])
+    assert len(teams._team_of_members()) > 0
+
+
+@pytest.mark.parametrize("mode", ["legacy", "bulk", "parallel"])
+def test_benchmark_cohort(mode):
+    result = benchmark_cohort(40, sessions=2, mode=mode, chunk_size=10)
+    # the students are enrolled once
+    assert result["rows"]["enrolled"] == 40
+    assert result["timings"]["enrolled"]["calls"] == 1
+    assert result["timings"]["written"]["calls"] == 2
+    assert result["timings"]["get_final_grade_given"]["calls"] == 40
+    assert all(timing["round_trips"] > 0 for timing in result["timings"].values())
+    comparison = compare({"results": [result]}, {"results": [result]})
+    assert {row["round_trips"] for row in comparison} == {1.0}
@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from dsl_grade_db.data_ingestor import IngestionJournal
+
+pytestmark = pytest.mark.usefixtures("backend")
+
+
+@pytest.fixture
+def journal():
+    journal = IngestionJournal(database_name="DSL_grade_test")
+    yield journal
+    journal.drop()
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = os.path.join(tmp_path, "written_grade.csv")
+    with open(path, "w") as file:
+        file.write("student_id,grade\n123,18\n")
+    return path
+
+
+def test_run_id_from_kind_and_content(journal, csv_file, tmp_path):
+    run = journal.start("written_grade", csv_file)
+    assert run.run_id == f"written_grade:{IngestionJournal.files_sha256(csv_file)}"
+    assert run.status == "running" and not run.applied
+    # same content in another file: same run
+    other_path = os.path.join(tmp_path, "copy.csv")
+    with open(csv_file) as source, open(other_path, "w") as copy:
+        copy.write(source.read())
+    assert journal.start("written_grade", other_path).run_id == run.run_id
+    # another kind: another run
+    assert journal.start("report_grade", csv_file).run_id != run.run_id
+
+
+def test_resume_from_the_checkpoint(journal, csv_file):
+    run = journal.start("written_grade", csv_file)
+    run.record_batch(["123", "122"], {"rows": 3, "inserted": 2})
+    run.record_batch(["121"], {"rows": 1, "inserted": 1})
+    resumed = journal.start("written_grade", csv_file)
+    assert resumed.applied == {"123", "122", "121"}
+    document = journal.get_run("written_grade", csv_file)
+    assert document["batches"] == 2
+    assert document["counts"] == {"rows": 4, "inserted": 3}
+    # one checkpoint document for each batch, not one growing array in the run
+    checkpoints = list(journal.checkpoints.find({"run_id": run.run_id}, {"_id": 0, "at": 0}))
+    assert checkpoints == [{"run_id": run.run_id, "students": ["123", "122"], "rows": 3},
+                           {"run_id": run.run_id, "students": ["121"], "rows": 1}]
+    # the checkpoints of another run are not applied
+    assert not journal.start("report_grade", csv_file).applied
+
+
+def test_finish_completes_only_without_errors(journal, csv_file):
+    run = journal.start("written_grade", csv_file)
+    counts = run.finish({"inserted": 0, "errors": [{"chunk": 0}]}, resumed=0)
+    assert counts["run_id"] == run.run_id
+    assert not journal.start("written_grade", csv_file).completed
+    run.finish({"inserted": 1, "errors": []}, resumed=0)
+    assert journal.start("written_grade", csv_file).completed
+    assert journal.get_run("written_grade", csv_file)["result"]["inserted"] == 1
@@ -0,0 +1,55 @@
+import os
+
+import pandas as pd
+import pytest
+
+from dsl_grade_db.data_ingestor import ParallelIngestion
+from dsl_grade_db.data_ingestor.mongo_db_enrolled_student import MongoDBEnrolledStudent
+
+pytestmark = pytest.mark.usefixtures("backend")
+
+
+@pytest.fixture
+def enrolled_df(tmp_path):
+    data_input = [
+        {"MATRICOLA": 123, "NOME": "John", "COGNOME - (*) Inserito dal docente": "Doe"},
+        {"MATRICOLA": 122, "NOME": "Pippo", "COGNOME - (*) Inserito dal docente": "Pluto"},
+        {"MATRICOLA": 121, "NOME": "Max", "COGNOME - (*) Inserito dal docente": "Power"},
+    ]
+    df = pd.DataFrame(data_input)
+    df.to_csv(os.path.join(tmp_path, "enrolled.csv"), index=False)
+
+
+@pytest.fixture
+def mongo_db_enrolled(enrolled_df, tmp_path):
+    db = MongoDBEnrolledStudent(
+        enrolled_students_csv_file_path=os.path.join(tmp_path, "enrolled.csv"),
+        database_name="DSL_grade_test")
+    yield db
+    db.mongo_db_student_id.collection.drop()
+    db.mongo_db_student_grade.collection.drop()
+
+
+def test_consume_file_bulk(mongo_db_enrolled):
+    # one student is already in the database
+    mongo_db_enrolled.mongo_db_student_id.add_student_id({"MATRICOLA": "123"})
+    counts = mongo_db_enrolled.consume_file_bulk()
+    assert counts == {"inserted": 2, "skipped": 1}
+    student = mongo_db_enrolled.mongo_db_student_grade.get_student("122")
+    assert student["name"] == "Pippo"
+    assert student["surname"] == "Pluto"
+    assert student["db_id"] == mongo_db_enrolled.mongo_db_student_id.get_db_id_from("122")
+    # a second ingestion of the same file does not insert anything
+    counts = mongo_db_enrolled.consume_file_bulk()
+    assert counts == {"inserted": 0, "skipped": 3}
+    assert mongo_db_enrolled.mongo_db_student_grade.collection.count_documents({}) == 3
+
+
+def test_consume_file_parallel(mongo_db_enrolled):
+    mongo_db_enrolled.mongo_db_student_id.add_student_id({"MATRICOLA": "123"})
+    counts = mongo_db_enrolled.consume_file_parallel(ParallelIngestion(max_workers=2,
+                                                                       chunk_size=1))
+    assert counts == {"inserted": 2, "skipped": 1, "chunks": 3, "errors": []}
+    student = mongo_db_enrolled.mongo_db_student_grade.get_student("122")
+    assert student["db_id"] == mongo_db_enrolled.mongo_db_student_id.get_db_id_from("122")
+    assert mongo_db_enrolled.mongo_db_student_grade.collection.count_documents({}) == 3
@@ -5,9 +5,12 @@ import pandas as pd
 import pytest
 from bson import ObjectId
 
+from dsl_grade_db.data_ingestor import IngestionJournal, ParallelIngestion
 from dsl_grade_db.data_ingestor.mongo_db_report_grade import MongoDBReportGrade
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
 
+pytestmark = pytest.mark.usefixtures("backend")
+
 
 def side_effect_func(value):
     if isinstance(value, int):
@@ -20,6 +23,12 @@ def side_effect_func(value):
         return ObjectId("6595497c6adac1c7b70c33f4")
 
 
+def batch_side_effect_func(values):
+    db_ids = {str(value): side_effect_func(value) for value in values}
+    return ({key: value for key, value in db_ids.items() if value is not None},
+            [key for key, value in db_ids.items() if value is None])
+
+
 @pytest.fixture
 def mongo_db_student_grade():
     # Create MongoDBStudentGrade with the mocked MongoDBStudentId
@@ -59,6 +68,7 @@ def mongo_db_student_grade():
             }
         ])
         mock_student_id.get_db_id_from.side_effect = side_effect_func
+        mock_student_id.get_db_ids_from.side_effect = batch_side_effect_func
         mock_student_id.get_project_id.return_value = "1/3/2023"
         db.db_id = mock_student_id
         yield db
@@ -78,6 +88,9 @@ def report_df(tmp_path):
         {"Matricola": "121",
          "Final score": 3,
          "Note": "MFCC/ZCR/RMS + PCA + SVM/RF/KNN"},
+        {"Matricola": "999",  # not enrolled
+         "Final score": 3,
+         "Note": "MFCC/ZCR/RMS + PCA + SVM/RF/KNN"},
     ]
     df = pd.DataFrame(data_input)
     df.to_csv(os.path.join(tmp_path, "report.csv"), index=False)
@@ -148,3 +161,107 @@ def test_student_one_complete_project(mongo_db_report):
     assert len(student['project_grades']) == 2
     assert student['project_grades'][-1]['report_grade'] == 3
     assert student['project_grades'][-1]['final_grade'] == 3
+
+
+def test_student_not_enrolled(mongo_db_report):
+    missing = mongo_db_report.consume_documents()
+    assert missing == ["999"]
+    student = mongo_db_report.student_coll.get_student("121")
+    assert len(student['project_grades']) == 2
+
+
+def test_consume_documents_bulk(mongo_db_report):
+    counts = mongo_db_report.consume_documents_bulk()
+    assert counts == {"updated": 3, "missing": ["999"]}
+    # the report staging collection is never used
+    assert mongo_db_report.report_coll.count_documents({}) == 0
+    # no project grades: the project is created
+    student = mongo_db_report.student_coll.get_student("123")
+    assert len(student['project_grades']) == 1
+    assert student['project_grades'][0]['report_grade'] == 8
+    assert student['project_grades'][0]['final_grade'] == 8
+    # only the leaderboard grade: the project is updated
+    student = mongo_db_report.student_coll.get_student("122")
+    assert len(student['project_grades']) == 1
+    assert student['project_grades'][0]['report_grade'] == 4
+    assert student['project_grades'][0]['final_grade'] == 7
+    # the summary fields are updated with the project, there is no written grade
+    assert student['best_project_grade'] == 7
+    assert student['final_grade'] is None
+    # a complete project of another session: the new one is appended
+    student = mongo_db_report.student_coll.get_student("121")
+    assert len(student['project_grades']) == 2
+    assert student['project_grades'][-1]['report_grade'] == 3
+    assert student['project_grades'][-1]['final_grade'] == 3
+    # the report grades are never overwritten
+    counts = mongo_db_report.consume_documents_bulk()
+    assert counts == {"updated": 0, "missing": ["999"]}
+    student = mongo_db_report.student_coll.get_student("122")
+    assert student['project_grades'][0]['final_grade'] == 7
+
+
+def test_consume_documents_parallel(mongo_db_report):
+    counts = mongo_db_report.consume_documents_parallel(ParallelIngestion(max_workers=3,
+                                                                          chunk_size=1))
+    assert counts == {"updated": 3, "missing": ["999"], "chunks": 4, "errors": []}
+    student = mongo_db_report.student_coll.get_student("122")
+    assert student['project_grades'][0]['final_grade'] == 7
+    student = mongo_db_report.student_coll.get_student("121")
+    assert len(student['project_grades']) == 2
+    # the report grades are never overwritten
+    counts = mongo_db_report.consume_documents_parallel()
+    assert counts == {"updated": 0, "missing": ["999"], "chunks": 1, "errors": []}
+
+
+def test_consume_documents_journaled_resume(mongo_db_report):
+    journal = IngestionJournal(database_name="DSL_grade_test")
+    bulk_write = mongo_db_report.student_coll.bulk_write
+    written_chunks = []
+
+    def bulk_write_then_crash(requests):
+        # the process dies after the first chunk: the other chunks are not written
+        if written_chunks:
+            raise RuntimeError("killed")
+        written_chunks.append(requests)
+        return bulk_write(requests)
+
+    with patch.object(mongo_db_report.student_coll, "bulk_write",
+                      side_effect=bulk_write_then_crash):
+        with pytest.raises(RuntimeError):
+            mongo_db_report.consume_documents_parallel(
+                ParallelIngestion(max_workers=1, chunk_size=1), journal)
+    run = journal.get_run("report_grade", mongo_db_report.report_csv_file_path)
+    assert run["status"] == "running"
+    assert journal.start("report_grade", mongo_db_report.report_csv_file_path).applied \
+        == {"123"}
+    # the new execution resumes from the checkpoint
+    counts = mongo_db_report.consume_documents_parallel(
+        ParallelIngestion(max_workers=1, chunk_size=1), journal)
+    assert counts["updated"] == 2 and counts["resumed"] == 1
+    assert counts["run_id"] == run["_id"]
+    run = journal.get_run("report_grade", mongo_db_report.report_csv_file_path)
+    assert run["status"] == "completed" and run["batches"] == 4
+    # the student not enrolled is not applied
+    assert journal.start("report_grade", mongo_db_report.report_csv_file_path).applied \
+        == {"121", "122", "123"}
+    assert run["counts"]["updated"] == 3
+    # the report of the first chunk is not assigned twice
+    student = mongo_db_report.student_coll.get_student("123")
+    assert len(student['project_grades']) == 1
+    assert student['project_grades'][0]['final_grade'] == 8
+    # a completed run writes only the students not applied yet
+    counts = mongo_db_report.consume_documents_parallel(journal=journal)
+    assert counts["updated"] == 0 and counts["resumed"] == 3 and counts["chunks"] == 1
+    assert counts["missing"] == ["999"]
+    # once enrolled, the student is written by the next execution
+    db_id = ObjectId("6595497c6adac1c7b70c33f3")
+    mongo_db_report.student_coll.collection.insert_one(
+        {"student_id": "999", "db_id": db_id, "written_grades": [], "project_grades": []})
+    mongo_db_report.student_coll.db_id.get_db_ids_from.side_effect = \
+        lambda values: ({**batch_side_effect_func(values)[0], "999": db_id}, [])
+    counts = mongo_db_report.consume_documents_parallel(journal=journal)
+    assert counts["updated"] == 1 and counts["resumed"] == 3 and counts["missing"] == []
+    assert "999" in journal.start("report_grade", mongo_db_report.report_csv_file_path).applied
+    student = mongo_db_report.student_coll.collection.find_one({"db_id": db_id})
+    assert student["project_grades"][0]["final_grade"] == 3
+    journal.drop()
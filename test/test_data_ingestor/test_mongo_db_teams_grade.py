@@ -5,9 +5,12 @@ import pandas as pd
 import pytest
 from bson import ObjectId
 
+from dsl_grade_db.data_ingestor import ParallelIngestion
 from dsl_grade_db.data_ingestor.mongo_db_teams_grade import MongoDBTeamsGrade
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
 
+pytestmark = pytest.mark.usefixtures("backend")
+
 
 def side_effect_func(value):
     if isinstance(value, int):
@@ -20,6 +23,12 @@ def side_effect_func(value):
         return ObjectId("6595497c6adac1c7b70c33f4")
 
 
+def batch_side_effect_func(values):
+    db_ids = {str(value): side_effect_func(value) for value in values}
+    return ({key: value for key, value in db_ids.items() if value is not None},
+            [key for key, value in db_ids.items() if value is None])
+
+
 @pytest.fixture
 def mongo_db_student_grade():
     # Create MongoDBStudentGrade with the mocked MongoDBStudentId
@@ -61,6 +70,7 @@ def mongo_db_student_grade():
                 }
             ])
         mock_student_id.get_db_id_from.side_effect = side_effect_func
+        mock_student_id.get_db_ids_from.side_effect = batch_side_effect_func
         db.db_id = mock_student_id
         yield db
         db.collection.drop()
@@ -116,6 +126,52 @@ def test_consume_documents_in_leaderboard(leaderboard_df, teams_df,
     db.teams_coll.drop()
 
 
+def test_consume_documents_in_leaderboard_bulk(leaderboard_df, teams_df,
+                                               tmp_path, mongo_db_student_grade):
+    db = MongoDBTeamsGrade(database_name="DSL_grade_test",
+                           leaderboard_csv_file_path=os.path.join(tmp_path,
+                                                                  "leaderboard.csv"),
+                           teams_csv_file_path=os.path.join(tmp_path, "teams.csv"))
+    db.student_coll = mongo_db_student_grade
+
+    teams = db.consume_documents_in_leaderboard_bulk()
+    assert len(teams) == 2
+    # the staging collections are never used
+    assert db.leaderboard_coll.count_documents({}) == 0
+    assert db.teams_coll.count_documents({}) == 0
+    double_team, single_team = teams
+    assert single_team["Student ID # 1"] == 121
+    assert single_team['max_lead_grade'] == 6
+    assert single_team['leaderboard_info']['rounded_points'] == 6
+    assert single_team['project_id'] == "1/3/2023"
+    assert not single_team["Student ID # 2"]
+    assert double_team["Student ID # 1"] == 123
+    assert double_team['max_lead_grade'] == 5
+    assert double_team['leaderboard_info']['matricola'] == 122
+    assert double_team['project_id'] == "1/3/2023"
+    assert double_team["Student ID # 2"] == 122
+
+
+def test_join_leaderboard_and_teams_no_submission(tmp_path, mongo_db_student_grade):
+    db = MongoDBTeamsGrade(database_name="DSL_grade_test",
+                           leaderboard_csv_file_path=os.path.join(tmp_path,
+                                                                  "leaderboard.csv"),
+                           teams_csv_file_path=os.path.join(tmp_path, "teams.csv"))
+    db.student_coll = mongo_db_student_grade
+    leaderboard = pd.DataFrame([{"matricola": 121, "rounded_points": 3}])
+    # the second team has only one student, read as NaN
+    teams = pd.DataFrame([{"Timestamp": "1/3/2023 22:17:06",
+                           "Student ID # 1": 123, "Student ID # 2": 122},
+                          {"Timestamp": "1/3/2023 22:18:06",
+                           "Student ID # 1": 121, "Student ID # 2": None}])
+    teams = db._join_leaderboard_and_teams(leaderboard, teams)
+    assert len(teams) == 2
+    # no submission for the first team
+    assert teams[0]['max_lead_grade'] == -1
+    assert 'leaderboard_info' not in teams[0]
+    assert teams[1]['max_lead_grade'] == 3
+
+
 def test_consume_documents_in_teams(leaderboard_df, teams_df,
                                     tmp_path, mongo_db_student_grade):
     db = MongoDBTeamsGrade(database_name="DSL_grade_test",
@@ -123,7 +179,8 @@ def test_consume_documents_in_teams(leaderboard_df, teams_df,
                                                                   "leaderboard.csv"),
                            teams_csv_file_path=os.path.join(tmp_path, "teams.csv"))
     db.student_coll = mongo_db_student_grade
-    db.consume_documents_in_teams()
+    assert db.consume_documents_in_teams() == []
+    assert db.teams_coll.count_documents({}) == 0
     # the first student has only one project with the leaderboard
     student_1 = mongo_db_student_grade.get_student("123")
     assert student_1["project_grades"][0]["leaderboard_grade"] == 5 \
@@ -140,3 +197,52 @@ def test_consume_documents_in_teams(leaderboard_df, teams_df,
     assert len(student_3["project_grades"]) == 2
     assert student_3["project_grades"][-1]['leaderboard_grade'] == 6 \
            and student_3["project_grades"][-1]['final_grade'] == 6
+
+
+def test_consume_documents_in_teams_bulk(leaderboard_df, teams_df,
+                                         tmp_path, mongo_db_student_grade):
+    db = MongoDBTeamsGrade(database_name="DSL_grade_test",
+                           leaderboard_csv_file_path=os.path.join(tmp_path,
+                                                                  "leaderboard.csv"),
+                           teams_csv_file_path=os.path.join(tmp_path, "teams.csv"))
+    db.student_coll = mongo_db_student_grade
+    counts = db.consume_documents_in_teams_bulk()
+    assert counts == {"updated": 3, "missing": []}
+    # the first student has only one project with the leaderboard
+    student_1 = mongo_db_student_grade.get_student("123")
+    assert student_1["project_grades"][0]["leaderboard_grade"] == 5 \
+           and student_1["project_grades"][0]['final_grade'] == 5
+    assert student_1["project_grades"][0]['project_id'] == '1/3/2023'
+    # the second student has one project with report only, it is updated
+    student_2 = mongo_db_student_grade.get_student("122")
+    assert len(student_2["project_grades"]) == 1
+    assert student_2["project_grades"][0]['leaderboard_grade'] == 5 \
+           and student_2["project_grades"][0]['final_grade'] == 10
+    assert student_2["project_grades"][0]['report_grade'] == 5
+    # the third student has already a complete project, append the new one
+    student_3 = mongo_db_student_grade.get_student("121")
+    assert len(student_3["project_grades"]) == 2
+    assert student_3["project_grades"][-1]['leaderboard_grade'] == 6 \
+           and student_3["project_grades"][-1]['final_grade'] == 6
+    # the leaderboard grade is never assigned twice
+    counts = db.consume_documents_in_teams_bulk()
+    assert counts == {"updated": 0, "missing": []}
+    student_2 = mongo_db_student_grade.get_student("122")
+    assert student_2["project_grades"][0]['final_grade'] == 10
+
+
+def test_consume_documents_in_teams_parallel(leaderboard_df, teams_df,
+                                             tmp_path, mongo_db_student_grade):
+    db = MongoDBTeamsGrade(database_name="DSL_grade_test",
+                           leaderboard_csv_file_path=os.path.join(tmp_path,
+                                                                  "leaderboard.csv"),
+                           teams_csv_file_path=os.path.join(tmp_path, "teams.csv"))
+    db.student_coll = mongo_db_student_grade
+    counts = db.consume_documents_in_teams_parallel(ParallelIngestion(max_workers=2,
+                                                                      chunk_size=2))
+    assert counts == {"updated": 3, "missing": [], "chunks": 2, "errors": []}
+    student_2 = mongo_db_student_grade.get_student("122")
+    assert len(student_2["project_grades"]) == 1
+    assert student_2["project_grades"][0]['final_grade'] == 10
+    student_3 = mongo_db_student_grade.get_student("121")
+    assert student_3["project_grades"][-1]['final_grade'] == 6
@@ -1,13 +1,17 @@
 import os
+from datetime import datetime
 from unittest.mock import patch
 
 import pandas as pd
 import pytest
 from bson import ObjectId
 
+from dsl_grade_db.data_ingestor import ParallelIngestion
 from dsl_grade_db.data_ingestor.mongo_db_written_grade import MongoDBWrittenGrade
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
 
+pytestmark = pytest.mark.usefixtures("backend")
+
 
 def side_effect_func(value):
     if value == "123":
@@ -18,6 +22,12 @@ def side_effect_func(value):
         return ObjectId("6595497c6adac1c7b70c33f4")
 
 
+def batch_side_effect_func(values):
+    db_ids = {str(value): side_effect_func(value) for value in values}
+    return ({key: value for key, value in db_ids.items() if value is not None},
+            [key for key, value in db_ids.items() if value is None])
+
+
 @pytest.fixture
 def mongo_db_student_grade():
     # Create MongoDBStudentGrade with the mocked MongoDBStudentId
@@ -55,6 +65,7 @@ def mongo_db_student_grade():
                 }
             ])
         mock_student_id.get_db_id_from.side_effect = side_effect_func
+        mock_student_id.get_db_ids_from.side_effect = batch_side_effect_func
         db.db_id = mock_student_id
         yield db
         db.collection.drop()
@@ -154,6 +165,31 @@ def test_parse_written_csv_file(written_grade_df, tmp_path):
                'D. 11 /1,50', 'D. 12 /2,00', 'D. 13 /2,00']
 
 
+def test_parse_written_csv_file_values(written_grade_df, tmp_path):
+    df = pd.read_csv(os.path.join(tmp_path, 'written_grade.csv'))
+    df = MongoDBWrittenGrade._parse_written_csv_file(df)
+    # both "12,88" and "12.88" are converted to float
+    assert df['Valutazione/20,00'].tolist() == [12.88, 12.88, 5.6]
+    assert df['D. 2 /1,50'].tolist() == [-0.23, -0.23, -0.23]
+    # missing answers
+    assert df['D. 1 /0,00'].isna().all()
+
+
+
+def test_parse_written_csv_file_rejects_missing_grade(written_grade_df, tmp_path):
+    df = pd.read_csv(os.path.join(tmp_path, 'written_grade.csv'))
+    # an attempt not graded yet
+    df.loc[1, 'Valutazione/20,00'] = "-"
+    with pytest.raises(ValueError, match="122"):
+        MongoDBWrittenGrade._parse_written_csv_file(df)
+
+def test_parse_written_csv_file_unknown_month(written_grade_df, tmp_path):
+    df = pd.read_csv(os.path.join(tmp_path, 'written_grade.csv'))
+    df.loc[0, 'Iniziato'] = "8 september 2023  09:40"
+    with pytest.raises(ValueError):
+        MongoDBWrittenGrade._parse_written_csv_file(df)
+
+
 def test_consume_written_grade(mongo_db_student_grade, written_grade_df, tmp_path):
     db = MongoDBWrittenGrade(database_name="DSL_grade_test",
                              written_csv_file_path=os.path.join(tmp_path,
@@ -182,3 +218,65 @@ def test_consume_written_grade(mongo_db_student_grade, written_grade_df, tmp_pat
     assert len(written_grades_student_3) == 1
     assert written_grades_student_3[0]['date'] == '08/09/2023'
     assert written_grades_student_3[0]['grade'] == 5.6
+
+
+def test_consume_written_grade_bulk(mongo_db_student_grade, written_grade_df, tmp_path):
+    db = MongoDBWrittenGrade(database_name="DSL_grade_test",
+                             written_csv_file_path=os.path.join(tmp_path,
+                                                                'written_grade.csv'))
+    db.student_coll = mongo_db_student_grade
+
+    counts = db.consume_documents_bulk()
+    assert counts == {"inserted": 3, "skipped": 0, "missing": []}
+    # the staging collection is never used
+    assert db.written_coll.count_documents({}) == 0
+    written_grades_student_1 = mongo_db_student_grade.get_student("123")['written_grades']
+    assert len(written_grades_student_1) == 1
+    assert written_grades_student_1[0]['date'] == '08/09/2023'
+    assert written_grades_student_1[0]['date_key'] == datetime(2023, 9, 8)
+    assert written_grades_student_1[0]['grade'] == 12.88
+    written_grades_student_2 = mongo_db_student_grade.get_student("122")['written_grades']
+    assert len(written_grades_student_2) == 2
+    assert written_grades_student_2[-1]['date'] == '08/09/2024'
+    assert written_grades_student_2[-1]['grade'] == 12.88
+    # the same exams are not inserted twice
+    counts = db.consume_documents_bulk()
+    assert counts == {"inserted": 0, "skipped": 3, "missing": []}
+    written_grades_student_3 = mongo_db_student_grade.get_student("121")['written_grades']
+    assert len(written_grades_student_3) == 1
+    assert written_grades_student_3[0]['grade'] == 5.6
+
+
+
+def test_written_grades_grouped_by_student(mongo_db_student_grade, written_grade_df, tmp_path):
+    db = MongoDBWrittenGrade(database_name="DSL_grade_test",
+                             written_csv_file_path=os.path.join(tmp_path,
+                                                                'written_grade.csv'))
+    db.student_coll = mongo_db_student_grade
+    # two more attempts of 123, one of them on a date already stored for 122
+    second = db.written_df.iloc[[0, 0]].assign(student_id=["123", "122"],
+                                               date=["20/01/2024", "08/09/2023"])
+    db.written_df = pd.concat([db.written_df, second], ignore_index=True)
+    with patch.object(mongo_db_student_grade, 'bulk_write',
+                      wraps=mongo_db_student_grade.bulk_write) as bulk_write:
+        counts = db.consume_documents_bulk()
+    # one request for each student with new exams
+    assert len(bulk_write.call_args.args[0]) == 3
+    assert counts == {"inserted": 4, "skipped": 1, "missing": []}
+    written_grades = mongo_db_student_grade.get_student("123")['written_grades']
+    assert [grade['date'] for grade in written_grades] == ['08/09/2023', '20/01/2024']
+    assert len(mongo_db_student_grade.get_student("122")['written_grades']) == 2
+
+def test_consume_written_grade_parallel(mongo_db_student_grade, written_grade_df, tmp_path):
+    db = MongoDBWrittenGrade(database_name="DSL_grade_test",
+                             written_csv_file_path=os.path.join(tmp_path,
+                                                                'written_grade.csv'))
+    db.student_coll = mongo_db_student_grade
+    # one student for each chunk
+    counts = db.consume_documents_parallel(ParallelIngestion(max_workers=2, chunk_size=1))
+    assert counts == {"inserted": 3, "skipped": 0, "missing": [], "chunks": 3, "errors": []}
+    written_grades_student_2 = mongo_db_student_grade.get_student("122")['written_grades']
+    assert len(written_grades_student_2) == 2
+    assert written_grades_student_2[-1]['date'] == '08/09/2024'
+    counts = db.consume_documents_parallel(ParallelIngestion(max_workers=2, chunk_size=1))
+    assert counts["inserted"] == 0
@@ -0,0 +1,52 @@
+import pandas as pd
+import pytest
+from pymongo.errors import BulkWriteError
+
+from dsl_grade_db.data_ingestor import ParallelIngestion
+
+pytestmark = pytest.mark.usefixtures("backend")
+
+DF = pd.DataFrame({"student_id": ["1", "2", "1", "3", "2", "4"],
+                   "grade": [1, 2, 3, 4, 5, 6]})
+
+
+def test_partition_keeps_the_rows_of_a_student_together():
+    chunks = ParallelIngestion(chunk_size=2).partition(DF, "student_id")
+    assert [chunk["student_id"].tolist() for chunk in chunks] == [
+        ["1", "1"], ["2", "2"], ["3", "4"]]
+    # the rows of a student are in the order of the file
+    assert chunks[0]["grade"].tolist() == [1, 3]
+
+
+def test_partition_chunk_larger_than_the_rows():
+    chunks = ParallelIngestion(chunk_size=100).partition(DF, "student_id")
+    assert len(chunks) == 1
+    assert chunks[0]["grade"].tolist() == DF["grade"].tolist()
+
+
+def test_run_aggregates_the_results_and_the_errors():
+    def process_chunk(chunk):
+        if "3" in chunk["student_id"].values:
+            raise BulkWriteError({"writeErrors": [], "nInserted": 0})
+        return {"rows": len(chunk), "student_ids": chunk["student_id"].unique().tolist()}
+
+    result = ParallelIngestion(max_workers=2, chunk_size=2).run(DF, "student_id",
+                                                                process_chunk)
+    assert result["chunks"] == 3
+    assert result["rows"] == 4
+    assert result["student_ids"] == ["1", "2"]
+    assert len(result["errors"]) == 1
+    assert result["errors"][0]["chunk"] == 2 and result["errors"][0]["rows"] == 2
+
+
+def test_run_raises_the_other_errors():
+    def process_chunk(chunk):
+        raise KeyError("not a database error")
+
+    with pytest.raises(KeyError):
+        ParallelIngestion().run(DF, "student_id", process_chunk)
+
+
+def test_invalid_configuration():
+    with pytest.raises(ValueError):
+        ParallelIngestion(max_workers=0)
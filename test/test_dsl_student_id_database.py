@@ -1,8 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
 import pytest
 from bson import ObjectId
 
 from dsl_grade_db.dsl_student_id_database import MongoDBStudentId
 
+pytestmark = pytest.mark.usefixtures("backend")
+
 
 # Fixture to create an instance of DSLDatabaseIdDatabase for testing
 @pytest.fixture
@@ -86,3 +91,114 @@ def test_get_student_id_from_nonexistent_id(mongo_database):
     nonexistent_db_id = ObjectId()
     with pytest.raises(KeyError):
         mongo_database.get_student_id_from(nonexistent_db_id)
+
+
+def test_add_student_ids(mongo_database):
+    """only the student IDs not yet in the database are inserted"""
+    mongo_database.add_student_id({'MATRICOLA': "123"})
+    inserted = mongo_database.add_student_ids([{'MATRICOLA': "123"},
+                                               {'MATRICOLA': 124},
+                                               {'MATRICOLA': "124"}])
+    assert inserted == 1
+    assert mongo_database.collection.count_documents({"MATRICOLA": "123"}) == 1
+    assert mongo_database.collection.count_documents({"MATRICOLA": "124"}) == 1
+    mongo_database.remove_student_id("123")
+    mongo_database.remove_student_id("124")
+
+
+def test_cache_warm(mongo_database):
+    mongo_database.add_student_ids([{'MATRICOLA': "123"}, {'MATRICOLA': "124"}])
+    mongo_database.clear_cache()
+    assert mongo_database.warm_cache() == 2
+    db_id = mongo_database.collection.find_one({"MATRICOLA": "123"})["_id"]
+    # the collection is not queried anymore
+    with patch.object(mongo_database, "collection") as mock_collection:
+        assert mongo_database.get_db_id_from("123") == db_id
+        assert mongo_database.get_student_id_from(db_id) == "123"
+        mock_collection.find_one.assert_not_called()
+
+
+def test_cache_invalidated(mongo_database):
+    mongo_database.add_student_id({'MATRICOLA': "123"})
+    db_id = mongo_database.get_db_id_from("123")
+    mongo_database.update_student_id("123", "125")
+    with pytest.raises(KeyError):
+        mongo_database.get_db_id_from("123")
+    assert mongo_database.get_student_id_from(db_id) == "125"
+    mongo_database.remove_student_id("125")
+    with pytest.raises(KeyError):
+        mongo_database.get_student_id_from(db_id)
+
+
+def test_cache_bounded(mongo_database, monkeypatch):
+    # the cache is shared by the tests using the same connection
+    monkeypatch.setattr(mongo_database.cache, "cache_size", 2)
+    mongo_database.add_student_ids([{'MATRICOLA': "121"}, {'MATRICOLA': "122"},
+                                    {'MATRICOLA': "123"}])
+    for student_id in ["121", "122", "123"]:
+        mongo_database.get_db_id_from(student_id)
+    assert len(mongo_database.cache._db_ids) == 2
+    assert len(mongo_database.cache._student_ids) == 2
+    # evicted students are still resolved from the database
+    assert mongo_database.get_db_id_from("121")
+
+
+def test_get_db_ids_from(mongo_database):
+    mongo_database.add_student_ids([{'MATRICOLA': "121"}, {'MATRICOLA': "122"}])
+    mongo_database.clear_cache()
+    db_ids, missing = mongo_database.get_db_ids_from(["121", 122, "999"])
+    assert sorted(db_ids) == ["121", "122"]
+    assert missing == ["999"]
+    student_ids, missing = mongo_database.get_student_ids_from(
+        [db_ids["121"], db_ids["122"], ObjectId()])
+    assert student_ids == {db_ids["121"]: "121", db_ids["122"]: "122"}
+    assert len(missing) == 1
+    mongo_database.remove_student_id("121")
+    mongo_database.remove_student_id("122")
+
+
+def test_get_db_ids_from_chunks(mongo_database):
+    """one query for each chunk of IDs not in the cache"""
+    mongo_database.add_student_ids([{'MATRICOLA': str(i)} for i in range(5)])
+    mongo_database.clear_cache()
+    with patch("dsl_grade_db.dsl_student_id_database.IN_QUERY_CHUNK_SIZE", 2), \
+            patch.object(mongo_database, "collection",
+                         wraps=mongo_database.collection) as collection:
+        db_ids, missing = mongo_database.get_db_ids_from([str(i) for i in range(5)])
+        assert collection.find.call_count == 3
+        # now everything is in the cache
+        mongo_database.get_db_ids_from([str(i) for i in range(5)])
+        assert collection.find.call_count == 3
+    assert len(db_ids) == 5 and not missing
+    for i in range(5):
+        mongo_database.remove_student_id(str(i))
+
+
+def test_cache_shared_by_threads(mongo_database, monkeypatch):
+    mongo_database.add_student_ids([{"MATRICOLA": str(i)} for i in range(50)])
+    monkeypatch.setattr(mongo_database.cache, "cache_size", 10)
+    mongo_database.clear_cache()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(mongo_database.get_db_ids_from,
+                                    [[str(i) for i in range(start, start + 10)]
+                                     for start in range(0, 41, 5)]))
+    assert all(not missing for _, missing in results)
+    assert len(mongo_database.cache._db_ids) == 10
+    assert len(mongo_database.cache._student_ids) == 10
+
+
+def test_cache_shared_by_the_objects(mongo_database):
+    other = MongoDBStudentId(database_name="DSL_grade_test")
+    mongo_database.add_student_ids([{"MATRICOLA": "123"}, {"MATRICOLA": "124"}])
+    db_id = other.get_db_id_from("123")
+    mongo_database.update_student_id("123", "125")
+    # invalidated by the other object
+    with pytest.raises(KeyError):
+        other.get_db_id_from("123")
+    assert other.get_student_id_from(db_id) == "125"
+    # a new student ID of the same ObjectID evicts the old one
+    other.cache.put("126", db_id)
+    assert other.cache.db_id("125") is None
+    assert MongoDBStudentId(database_name="DSL_grade_other").cache is not other.cache
+    mongo_database.remove_student_id("125")
+    mongo_database.remove_student_id("124")
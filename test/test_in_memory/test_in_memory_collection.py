@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+import pytest
+from pymongo import ASCENDING, IndexModel, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation, \
+    OperationFailure
+
+from dsl_grade_db.in_memory import AsyncInMemoryClient, InMemoryClient, InMemoryStorage
+
+
+@pytest.fixture
+def collection():
+    return InMemoryClient(storage=InMemoryStorage())["DSL_grade_test"]["student_grade"]
+
+
+@pytest.fixture
+def students(collection):
+    collection.insert_many([
+        {"student_id": "123", "written_grades": [{"date": "08/09/2023", "grade": 20}],
+         "project_grades": [{"project_id": "1/3/2023", "final_grade": 8}]},
+        {"student_id": "122", "written_grades": [{"date": "08/09/2023", "grade": 14}],
+         "project_grades": []},
+        {"student_id": "121", "written_grades": [], "project_grades": []},
+    ])
+    return collection
+
+
+def test_find_one_and_projection(students):
+    student = students.find_one({"student_id": "123"}, {"_id": 0, "student_id": 1})
+    assert student == {"student_id": "123"}
+    assert students.find_one({"student_id": "000"}) is None
+    # the documents returned are copies
+    student["student_id"] = "000"
+    assert students.count_documents({"student_id": "123"}) == 1
+
+
+def test_find_elem_match_or_lt(students):
+    query = {"written_grades": {"$elemMatch": {"date": "08/09/2023", "grade": {"$gte": 15}}}}
+    assert [student["student_id"] for student in students.find(query)] == ["123"]
+    query = {"$or": [{"written_grades": {"$size": 0}},
+                     {"written_grades.grade": {"$lt": 15}}]}
+    assert [student["student_id"] for student in students.find(query).sort("student_id")] \
+           == ["121", "122"]
+
+
+def test_update_one(students):
+    result = students.update_one({"student_id": "122", "project_grades.project_id":
+                                 {"$ne": "1/3/2023"}},
+                                 {"$push": {"project_grades": {"project_id": "1/3/2023",
+                                                               "final_grade": 6}}})
+    assert (result.matched_count, result.modified_count) == (1, 1)
+    students.update_one({"student_id": "122", "project_grades.project_id": "1/3/2023"},
+                        {"$set": {"project_grades.$.final_grade": 7}})
+    assert students.find_one({"student_id": "122"})["project_grades"] == [
+        {"project_id": "1/3/2023", "final_grade": 7}]
+    # a pipeline update
+    students.update_one({"student_id": "121"},
+                        [{"$set": {"count": {"$size": "$written_grades"}}}])
+    assert students.find_one({"student_id": "121"})["count"] == 0
+    result = students.update_one({"student_id": "000"}, {"$set": {"name": "John"}},
+                                 upsert=True)
+    assert students.find_one({"_id": result.upserted_id})["student_id"] == "000"
+
+
+def test_bulk_write(students):
+    result = students.bulk_write([
+        UpdateOne({"student_id": "123"}, {"$set": {"final_grade": 30}}),
+        UpdateOne({"student_id": "122"}, {"$set": {"final_grade": 25}}),
+        UpdateOne({"student_id": "000"}, {"$set": {"final_grade": 18}}),
+    ], ordered=False)
+    assert (result.matched_count, result.modified_count) == (2, 2)
+    assert students.count_documents({"final_grade": {"$exists": True}}) == 2
+
+
+def test_unique_hash_index(students):
+    students.create_indexes([IndexModel([("student_id", ASCENDING)], unique=True,
+                                        name="student_id_unique")])
+    assert "student_id_unique" in students.index_information()
+    with pytest.raises(DuplicateKeyError):
+        students.insert_one({"student_id": "123"})
+    with pytest.raises(BulkWriteError):
+        students.insert_many([{"student_id": "124"}, {"student_id": "121"}])
+    # the ordered insert stops at the first error
+    assert students.count_documents({"student_id": "124"}) == 1
+    # the index follows the updates
+    students.update_one({"student_id": "121"}, {"$set": {"student_id": "125"}})
+    assert students.find_one({"student_id": "121"}) is None
+    assert students.find_one({"student_id": {"$in": ["125", "000"]}})["student_id"] == "125"
+    students.insert_one({"student_id": "121"})
+
+
+def test_aggregate(students):
+    result = list(students.aggregate([
+        {"$unwind": "$written_grades"},
+        {"$group": {"_id": "$written_grades.date", "max": {"$max": "$written_grades.grade"},
+                    "students": {"$sum": 1}}},
+    ]))
+    assert result == [{"_id": "08/09/2023", "max": 20, "students": 2}]
+
+
+def test_storage_shared_by_the_clients(students):
+    storage = InMemoryStorage()
+    InMemoryClient(storage=storage)["DSL_grade_test"]["students"].insert_one({"a": 1})
+    client = InMemoryClient(storage=storage)
+    assert client["DSL_grade_test"]["students"].find_one({}, {"_id": 0}) == {"a": 1}
+    client.drop_database("DSL_grade_test")
+    assert client["DSL_grade_test"]["students"].find_one() is None
+
+
+def test_closed_client_cannot_be_used():
+    storage = InMemoryStorage()
+    client = InMemoryClient(storage=storage)
+    collection = client["DSL_grade_test"]["students"]
+    collection.insert_one({"a": 1})
+    client.close()
+    with pytest.raises(InvalidOperation):
+        collection.find_one()
+    with pytest.raises(InvalidOperation):
+        client["DSL_grade_test"]["students"].insert_one({"a": 2})
+    with pytest.raises(InvalidOperation):
+        client.list_database_names()
+    with pytest.raises(InvalidOperation):
+        client["DSL_grade_test"].command("ping")
+    # the data is left to the other clients of the storage
+    assert InMemoryClient(storage=storage)["DSL_grade_test"]["students"].count_documents(
+        {}) == 1
+
+    async def use_closed_async_client():
+        async_client = AsyncInMemoryClient(storage=storage)
+        async_client.close()
+        await async_client["DSL_grade_test"]["students"].find_one()
+
+    with pytest.raises(InvalidOperation):
+        asyncio.run(use_closed_async_client())
+
+
+def test_command():
+    database = InMemoryClient(storage=InMemoryStorage())["DSL_grade_test"]
+    assert database.command("ping") == {"ok": 1.0}
+    with pytest.raises(OperationFailure) as error:
+        database.command({"serverStatus": 1})
+    assert error.value.code == 59
+
+
+def test_partial_index_serves_the_equalities(students):
+    students.create_indexes([IndexModel(
+        [("student_id", ASCENDING)], name="student_id_unique", unique=True,
+        partialFilterExpression={"student_id": {"$exists": True}})])
+    students.insert_one({"project_id": "1/3/2023"})
+
+    def accesses():
+        stats = students.aggregate([{"$indexStats": {}}])
+        return {index["name"]: index["accesses"]["ops"] for index in stats}
+
+    assert students.find_one({"student_id": "123"})["student_id"] == "123"
+    assert [student["student_id"] for student in students.aggregate([
+        {"$match": {"student_id": {"$in": ["122", "121"]}}}, {"$sort": {"student_id": 1}}
+    ])] == ["121", "122"]
+    assert accesses()["student_id_unique"] == 2
+    # the documents outside the filter are not indexed: a null is a full scan
+    assert students.find_one({"student_id": None})["project_id"] == "1/3/2023"
+    assert accesses()["student_id_unique"] == 2
+
+
+def test_aggregate_returns_copies(students):
+    student = next(students.aggregate([{"$match": {"student_id": "123"}}]))
+    student["written_grades"][0]["grade"] = 0
+    assert students.find_one({"student_id": "123"})["written_grades"][0]["grade"] == 20
+
+
+def test_command_events_time_the_operation(students, monkeypatch):
+    class Listener:
+        def __init__(self):
+            self.succeeded_events, self.failed_events = [], []
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            self.succeeded_events.append(event)
+
+        def failed(self, event):
+            self.failed_events.append(event)
+
+    listener = Listener()
+    client = InMemoryClient(storage=InMemoryStorage(), event_listeners=[listener])
+    collection = client["DSL_grade_test"]["students"]
+    collection.insert_one({"student_id": "123"})
+    matching = type(collection)._matching
+
+    def slow_matching(*args):
+        time.sleep(0.02)
+        return matching(*args)
+
+    monkeypatch.setattr(type(collection), "_matching", slow_matching)
+    collection.find_one({"student_id": "123"})
+    assert listener.succeeded_events[-1].command_name == "find"
+    assert listener.succeeded_events[-1].duration_micros >= 20_000
+    with pytest.raises(OperationFailure):
+        client["DSL_grade_test"].command({"serverStatus": 1})
+    assert listener.failed_events[-1].command_name == "serverStatus"
+    # a write error is in the reply of a command that succeeded
+    collection.create_index("student_id", unique=True)
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"student_id": "123"})
+    assert listener.succeeded_events[-1].command_name == "insert"
+    assert len(listener.failed_events) == 1
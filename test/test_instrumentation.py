@@ -0,0 +1,73 @@
+import pandas as pd
+import pytest
+
+from dsl_grade_db import MongoDBConnection, MongoDBStudentGrade
+from dsl_grade_db.data_ingestor import MongoDBEnrolledStudent, MongoDBReportGrade
+from dsl_grade_db.instrumentation import OTHER, CommandInstrumentation
+
+
+@pytest.fixture
+def instrumentation():
+    return CommandInstrumentation()
+
+
+@pytest.fixture
+def connection(instrumentation):
+    connection = MongoDBConnection(event_listeners=[instrumentation])
+    yield connection
+    connection.client.drop_database("DSL_grade_test")
+    connection.close()
+
+
+@pytest.fixture
+def student_db(connection, tmp_path):
+    enrolled_csv_file_path = tmp_path / "enrolled.csv"
+    pd.DataFrame([{"MATRICOLA": student_id, "NOME": "John",
+                   "COGNOME - (*) Inserito dal docente": "Doe"}
+                  for student_id in [123, 122, 121]]).to_csv(enrolled_csv_file_path,
+                                                             index=False)
+    MongoDBEnrolledStudent(str(enrolled_csv_file_path), "DSL_grade_test",
+                           connection).consume_file_bulk()
+    student_db = MongoDBStudentGrade(database_name="DSL_grade_test", connection=connection)
+    student_db.db_id.set_project_id("1/3/2023")
+    return student_db
+
+
+def test_commands_attributed_to_the_outermost_method(instrumentation, student_db, tmp_path):
+    stats = instrumentation.snapshot()
+    assert stats["MongoDBEnrolledStudent.consume_file_bulk"]["commands"] > 0
+    assert "MongoDBStudentGrade.insert_students" not in stats
+
+    report_csv_file_path = tmp_path / "report.csv"
+    pd.DataFrame([{"Matricola": 123, "Final score": 8}]).to_csv(report_csv_file_path,
+                                                                index=False)
+    ingestor = MongoDBReportGrade("DSL_grade_test", str(report_csv_file_path),
+                                  student_db.connection)
+    with instrumentation.measure() as measurement:
+        ingestor.consume_documents_bulk()
+    assert list(measurement.stats) == ["MongoDBReportGrade.consume_documents_bulk"]
+    stats = measurement.stats["MongoDBReportGrade.consume_documents_bulk"]
+    assert stats["commands"] == sum(stats["by_command"].values())
+    assert stats["bytes_sent"] > 0 and stats["failures"] == 0
+
+
+def test_measure_round_trip_budget(instrumentation, student_db):
+    student_db.db_id.clear_cache()
+    with instrumentation.measure() as measurement:
+        student_db.get_final_grade_given("123")
+        student_db.get_final_grade_given("123")
+        student_db.collection.count_documents({})
+    # the second call resolves the student from the cache
+    assert measurement.round_trips("MongoDBStudentGrade.get_final_grade_given") == 3
+    assert measurement.round_trips(OTHER) == 1
+    measurement.assert_round_trips(4)
+    measurement.assert_round_trips({"MongoDBStudentGrade.get_final_grade_given": 3})
+    with pytest.raises(AssertionError, match="get_final_grade_given: 3 > 2"):
+        measurement.assert_round_trips({"MongoDBStudentGrade.get_final_grade_given": 2})
+
+    # the measurement is scoped to the block
+    with instrumentation.measure() as measurement:
+        pass
+    assert measurement.round_trips() == 0
+    instrumentation.reset()
+    assert instrumentation.snapshot() == {}
@@ -0,0 +1,67 @@
+import pytest
+from pymongo.errors import InvalidOperation
+
+from dsl_grade_db import MongoDBStudentGrade, MongoDBStudentId
+from dsl_grade_db.data_ingestor import MongoDBReportGrade
+from dsl_grade_db.mongo_db_connection import MongoDBConnection, get_connection
+
+
+def test_get_connection_is_shared():
+    assert get_connection() is get_connection()
+    assert get_connection("mongodb://localhost:27018") is not get_connection()
+
+
+def test_classes_share_the_client():
+    connection = MongoDBConnection()
+    student_grade = MongoDBStudentGrade(database_name="DSL_grade_test",
+                                        connection=connection)
+    report = MongoDBReportGrade(database_name="DSL_grade_test",
+                                report_csv_file_path="report.csv",
+                                connection=connection)
+    assert student_grade.client is connection.client
+    assert student_grade.db_id.client is connection.client
+    assert report.student_coll.client is connection.client
+    # by default the connection of the process is used
+    assert MongoDBStudentId(database_name="DSL_grade_test").client \
+           is get_connection().client
+    connection.close()
+
+
+def test_connection_reopened_after_close():
+    with MongoDBConnection() as connection:
+        db = MongoDBStudentId(database_name="DSL_grade_test", connection=connection)
+        db.add_student_id({"MATRICOLA": "123"})
+        client = connection.client
+    # closed by the context manager, a new client is created at the next use
+    db = MongoDBStudentId(database_name="DSL_grade_test", connection=connection)
+    assert db.client is not client
+    assert db.get_db_id_from("123")
+    db.collection.drop()
+    connection.close()
+
+
+def test_backend_selection(monkeypatch):
+    from dsl_grade_db.in_memory import InMemoryClient
+
+    monkeypatch.setenv("DSL_GRADE_DB_BACKEND", "memory")
+    assert isinstance(MongoDBConnection().client, InMemoryClient)
+    assert get_connection().backend == "memory"
+    assert get_connection() is not get_connection(backend="mongodb")
+    with pytest.raises(ValueError):
+        MongoDBConnection(backend="sqlite")
+    monkeypatch.setenv("DSL_GRADE_DB_BACKEND", "sqlite")
+    with pytest.raises(ValueError):
+        MongoDBConnection()
+
+
+def test_close_does_not_close_the_shared_connection():
+    first = MongoDBStudentGrade(database_name="DSL_grade_test")
+    second = MongoDBStudentGrade(database_name="DSL_grade_test")
+    first.close()
+    first.db_id.close()
+    assert second.collection.find_one({"db_id": None}) is None
+    assert second.db_id.client is get_connection().client
+    # closing the connection closes the client of all the objects using it
+    get_connection().close()
+    with pytest.raises(InvalidOperation):
+        second.collection.find_one({"db_id": None})
@@ -0,0 +1,49 @@
+import pytest
+from pymongo.errors import DuplicateKeyError
+
+from dsl_grade_db.mongo_db_connection import MongoDBConnection
+from dsl_grade_db.mongo_db_indexes import INDEXES, ensure_indexes
+
+
+@pytest.fixture
+def mongo_db():
+    connection = MongoDBConnection()
+    db = connection.get_database("DSL_grade_test")
+    yield db
+    for collection_name in INDEXES:
+        db[collection_name].drop()
+    connection.close()
+
+
+def test_ensure_indexes_idempotent(mongo_db):
+    report = ensure_indexes(mongo_db)
+    assert "student_grade.db_id_unique" in report["created"]
+    assert "enrolled_students.MATRICOLA_unique" in report["created"]
+    assert not report["present"]
+    # the second call does not create anything
+    report = ensure_indexes(mongo_db)
+    assert not report["created"]
+    assert "student_grade.db_id_unique" in report["present"]
+    assert "student_grade.project_grades_project_id_report_grade" in report["present"]
+
+
+def test_ensure_indexes_only_some_collections(mongo_db):
+    report = ensure_indexes(mongo_db, collections=["teams_grade"])
+    assert sorted(report["created"]) == ["teams_grade.student_id_1",
+                                         "teams_grade.student_id_2"]
+
+
+def test_ensure_indexes_report_unexpected(mongo_db):
+    mongo_db["student_grade"].create_index("name", name="old_name_index")
+    report = ensure_indexes(mongo_db)
+    assert report["unexpected"] == ["student_grade.old_name_index"]
+
+
+def test_enrolled_students_unique(mongo_db):
+    ensure_indexes(mongo_db)
+    collection = mongo_db["enrolled_students"]
+    collection.insert_one({"MATRICOLA": "123"})
+    with pytest.raises(DuplicateKeyError):
+        collection.insert_one({"MATRICOLA": "123"})
+    # the project id document does not have the MATRICOLA
+    collection.insert_one({"project_id": "project_id", "id": "1/3/2023"})
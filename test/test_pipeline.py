@@ -0,0 +1,89 @@
+import json
+import os
+
+import pandas as pd
+import pytest
+
+from dsl_grade_db.data_ingestor import ParallelIngestion
+from dsl_grade_db.pipeline import STAGES, SessionPipeline, format_report
+
+QUESTIONS = ['D. 1 /0,00', 'D. 2 /1,50', 'D. 3 /1,50', 'D. 4 /1,50', 'D. 5 /1,50',
+             'D. 6 /2,50', 'D. 7 /1,50', 'D. 8 /1,50', 'D. 9 /1,50', 'D. 10 /1,50',
+             'D. 11 /1,50', 'D. 12 /2,00', 'D. 13 /2,00']
+
+
+@pytest.fixture
+def session_files(tmp_path):
+    files = {name: os.path.join(tmp_path, f"{name}.csv")
+             for name in ["enrolled", "written", "teams", "leaderboard", "report"]}
+    pd.DataFrame([{"MATRICOLA": student_id, "NOME": "John",
+                   "COGNOME - (*) Inserito dal docente": "Doe"}
+                  for student_id in [123, 122, 121]]).to_csv(files["enrolled"], index=False)
+    pd.DataFrame([{"Username": f"01twzsm0_it_23_p1070_s{student_id}",
+                   "Iniziato": "8 settembre 2023  09:40", "Valutazione/20,00": grade,
+                   **{question: "1,00" for question in QUESTIONS}}
+                  for student_id, grade in [(123, "20,00"), (122, "18,00"), (121, "10,00")]]
+                 ).to_csv(files["written"], index=False)
+    pd.DataFrame([{"Timestamp": "1/3/2023 22:17:06", "Student ID # 1": 123,
+                   "Student ID # 2": 122}]).to_csv(files["teams"], index=False)
+    pd.DataFrame([{"matricola": 123, "rounded_points": 4},
+                  {"matricola": 121, "rounded_points": 6}]
+                 ).to_csv(files["leaderboard"], index=False)
+    pd.DataFrame([{"Matricola": 123, "Final score": 8},
+                  {"Matricola": 122, "Final score": 7}]).to_csv(files["report"], index=False)
+    return files
+
+
+@pytest.fixture
+def pipeline(session_files, tmp_path):
+    pipeline = SessionPipeline(
+        database_name="DSL_grade_test",
+        enrolled_csv_file_path=session_files["enrolled"],
+        written_csv_file_path=session_files["written"],
+        teams_csv_file_path=session_files["teams"],
+        leaderboard_csv_file_path=session_files["leaderboard"],
+        report_csv_file_path=session_files["report"],
+        students_id_to_correct_file=os.path.join(tmp_path, "to_correct.txt"),
+        students_final_grade_file=os.path.join(tmp_path, "final_grade.ndjson"))
+    yield pipeline
+    pipeline.connection.client.drop_database("DSL_grade_test")
+    pipeline.close()
+
+
+def test_run_all_the_stages(pipeline):
+    report = pipeline.run()
+    assert [stage["stage"] for stage in report] == STAGES
+    rows = {stage["stage"]: stage["rows"] for stage in report}
+    assert rows == {"enrolled": 3, "written": 3, "teams": 3, "to_correct": 2,
+                    "report": 2, "final_grades": 2}
+    assert all(stage["round_trips"] > 0 and stage["seconds"] >= 0 for stage in report)
+    # the round trips are the commands attributed by the instrumentation
+    stats = pipeline.instrumentation.snapshot()
+    assert sum(method["commands"] for method in stats.values()) \
+           == sum(stage["round_trips"] for stage in report)
+    assert "MongoDBEnrolledStudent.consume_file_bulk" in stats
+    with open(pipeline.students_id_to_correct_file) as file:
+        assert sorted(file.read().split("\n")) == ["122", "123"]
+    with open(pipeline.students_final_grade_file) as file:
+        final_grades = {student["student_id"]: student["final_grade"]
+                        for student in map(json.loads, file)}
+    assert final_grades == {"123": 32, "122": 29}
+    assert "total" in format_report(report)
+
+
+def test_run_a_subset_of_the_stages(pipeline):
+    pipeline.run(["enrolled"])
+    # the cache is warmed by the first stage resolving the students
+    pipeline.student_db.db_id.clear_cache()
+    pipeline.ingestion = ParallelIngestion(max_workers=2, chunk_size=1)
+    report = pipeline.run(["written", "enrolled"])
+    assert [stage["stage"] for stage in report] == ["enrolled", "written"]
+    assert report[1]["result"]["chunks"] == 3
+    with pytest.raises(ValueError):
+        pipeline.run(["unknown"])
+
+
+def test_missing_input_file(pipeline):
+    pipeline.files["report"] = None
+    with pytest.raises(ValueError):
+        pipeline.run(["report"])
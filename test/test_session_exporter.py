@@ -0,0 +1,76 @@
+import csv
+import json
+import os
+from datetime import datetime
+from unittest.mock import patch
+
+import pytest
+from bson import ObjectId
+
+from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
+from dsl_grade_db.session_exporter import export_students_project_session, to_json
+
+DB_ID = ObjectId("626bccb9697a12204fb22221")
+
+
+@pytest.fixture
+def mongo_db_student_grade():
+    with patch('dsl_grade_db.mongo_db_student_grade.MongoDBStudentId') as mock_student_id:
+        db = MongoDBStudentGrade(database_name="DSL_grade_test")
+        mock_student_id.get_project_id.return_value = "1/3/2023"
+        db.db_id = mock_student_id
+        db.collection.insert_many([
+            {"student_id": "111", "db_id": DB_ID, "name": "John", "surname": "Doe",
+             "written_grades": [{"date": "08/09/2023", "date_key": datetime(2023, 9, 8),
+                                 "grade": 20, "written_info": {"D. 1 /0,00": float("nan")}}],
+             "project_grades": [{"project_id": "1/3/2023", "report_grade": 4,
+                                 "leaderboard_grade": 3, "final_grade": 7,
+                                 "report_info": {"Matricola": 111}}],
+             "last_written_grade": 20, "best_project_grade": 7, "final_grade": 27},
+            # not in the session
+            {"student_id": "222", "db_id": ObjectId("626bccb9697a12204fb22222"),
+             "written_grades": [], "project_grades": []},
+        ])
+        yield db
+        db.collection.drop()
+        db.close()
+
+
+def test_to_json_bson_values():
+    document = json.loads(to_json({"_id": DB_ID, "date": datetime(2023, 9, 8),
+                                   "grade": float("nan"), "grades": [{"a": 1}]}))
+    assert document == {"_id": str(DB_ID), "date": "2023-09-08T00:00:00",
+                        "grade": None, "grades": [{"a": 1}]}
+
+
+def test_export_ndjson(mongo_db_student_grade, tmp_path):
+    path = os.path.join(tmp_path, "students.ndjson")
+    count = export_students_project_session(mongo_db_student_grade, path, batch_size=1)
+    assert count == 1
+    with open(path) as file:
+        students = [json.loads(line) for line in file]
+    assert len(students) == 1
+    assert students[0]["db_id"] == str(DB_ID)
+    assert students[0]["written_grades"][0]["written_info"] == {"D. 1 /0,00": None}
+
+
+def test_export_lean_csv(mongo_db_student_grade, tmp_path):
+    path = os.path.join(tmp_path, "students.csv")
+    count = export_students_project_session(
+        mongo_db_student_grade, path, file_format="csv", lean=True,
+        fields=["student_id", "final_grade", "project_grades"])
+    assert count == 1
+    with open(path, newline="") as file:
+        rows = list(csv.DictReader(file))
+    assert rows[0]["student_id"] == "111"
+    assert rows[0]["final_grade"] == "27"
+    # the raw csv rows are not exported
+    assert json.loads(rows[0]["project_grades"]) == [
+        {"project_id": "1/3/2023", "report_grade": 4, "leaderboard_grade": 3,
+         "final_grade": 7}]
+
+
+def test_export_unknown_format(mongo_db_student_grade, tmp_path):
+    with pytest.raises(ValueError):
+        export_students_project_session(mongo_db_student_grade,
+                                        os.path.join(tmp_path, "students.xml"), "xml")
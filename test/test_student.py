@@ -1,9 +1,14 @@
+from datetime import datetime
 from unittest.mock import patch
 
 import pytest
 from bson import ObjectId
 
+from dsl_grade_db.date_keys import date_key_expression, entry_date_key
 from dsl_grade_db.mongo_db_student_grade import MongoDBStudentGrade
+from dsl_grade_db.student_grade_queries import max_written_grade
+
+pytestmark = pytest.mark.usefixtures("backend")
 
 OBJECT_ID = ObjectId("626bccb9697a12204fb22ea3")
 DOCUMENT = {"db_id": OBJECT_ID,
@@ -29,7 +34,7 @@ def mongo_db_student_grade():
         db.db_id = mock_student_id
         yield db
         db.collection.drop()
-        db.client.close()
+        db.close()
 
 
 @patch('dsl_grade_db.dsl_student_id_database.MongoDBStudentId')
@@ -119,6 +124,9 @@ def test_get_student_id_to_correct(mock_id, mongo_db_student_grade):
 
     students_to_correct = mongo_db_student_grade.get_student_id_to_correct(threshold=21)
     assert not students_to_correct
+    # the student IDs come from the aggregation, they are not resolved from the db_ids
+    mock_id.get_student_id_from.assert_not_called()
+    mock_id.get_student_ids_from.assert_not_called()
 
 
 @patch('dsl_grade_db.dsl_student_id_database.MongoDBStudentId')
@@ -175,3 +183,249 @@ def test_get_students(mock_id, mongo_db_student_grade, ):
     # only the second returned because it has both leaderboard and report grade
     # for the current project id = 1
     assert students[0]["student_id"] == student_ids[1]
+
+
+def test_iter_student_id_to_correct_last_written(mongo_db_student_grade):
+    """the last written grade is considered, not the max"""
+    mongo_db_student_grade.collection.insert_many([
+        {"student_id": "111",
+         "db_id": ObjectId("626bccb9697a12204fb22221"),
+         "written_grades": [{"date": "08/09/2023", "grade": 20},
+                            {"date": "20/01/2024", "grade": 8}],
+         "project_grades": [{"project_id": 1, "leaderboard_grade": 0, "final_grade": 0}]},
+        {"student_id": "222",
+         "db_id": ObjectId("626bccb9697a12204fb22222"),
+         "written_grades": [{"date": "20/01/2024", "grade": 18},
+                            {"date": "08/09/2023", "grade": 8}],
+         "project_grades": [{"project_id": 1, "leaderboard_grade": 0, "final_grade": 0}]},
+        {"student_id": "333",  # no written grade
+         "db_id": ObjectId("626bccb9697a12204fb22223"),
+         "written_grades": [],
+         "project_grades": [{"project_id": 1, "leaderboard_grade": 0, "final_grade": 0}]},
+    ])
+    students_to_correct = mongo_db_student_grade.iter_student_id_to_correct(threshold=10)
+    assert list(students_to_correct) == ["222"]
+
+
+def test_migrate_date_keys(mongo_db_student_grade):
+    mongo_db_student_grade.collection.insert_many([
+        {"student_id": "111",
+         "db_id": ObjectId("626bccb9697a12204fb22221"),
+         "written_grades": [{"date": "08/09/2023", "grade": 20},
+                            {"date": "20/01/2024", "grade": 8}],
+         "project_grades": [{"project_id": "1/3/2023", "final_grade": 0}]},
+        {"student_id": "222",
+         "db_id": ObjectId("626bccb9697a12204fb22222"),
+         "written_grades": [{"date": "20/01/2024", "grade": 18,
+                             "date_key": datetime(2024, 1, 20)}],
+         "project_grades": [{"project_id": 1, "final_grade": 0}]},
+        {"student_id": "333",  # already migrated
+         "db_id": ObjectId("626bccb9697a12204fb22223"),
+         "written_grades": [],
+         "project_grades": []},
+    ])
+    counts = mongo_db_student_grade.migrate_date_keys(batch_size=1)
+    assert counts == {"students": 2, "batches": 2}
+    student = mongo_db_student_grade.collection.find_one({"student_id": "111"})
+    assert [written["date_key"] for written in student["written_grades"]] == [
+        datetime(2023, 9, 8), datetime(2024, 1, 20)]
+    assert student["project_grades"][0]["date_key"] == datetime(2023, 3, 1)
+    # the project id is not a date
+    student = mongo_db_student_grade.collection.find_one({"student_id": "222"})
+    assert student["project_grades"][0]["date_key"] is None
+    # nothing left to migrate
+    assert mongo_db_student_grade.migrate_date_keys() == {"students": 0, "batches": 0}
+
+
+def test_max_written_grade_uses_date_key():
+    written_grades = [{"date": "08/09/2023", "date_key": datetime(2023, 9, 8), "grade": 20},
+                      {"date": "20/01/2024", "grade": 8}]
+    assert max_written_grade(written_grades) == 8
+
+
+
+def test_date_key_of_a_project_id_not_a_date(mongo_db_student_grade):
+    project_grades = [{"project_id": "1/3/2023", "final_grade": 5},
+                      {"project_id": "project-1", "final_grade": 6},
+                      {"project_id": "a/b/c", "final_grade": 7},
+                      {"project_id": "extra", "date_key": None, "final_grade": 8}]
+    mongo_db_student_grade.collection.insert_one(
+        {"student_id": "111", "db_id": OBJECT_ID, "written_grades": [],
+         "project_grades": project_grades})
+    keys = [entry_date_key(project, "project_id") for project in project_grades]
+    assert keys == [datetime(2023, 3, 1), None, None, None]
+    # the same keys on the server
+    server_keys = mongo_db_student_grade.collection.aggregate([{"$project": {
+        "_id": 0, "keys": {"$map": {"input": "$project_grades", "in": date_key_expression(
+            "$$this", "project_id")}}}}])
+    assert next(server_keys)["keys"] == keys
+    # hence the rejection drops the same project in Python and on the server
+    mongo_db_student_grade.db_id.get_db_ids_from.return_value = ({"111": OBJECT_ID}, [])
+    mongo_db_student_grade.update_students_have_rejected(["111"])
+    in_python = mongo_db_student_grade.get_student("111")["project_grades"]
+    mongo_db_student_grade.collection.update_one(
+        {"db_id": OBJECT_ID}, {"$set": {"project_grades": project_grades}})
+    mongo_db_student_grade.update_students_have_rejected_bulk(["111"])
+    on_the_server = mongo_db_student_grade.get_student("111")["project_grades"]
+    assert in_python == on_the_server
+    assert [project["project_id"] for project in on_the_server] == [
+        "project-1", "a/b/c", "extra"]
+
+def test_summary_fields_updated_with_the_grades(mongo_db_student_grade):
+    mongo_db_student_grade.collection.insert_one(
+        {"student_id": "111", "db_id": OBJECT_ID, "written_grades": [], "project_grades": []})
+    mongo_db_student_grade.update_student_written_grade(
+        "111", [{"date": "20/01/2024", "grade": 18}, {"date": "08/09/2023", "grade": 30}])
+    student = mongo_db_student_grade.collection.find_one({"db_id": OBJECT_ID})
+    assert student["last_written_grade"] == 18
+    assert student["best_project_grade"] is None
+    assert student["final_grade"] is None
+    mongo_db_student_grade.update_student_project_grade(
+        "111", [{"project_id": "1/3/2023", "report_grade": 5, "leaderboard_grade": 3,
+                 "final_grade": 8},
+                {"project_id": "1/7/2023", "report_grade": 7, "leaderboard_grade": 3,
+                 "final_grade": 10},
+                # not completed
+                {"project_id": "1/9/2023", "leaderboard_grade": 12, "final_grade": 12}])
+    student = mongo_db_student_grade.collection.find_one({"db_id": OBJECT_ID})
+    assert student["best_project_grade"] == 10
+    assert student["final_grade"] == 28
+    assert mongo_db_student_grade.get_final_grade_given("111") == 28
+    assert list(mongo_db_student_grade.iter_student_id_with_final_grade(20)) == ["111"]
+    assert list(mongo_db_student_grade.iter_student_id_with_final_grade(30)) == []
+
+
+def test_rebuild_summaries(mongo_db_student_grade):
+    document = {**DOCUMENT, "project_grades": [{"project_id": 0, "report_grade": 5,
+                                                "leaderboard_grade": 5, "final_grade": 10}]}
+    mongo_db_student_grade.collection.insert_one(document)
+    # computed from the grades before the rebuild
+    assert mongo_db_student_grade.get_final_grade_given("456") == 100
+    assert mongo_db_student_grade.rebuild_summaries() == 1
+    student = mongo_db_student_grade.collection.find_one({"db_id": OBJECT_ID})
+    assert student["last_written_grade"] == 90
+    assert student["best_project_grade"] == 10
+    assert student["final_grade"] == 100
+    # nothing changes the second time
+    assert mongo_db_student_grade.rebuild_summaries() == 0
+
+
+def test_get_final_grades(mongo_db_student_grade):
+    def batch_side_effect_func(values):
+        values = [str(value) for value in values]
+        return ({value: object_ids[value] for value in values if value in object_ids},
+                [value for value in values if value not in object_ids])
+
+    object_ids = {"111": ObjectId("626bccb9697a12204fb22221"),
+                  "222": ObjectId("626bccb9697a12204fb22222"),
+                  "333": ObjectId("626bccb9697a12204fb22223"),
+                  # enrolled, without a grades document
+                  "444": ObjectId("626bccb9697a12204fb22224")}
+    mongo_db_student_grade.db_id.get_db_ids_from.side_effect = batch_side_effect_func
+    mongo_db_student_grade.collection.insert_many([
+        {"student_id": "111", "db_id": object_ids["111"],
+         "written_grades": [], "project_grades": [],
+         "last_written_grade": 18, "best_project_grade": 10, "final_grade": 28},
+        # stored before the summary fields
+        {"student_id": "222", "db_id": object_ids["222"],
+         "written_grades": [{"date": "08/09/2023", "grade": 20}],
+         "project_grades": [{"project_id": 1, "report_grade": 4, "leaderboard_grade": 3,
+                             "final_grade": 7}]},
+        {"student_id": "333", "db_id": object_ids["333"],
+         "written_grades": [], "project_grades": [],
+         "last_written_grade": None, "best_project_grade": None, "final_grade": None},
+    ])
+    # in the order of insertion, also the students stored before the summary fields
+    expected = [("111", 18, 10, 28), ("222", 20, 7, 27), ("333", None, None, None)]
+    assert list(mongo_db_student_grade.get_final_grades()) == expected
+    assert list(mongo_db_student_grade.get_final_grades(batch_size=1)) == expected
+    # in the order of the student IDs
+    assert list(mongo_db_student_grade.get_final_grades(["333", "222", 111])) == [
+        ("333", None, None, None), ("222", 20, 7, 27), ("111", 18, 10, 28)]
+    with pytest.raises(KeyError):
+        list(mongo_db_student_grade.get_final_grades(["555"]))
+    with pytest.raises(KeyError, match="444"):
+        list(mongo_db_student_grade.get_final_grades(["111", "444"]))
+
+
+def test_get_student_lean_and_projection(mongo_db_student_grade):
+    mongo_db_student_grade.collection.insert_one(
+        {"student_id": "111", "db_id": OBJECT_ID, "name": "John Doe",
+         "written_grades": [{"date": "08/09/2023", "grade": 20, "written_info": {"a": 1}}],
+         "project_grades": [{"project_id": 1, "final_grade": 3, "report_info": {"a": 1},
+                             "team_info": {"leaderboard_info": {"a": 1}}}]})
+    student = mongo_db_student_grade.get_student("111", lean=True)
+    assert student["name"] == "John Doe"
+    assert student["written_grades"] == [{"date": "08/09/2023", "grade": 20}]
+    assert student["project_grades"] == [{"project_id": 1, "final_grade": 3}]
+    student = mongo_db_student_grade.get_student("111", projection={"_id": 0, "name": 1})
+    assert student == {"name": "John Doe"}
+    with pytest.raises(ValueError):
+        mongo_db_student_grade.get_student("111", projection={"name": 1}, lean=True)
+
+
+def test_element_updates(mongo_db_student_grade):
+    mongo_db_student_grade.collection.insert_one(
+        {"student_id": "111", "db_id": OBJECT_ID, "written_grades": [], "project_grades": []})
+    written_grade = {"date": "08/09/2023", "grade": 20, "written_info": {"D. 1 /0,00": 1}}
+    assert mongo_db_student_grade.push_written_grade("111", written_grade)
+    # only one written grade per date
+    assert not mongo_db_student_grade.push_written_grade("111", {**written_grade, "grade": 5})
+    # the project is added
+    assert mongo_db_student_grade.upsert_project_grade(
+        "111", {"project_id": "1/3/2023", "leaderboard_grade": 3, "final_grade": 3,
+                "team_info": {}}, "leaderboard_grade")
+    # the existing project is patched
+    assert mongo_db_student_grade.upsert_project_grade(
+        "111", {"project_id": "1/3/2023", "report_grade": 4, "final_grade": 4,
+                "report_info": {}}, "report_grade")
+    # the report grade is never overwritten
+    assert not mongo_db_student_grade.upsert_project_grade(
+        "111", {"project_id": "1/3/2023", "report_grade": 9, "final_grade": 9,
+                "report_info": {}}, "report_grade")
+    student = mongo_db_student_grade.collection.find_one({"db_id": OBJECT_ID})
+    assert student["written_grades"] == [written_grade]
+    assert student["project_grades"] == [
+        {"project_id": "1/3/2023", "leaderboard_grade": 3, "final_grade": 7,
+         "team_info": {}, "report_grade": 4, "report_info": {}}]
+    assert student["final_grade"] == 27
+
+
+@pytest.mark.mongodb
+def test_element_updates_on_the_server(mongodb_connection):
+    """The update pipelines of push_written_grade and upsert_project_grade, with the raw
+    csv rows and their dotted column names inside $literal, are accepted by the server"""
+    db = MongoDBStudentGrade(database_name="DSL_grade_test_server",
+                             connection=mongodb_connection)
+    try:
+        db.db_id.add_student_ids([{"MATRICOLA": "111"}])
+        db.insert_students([{"MATRICOLA": "111", "NOME": "John",
+                             "COGNOME - (*) Inserito dal docente": "Doe"}])
+        written_grade = {"date": "08/09/2023", "date_key": datetime(2023, 9, 8),
+                         "grade": 20.0,
+                         "written_info": {"D. 1 /0,00": None, "Valutazione/20,00": 20.0}}
+        assert db.push_written_grade("111", written_grade)
+        assert not db.push_written_grade("111", {**written_grade, "grade": 5.0})
+        # the push branch
+        assert db.upsert_project_grade(
+            "111", {"project_id": "1/3/2023", "date_key": datetime(2023, 3, 1),
+                    "leaderboard_grade": 3.0, "final_grade": 3.0,
+                    "team_info": {"Student ID # 1": "111", "Score. 1": 0.5}},
+            "leaderboard_grade")
+        # the patch branch
+        assert db.upsert_project_grade(
+            "111", {"project_id": "1/3/2023", "report_grade": 4.0, "final_grade": 4.0,
+                    "report_info": {"Grade. report": 4.0}}, "report_grade")
+        assert not db.upsert_project_grade(
+            "111", {"project_id": "1/3/2023", "report_grade": 9.0, "final_grade": 9.0,
+                    "report_info": {}}, "report_grade")
+        student = db.collection.find_one({"student_id": "111"}, {"_id": 0, "db_id": 0})
+        assert student["written_grades"] == [written_grade]
+        assert student["project_grades"] == [
+            {"project_id": "1/3/2023", "date_key": datetime(2023, 3, 1),
+             "leaderboard_grade": 3.0, "final_grade": 7.0,
+             "team_info": {"Student ID # 1": "111", "Score. 1": 0.5},
+             "report_grade": 4.0, "report_info": {"Grade. report": 4.0}}]
+        assert student["final_grade"] == 27.0
+    finally:
+        mongodb_connection.client.drop_database("DSL_grade_test_server")
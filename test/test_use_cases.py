@@ -1,7 +1,11 @@
+from datetime import datetime
+
 import pytest
 
 from dsl_grade_db import MongoDBStudentId, MongoDBStudentGrade
 
+pytestmark = pytest.mark.usefixtures("backend")
+
 
 @pytest.fixture
 def mongo_db_id():
@@ -100,3 +104,43 @@ def test_2sd_student_change_id(mongo_student_id):
     assert len(student["project_grades"]) == 1
     with pytest.raises(KeyError):
         mongo_student_id.get_student("123")
+
+
+# 3rd use case: the students that rejected the grade are processed in bulk
+def test_3rd_case_bulk_rejected(mongo_student_id):
+    mongo_student_id.collection.insert_many([{
+        "student_id": "123",
+        "db_id": mongo_student_id.db_id.get_db_id_from("123"),
+        "written_grades": [
+            {'date': '08/09/2021', 'grade': 5, "written_info": {}},
+            {'date': '20/01/2022', 'grade': 20, "written_info": {}},
+            {'date': '08/09/2020', 'grade': 5, "written_info": {}}],
+        "project_grades": [
+            {'project_id': "1/7/2021", 'report_grade': 10,
+             'leaderboard_grade': 3, 'final_grade': 13},
+            # the date_key is used when present
+            {'project_id': "1/3/2020", 'date_key': datetime(2020, 3, 1), 'report_grade': 7,
+             'leaderboard_grade': 3, 'final_grade': 10},
+            {'project_id': "10/12/2021", 'report_grade': 7,
+             'leaderboard_grade': 3, 'final_grade': 10}],
+    }, {
+        "student_id": "122",
+        "db_id": mongo_student_id.db_id.get_db_id_from("122"),
+        "written_grades": [],
+        "project_grades": [],
+    }])
+    counts = mongo_student_id.update_students_have_rejected_bulk(["123", "122"])
+    assert counts == {"updated": 1, "nothing_to_drop": ["122"]}
+    doc = mongo_student_id.get_student("123")
+    assert [written['date'] for written in doc["written_grades"]] == ['08/09/2021',
+                                                                     '08/09/2020']
+    assert [project['project_id'] for project in doc["project_grades"]] == ["1/7/2021",
+                                                                            "1/3/2020"]
+    assert doc["last_written_grade"] == 5
+    assert doc["final_grade"] == 18
+    with pytest.raises(KeyError):
+        mongo_student_id.update_students_have_rejected_bulk(["999"])
+    # 121 is enrolled without a grades document: nothing is written
+    with pytest.raises(KeyError, match="121"):
+        mongo_student_id.update_students_have_rejected_bulk(["123", "121"])
+    assert len(mongo_student_id.get_student("123")["written_grades"]) == 2